@@ -55,6 +55,14 @@ def analyze_tournament(base_folder):
         algo_folder = os.path.join(base_folder, algo)
         if os.path.exists(algo_folder):
             results[algo]['hparams'] = extract_hyperparameters(algo_folder)
+        else:
+            # The searches keep no algo folders, only a copy of the hyperparameters with each replay
+            for replay_folder in replay_folders:
+                hparams_path = os.path.join(base_folder, replay_folder, f'{algo}_hyperparameters.json')
+                if os.path.exists(hparams_path):
+                    with open(hparams_path) as f:
+                        results[algo]['hparams'] = json.load(f)
+                    break
     
     return results
 
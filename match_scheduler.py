@@ -0,0 +1,225 @@
+import os
+import sys
+import shutil
+import json
+import functools
+import shlex
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple, Union
+
+"""
+Runs engine games several at a time for the hyperparameter searches.
+
+Every game gets its own working directory under matches/, holding links to engine.jar and
+game-configs.json and its own replays folder, so games running at once never see each
+other's replays. The engine is started there directly instead of through
+scripts/run_match.py, which always runs it from the repository root. A game's result is
+reported as soon as its replay ends with the endStats line, while the engine is still
+shutting the algos down.
+
+A player is an algo folder, or an (algo folder, hyperparameters file) pair. For a pair the
+engine runs a launcher written into the game's working directory, which points the algo at
+its hyperparameters through the ALGO_HPARAMS environment variable, so every individual of a
+search plays from the same folder without a copy of it.
+
+The number of games run at once defaults to the MATCH_WORKERS environment variable, or a
+third of the number of cores, since every game runs an engine and two algos at once. A game
+that crashes or runs longer than GAME_TIMEOUT has no winner, and the other games go on.
+"""
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MATCHES_FOLDER = os.path.join(ROOT, 'matches')
+ENGINE_FILES = ['engine.jar', 'game-configs.json']
+# Seconds between looks at a running game's replay
+POLL_INTERVAL = 0.1
+# Seconds the engine gets to exit once the replay is complete, before it is killed
+EXIT_GRACE = 10
+# Seconds a game in run_matches may take before it is killed, well over a full game at the turn time limit
+GAME_TIMEOUT = 1200
+# Processes busy in every game: the engine and two algos, each algo simulating on its own pool
+PROCESSES_PER_GAME = 3
+# Read by python_algo_template/algo_strategy.py, see load_hparams there
+HPARAMS_ENV = 'ALGO_HPARAMS'
+
+Player = Union[str, Tuple[str, str]]
+
+def default_workers() -> int:
+    return int(os.environ.get('MATCH_WORKERS', max(1, (os.cpu_count() or 1) // PROCESSES_PER_GAME)))
+
+def run_file(algo: str) -> str:
+    # Same run file choice as scripts/run_match.py
+    name = 'run.ps1' if sys.platform.startswith('win') else 'run.sh'
+    return os.path.join(os.path.abspath(algo), name)
+
+def launch_file(workdir: str, name: str, player: Player) -> str:
+    """Returns the file the engine runs for player, writing a launcher named name into workdir if it has hyperparameters"""
+    if isinstance(player, str):
+        return run_file(player)
+    algo, hparams_path = player
+    hparams_path = os.path.abspath(hparams_path)
+    if sys.platform.startswith('win'):
+        path = os.path.join(workdir, name + '.ps1')
+        content = f'$env:{HPARAMS_ENV} = "{hparams_path}"\r\n& "{run_file(algo)}"\r\n'
+    else:
+        path = os.path.join(workdir, name + '.sh')
+        content = f'#!/bin/bash\n{HPARAMS_ENV}={shlex.quote(hparams_path)} exec {shlex.quote(run_file(algo))}\n'
+    with open(path, 'w', newline='') as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+    return path
+
+def create_workdir() -> str:
+    os.makedirs(MATCHES_FOLDER, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='match_', dir=MATCHES_FOLDER)
+    for name in ENGINE_FILES:
+        source = os.path.join(ROOT, name)
+        try:
+            os.symlink(source, os.path.join(workdir, name))
+        except OSError:
+            # No symlinks without extra rights on Windows
+            shutil.copy(source, workdir)
+    os.makedirs(os.path.join(workdir, 'replays'))
+    return workdir
+
+class ReplayWatcher:
+    """
+    Follows the replay the engine writes into a replays folder, reading only what was added
+    since the last poll, until the endStats line that ends every finished game shows up.
+    """
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.path = None
+        self.offset = 0
+        self.partial = b''
+        self.end_stats = None
+
+    def poll(self) -> Optional[str]:
+        """Returns the endStats line once it has been written in full, None until then"""
+        if self.end_stats is not None:
+            return self.end_stats
+        if self.path is None:
+            replay_files = [f for f in os.listdir(self.folder) if f.endswith('.replay')]
+            if not replay_files:
+                return None
+            self.path = os.path.join(self.folder, replay_files[0])
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        # The last line may have no newline after it, it is whole once it parses
+        for line in lines + [self.partial]:
+            if b'"endStats"' not in line:
+                continue
+            try:
+                json.loads(line)
+            except ValueError:
+                continue
+            self.end_stats = line.decode('utf-8', errors='ignore')
+        return self.end_stats
+
+def kill(process: subprocess.Popen):
+    """Kills the engine and, on POSIX, the algos it started"""
+    if sys.platform.startswith('win'):
+        process.kill()
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    process.wait()
+
+def run_game(algo1: Player, algo2: Player, replay_dir: Optional[str] = None, timeout: Optional[float] = None,
+             on_end: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Plays algo1 (player 1) against algo2 in a fresh working directory and returns the
+    winner, 1 or 2. on_end(winner) is called as soon as the replay's endStats line is
+    written, run_game returns once the engine has exited (after at most EXIT_GRACE more
+    seconds) and its replay is moved into replay_dir, if one is given. A game still running
+    after timeout seconds is killed. If the game fails, its working directory is kept for
+    its engine.log.
+    """
+    workdir = create_workdir()
+    watcher = ReplayWatcher(os.path.join(workdir, 'replays'))
+    start_time = time.time()
+    with open(os.path.join(workdir, 'engine.log'), 'w') as log:
+        run1, run2 = launch_file(workdir, 'player1', algo1), launch_file(workdir, 'player2', algo2)
+        # In a session of its own on POSIX, so that killing it takes the algos down too
+        process = subprocess.Popen(['java', '-jar', 'engine.jar', 'work', run1, run2], cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+                                   start_new_session=not sys.platform.startswith('win'))
+        try:
+            while watcher.poll() is None:
+                if process.poll() is not None:
+                    # The engine may have finished the replay right before exiting
+                    if watcher.poll() is None:
+                        raise RuntimeError(f"Engine exited with {process.returncode} before the game ended for {algo1} vs {algo2}, see {workdir}/engine.log")
+                    break
+                if timeout is not None and time.time() - start_time > timeout:
+                    raise TimeoutError(f"Game did not complete within {timeout}s, see {workdir}")
+                time.sleep(POLL_INTERVAL)
+            winner = 2 if '"winner":2' in watcher.end_stats else 1
+            if on_end is not None:
+                on_end(winner)
+            # The game is over, the engine only has its algos left to shut down
+            try:
+                process.wait(timeout=EXIT_GRACE)
+            except subprocess.TimeoutExpired:
+                kill(process)
+        except BaseException:
+            if process.poll() is None:
+                kill(process)
+            raise
+
+    if replay_dir is not None:
+        os.makedirs(replay_dir, exist_ok=True)
+        shutil.move(watcher.path, os.path.join(replay_dir, os.path.basename(watcher.path)))
+    shutil.rmtree(workdir)
+    return winner
+
+def run_matches(matches: List[Tuple[Player, Player]], workers: Optional[int] = None, replay_dirs: Optional[List[str]] = None,
+                on_result: Optional[Callable[[int, int], None]] = None, timeout: Optional[float] = GAME_TIMEOUT) -> List[Optional[int]]:
+    """
+    Plays every (algo1, algo2) pair in matches, up to workers of them at once, and returns
+    their winners in the same order. on_result(index, winner) is called the moment each game
+    ends, in the order they end, from the thread running the game but never two at once.
+    run_matches returns once every engine has exited. replay_dirs, if given, holds where
+    each game's replay goes.
+
+    A game that fails before it ends, or is still running after timeout seconds, is killed
+    and reported on stderr. Its winner is None and on_result is not called for it: a crash or a hang may be
+    the engine's as much as either algo's, so it is not counted as a forfeit by either player.
+    """
+    workers = workers or default_workers()
+    winners = [None] * len(matches)
+    lock = threading.Lock()
+
+    def report(index: int, winner: int):
+        with lock:
+            winners[index] = winner
+            if on_result is not None:
+                on_result(index, winner)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for index, (algo1, algo2) in enumerate(matches):
+            replay_dir = replay_dirs[index] if replay_dirs else None
+            futures[executor.submit(run_game, algo1, algo2, replay_dir, timeout, functools.partial(report, index))] = index
+        try:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    algo1, algo2 = matches[futures[future]]
+                    print(f"Game {futures[future]} ({algo1} vs {algo2}) failed: {e}", file=sys.stderr)
+        except BaseException:
+            # Let the running games finish but start no more
+            for future in futures:
+                future.cancel()
+            raise
+    return winners
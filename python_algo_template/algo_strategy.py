@@ -3,10 +3,12 @@ import random
 import math
 import warnings
 import sys
+import os
 from sys import maxsize
 import json
 from simulator import Simulator
 from optimizer import Optimizer
+from simulation_pool import SimulationPool
 import copy
 import time
 
@@ -23,6 +25,25 @@ Advanced strategy tips:
   the actual current map state.
 """
 
+# Names the JSON file of hyperparameters to load, or holds the JSON itself
+HPARAMS_ENV = "ALGO_HPARAMS"
+# Loaded from next to this file when HPARAMS_ENV is not set
+HPARAMS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hyperparameters.json")
+
+def load_hparams():
+    """
+    Reads the hyperparameters from HPARAMS_ENV, or else from HPARAMS_FILE if there is one,
+    so every individual of a search can be run from the same folder.
+    """
+    value = os.environ.get(HPARAMS_ENV, "").strip()
+    if value.startswith("{"):
+        return json.loads(value)
+    path = value or HPARAMS_FILE
+    if not value and not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
 class AlgoStrategy(gamelib.AlgoCore):
     def __init__(self):
         super().__init__()
@@ -30,9 +51,10 @@ class AlgoStrategy(gamelib.AlgoCore):
         random.seed(seed)
         gamelib.debug_write('Random seed: {}'.format(seed))
 
-    def on_game_start(self, config):
+    def on_game_start(self, config, hparams=None):
         """ 
         Read in config and perform any initial setup here 
+        hparams replaces the hyperparameters load_hparams finds
         """
         gamelib.debug_write('Configuring your custom algo strategy...')
         self.config = config
@@ -43,11 +65,21 @@ class AlgoStrategy(gamelib.AlgoCore):
         SCOUT = config["unitInformation"][3]["shorthand"]
         DEMOLISHER = config["unitInformation"][4]["shorthand"]
         INTERCEPTOR = config["unitInformation"][5]["shorthand"]
-        self.hparams = {}
+        self.hparams = load_hparams() if hparams is None else dict(hparams)
         MP = 1
         SP = 0
         # This is a good place to do initial setup
         self.scored_on_locations = []
+        # Wall-clock seconds per turn for the planner, well under the engine's 5s soft limit
+        self.turn_budget = self.hparams.get("turn_budget", 4.0)
+        # Seconds of the turn budget kept back for optimize_offense while defending
+        self.offense_budget = self.hparams.get("offense_budget", 1.0)
+        # Best locations from earlier turns, the optimizer simulates them first
+        self.plan_hints = {}
+        # Opt-in: simulate offense/defense candidates on a pool of worker processes
+        self.simulation_pool = None
+        if self.hparams.get("parallel_workers", 0) > 0:
+            self.simulation_pool = SimulationPool(config, self.hparams["parallel_workers"])
 
     def parse_actions(self, game_state, actions):
         for action, loc in actions:
@@ -68,6 +100,9 @@ class AlgoStrategy(gamelib.AlgoCore):
         """
         # gamelib.debug_write(turn_state)
 
+        # Anytime planning: every step below only simulates until its deadline and then goes with
+        # the best plan found so far, so the turn is submitted on time however far it got.
+        deadline = time.time() + self.turn_budget
         game_state = gamelib.GameState(self.config, turn_state)
         gamelib.debug_write('Performing turn {} of your custom algo strategy'.format(game_state.turn_number))
         gamelib.debug_write(f'Current hp: {game_state.my_health}, current mp: {game_state.get_resource(1)}, current sp: {game_state.get_resource(1)}')
@@ -115,7 +150,9 @@ class AlgoStrategy(gamelib.AlgoCore):
             game_state.submit_turn()
             return 
 
-        optimizer = Optimizer(game_state, self.hparams)
+        attacking = game_state.get_resource(1) >= self.hparams["min_attack_mp"]
+        # Defense stops early enough to leave the offense its share of the turn
+        optimizer = Optimizer(game_state, self.hparams, pool=self.simulation_pool, deadline=deadline - (self.offense_budget if attacking else 0), hints=self.plan_hints)
 
 
         base_sp = 0
@@ -126,7 +163,7 @@ class AlgoStrategy(gamelib.AlgoCore):
         self.parse_actions(game_state, optimizer.optimize_defense_mandatory(game_state.get_resource(0) - base_sp, force_upgrade_turrets=True))
 
         old = game_state.get_resource(0)
-        while game_state.get_resource(0) - base_sp >= 5:
+        while game_state.get_resource(0) - base_sp >= 5 and time.time() < optimizer.deadline:
             self.parse_actions(game_state, optimizer.optimize_defense_batch(5, force_upgrade_turrets=True))
             if old == game_state.get_resource(0): break
             old = game_state.get_resource(0)
@@ -134,7 +171,8 @@ class AlgoStrategy(gamelib.AlgoCore):
         if game_state.get_resource(0) - base_sp >= 0:
             self.parse_actions(game_state, optimizer.optimize_defense_batch(game_state.get_resource(0) - base_sp, force_upgrade_turrets=True))
 
-        if game_state.get_resource(0) >= 4 and game_state.get_resource(1) >= self.hparams["min_attack_mp"]:
+        optimizer.deadline = deadline
+        if game_state.get_resource(0) >= 4 and attacking:
             loc, shieldloc = optimizer.optimize_offense()
 
             if loc:
@@ -312,9 +350,9 @@ class AlgoStrategy(gamelib.AlgoCore):
 
     def detect_enemy_unit(self, game_state, unit_type=None, valid_x = None, valid_y = None):
         total_units = 0
-        for location in game_state.game_map:
-            if game_state.contains_stationary_unit(location):
-                for unit in game_state.game_map[location]:
+        for location, cell in game_state.game_map.occupied():
+            if any(unit.stationary for unit in cell):
+                for unit in cell:
                     if unit.player_index == 1 and (unit_type is None or unit.unit_type == unit_type) and (valid_x is None or location[0] in valid_x) and (valid_y is None or location[1] in valid_y):
                         total_units += 1
         return total_units
@@ -326,6 +364,12 @@ class AlgoStrategy(gamelib.AlgoCore):
                 filtered.append(location)
         return filtered
 
+    def on_game_end(self):
+        # The pool's workers would otherwise outlive the game
+        if self.simulation_pool is not None:
+            self.simulation_pool.close()
+            self.simulation_pool = None
+
     def on_action_frame(self, turn_string):
         """
         This is the action frame of the game. This function could be called 
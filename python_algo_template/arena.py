@@ -0,0 +1,350 @@
+import gamelib
+import contextlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from algo_strategy import AlgoStrategy
+from simulator import Simulator, DISTANCES
+
+"""
+An in-process arena: two AlgoStrategy instances play a whole game against each other
+without the engine.
+
+Every turn each strategy gets the turn string the engine would send it, with the board
+turned around for player 2 so that both see themselves at the bottom, and answers with the
+two lines GameState.submit_turn prints. The moves are checked on a GameState made from that
+same string, the way attempt_spawn, attempt_upgrade and attempt_remove check them, and the
+accepted ones are made on the arena's board, which is kept from player 1's side.
+ArenaSimulator then plays out the action phase, after which removals are refunded and
+resources handed out as the config says.
+
+The arena is meant to play the engine's game, but ArenaSimulator has only been checked
+against it where replays were at hand; python replay_check.py --arena measures how far its
+action phases drift from recorded ones. Until that is close to zero, results are a fitness
+estimate for screening hyperparameters, not a replacement for engine games.
+
+Usage, from this directory:
+	python arena.py [HPARAMS1.json] [HPARAMS2.json] [--turn-budget SECONDS]
+Both players use ../best_hyperparameters.json by default.
+"""
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(HERE, "..", "game-configs.json")
+HPARAMS_PATH = os.path.join(HERE, "..", "best_hyperparameters.json")
+
+MAX_TURNS = 100
+# Frames after which an action phase is cut off, whatever mobile units are left are removed
+MAX_FRAMES = 200
+EVENT_TYPES = ["selfDestruct", "breach", "damage", "shield", "move", "spawn", "death", "attack", "melee"]
+
+class ArenaSimulator(Simulator):
+	"""
+	Simulator for both players' mobile units at once. Every support shields each friendly group
+	once, when the group first comes within range, every mobile unit and turret fires at the
+	unit GameState.get_target picks for it, and units are taken off the board as soon as they
+	die so that no shot is wasted on them. Breaches are counted per player in damage and
+	listed in breaches as (location, damage, player_index, unit_type).
+	"""
+	def __init__(self, state : gamelib.GameState):
+		self.damage = [0, 0]
+		self.breaches = []
+		self.shielded = set() # (shield id, group id)
+		self.dying = set()
+		super().__init__(state)
+		self.by_unit = {id(unit.unit) : unit for unit in self.units}
+
+	def warmup_locations(self):
+		return sorted((x, y) for (x, y), _ in self.state.game_map.occupied())
+
+	def has_mobile_units(self):
+		return len(self.scouts) + len(self.demolishers) + len(self.interceptors) > 0
+
+	def discard(self, unit):
+		if unit not in self.dying:
+			self.dying.add(unit)
+			self.state.game_map.discard_unit(unit.unit)
+
+	def settle(self, unit):
+		# After damage, the unit's health is that of the group's weakest member still standing
+		if unit.healths is None:
+			if unit.unit.health <= 0: self.discard(unit)
+			return
+		while unit.fallen < len(unit.healths) and unit.healths[unit.fallen] <= 0:
+			unit.fallen += 1
+		if unit.fallen == len(unit.healths):
+			self.state.game_map.set_health(unit.unit, 0)
+			self.discard(unit)
+		else:
+			self.state.game_map.set_health(unit.unit, unit.healths[unit.fallen])
+
+	def hit(self, attacker, target):
+		victim = self.by_unit[id(target)]
+		if target.stationary:
+			self.state.game_map.set_health(target, target.health - attacker.damage_f)
+		else:
+			victim.healths[victim.fallen] -= attacker.damage_i
+		self.settle(victim)
+
+	def tick(self):
+		# SHIELDING
+		for shield in self.shields:
+			shield_amount = 3
+			shield_range = 2.5
+			if shield.unit.upgraded:
+				shield_amount = 2 + 0.3 * min(shield.unit.y, 27 - shield.unit.y)
+				shield_range = 6
+			for unit in self.attacking_units:
+				if unit.unit.player_index != shield.unit.player_index or (shield.id, unit.id) in self.shielded: continue
+				if (abs(unit.unit.x - shield.unit.x), abs(unit.unit.y - shield.unit.y)) in DISTANCES[shield_range]:
+					self.shielded.add((shield.id, unit.id))
+					unit.add_health(self.state.game_map, shield_amount)
+
+		# MOVEMENT and SELF DESTRUCT DMG
+		movers = sorted(self.scouts, key=lambda unit: unit.id)
+		if self.time%2 == 0:
+			movers += sorted(self.demolishers, key=lambda unit: unit.id)
+			if self.time%4 == 0:
+				movers += sorted(self.interceptors, key=lambda unit: unit.id)
+		for unit in movers:
+			location = [unit.unit.x, unit.unit.y]
+			scored = self.PLAYER_DMG
+			self.move_action(unit)
+			if self.PLAYER_DMG > scored:
+				self.damage[unit.unit.player_index] += self.PLAYER_DMG - scored
+				self.breaches.append((location, self.PLAYER_DMG - scored, unit.unit.player_index, unit.unit.unit_type))
+		for unit in self.units:
+			self.settle(unit)
+
+		# ATTACK, everything still on the board after moving fires, even if it dies before its turn comes
+		attackers = sorted(self.attacking_units.union(self.turrets).difference(self.dying), key=lambda unit: unit.id)
+		shots = [1 if unit.healths is None else len(unit.healths) - unit.fallen for unit in attackers]
+		for attacker, count in zip(attackers, shots):
+			target = None
+			for _ in range(count):
+				if target is None or target.health <= 0:
+					target = self.state.get_target(attacker.unit)
+				if target is None: break
+				self.hit(attacker.unit, target)
+
+		self.remove_dead()
+		self.time += 1
+
+	def remove_dead(self):
+		# 0HP DEATH, dead units are off the board already
+		self.modified = False
+		for unit in self.dying:
+			if unit.unit.stationary:
+				self.modified = True
+			elif unit.healths is not None:
+				unit.healths = []
+			for S in [self.scouts, self.demolishers, self.interceptors, self.shields, self.turrets, self.walls, self.attacking_units, self.units_teamed[0], self.units_teamed[1], self.units]:
+				S.discard(unit)
+		self.dying = set()
+		for unit in self.attacking_units:
+			unit.healths = [health for health in unit.healths if health > 0]
+			unit.fallen = 0
+		if self.modified:
+			self.repath()
+
+class Arena:
+	"""
+	One game between two strategies, see play. turn_budget, if given, replaces the strategies'
+	seconds per turn. The strategies' debug output is dropped unless verbose is set.
+	"""
+	def __init__(self, config, hparams1, hparams2, turn_budget=None, max_turns=MAX_TURNS, verbose=False):
+		self.config = config
+		self.verbose = verbose
+		self.max_turns = max_turns
+		self.type_index = {unit["shorthand"] : i for i, unit in enumerate(config["unitInformation"])}
+		resources = config["resources"]
+		self.health = [resources["startingHP"]] * 2
+		self.SP = [resources["startingCores"]] * 2
+		self.MP = [resources["startingBits"]] * 2
+		self.turn = 0
+		# Seconds each strategy has spent in on_turn, the engine's tie-break
+		self.compute_time = [0.0, 0.0]
+		self.state = gamelib.GameState(config, self.turn_string(None))
+
+		self.strategies = []
+		for hparams in [hparams1, hparams2]:
+			with self.quiet():
+				strategy = AlgoStrategy()
+				strategy.on_game_start(config, hparams)
+			if turn_budget is not None:
+				strategy.turn_budget = turn_budget
+			self.strategies.append(strategy)
+
+	def quiet(self):
+		return contextlib.nullcontext() if self.verbose else contextlib.redirect_stderr(io.StringIO())
+
+	def view(self, x, y, player_index):
+		# Player 2 sees the board turned around
+		return (x, y) if player_index == 0 else (27 - x, 27 - y)
+
+	def turn_string(self, player_index, phase=0, frame=-1, events=None):
+		"""
+		The turn string the engine would send player_index, or an empty board with the
+		starting resources if player_index is None.
+		"""
+		units = [[[] for _ in range(8)], [[] for _ in range(8)]]
+		if player_index is not None:
+			for (x, y), cell in self.state.game_map.occupied():
+				for unit in cell:
+					side = units[0 if unit.player_index == player_index else 1]
+					vx, vy = self.view(x, y, player_index)
+					side[self.type_index[unit.unit_type]].append([vx, vy, unit.health, str(id(unit))])
+					if unit.pending_removal:
+						side[6].append([vx, vy, 0.0, str(id(unit))])
+					if unit.upgraded:
+						side[7].append([vx, vy, 0.0, str(id(unit))])
+		players = [0, 1] if player_index != 1 else [1, 0]
+		return json.dumps({
+			"p1Units" : units[0],
+			"p2Units" : units[1],
+			"turnInfo" : [phase, self.turn, frame, 0],
+			"p1Stats" : [self.health[players[0]], self.SP[players[0]], self.MP[players[0]], 0],
+			"p2Stats" : [self.health[players[1]], self.SP[players[1]], self.MP[players[1]], 0],
+			"events" : events if events is not None else {event : [] for event in EVENT_TYPES},
+		})
+
+	def ask(self, player_index):
+		"""Runs the strategy's on_turn and returns its turn string, build list and deploy list"""
+		turn_string = self.turn_string(player_index)
+		output = io.StringIO()
+		begin = time.perf_counter()
+		with contextlib.redirect_stdout(output), self.quiet():
+			self.strategies[player_index].on_turn(turn_string)
+		self.compute_time[player_index] += time.perf_counter() - begin
+		lines = output.getvalue().splitlines()
+		return turn_string, json.loads(lines[0]), json.loads(lines[1])
+
+	def apply(self, player_index, turn_string, build, deploy):
+		"""
+		Makes the moves that are valid on player_index's own turn string on the board and
+		takes their cost from the player's resources.
+		"""
+		check = gamelib.GameState(self.config, turn_string)
+		check.suppress_warnings(True)
+		game_map = self.state.game_map
+		for unit_type, x, y in [move[:3] for move in build] + [move[:3] for move in deploy]:
+			location = list(self.view(x, y, player_index))
+			if unit_type == "RM":
+				if check.attempt_remove([x, y]):
+					game_map[location[0], location[1]][0].pending_removal = True
+			elif unit_type == "UP":
+				if check.attempt_upgrade([x, y]):
+					unit = game_map[location[0], location[1]][0]
+					max_health = unit.max_health
+					game_map.upgrade_unit(location)
+					game_map.set_health(unit, unit.health + unit.max_health - max_health)
+			elif check.attempt_spawn(unit_type, [x, y]):
+				game_map.add_unit(unit_type, location, player_index)
+		self.SP[player_index] = check.get_resource(check.SP)
+		self.MP[player_index] = check.get_resource(check.MP)
+
+	def action_phase(self):
+		sim = ArenaSimulator(self.state)
+		frames = 0
+		while sim.has_mobile_units() and frames < MAX_FRAMES:
+			sim.tick()
+			frames += 1
+		for (x, y), cell in list(self.state.game_map.occupied()):
+			for unit in list(cell):
+				if not unit.stationary:
+					self.state.game_map.discard_unit(unit)
+		return sim
+
+	def end_turn(self, sim):
+		resources = self.config["resources"]
+		for player_index in [0, 1]:
+			self.health[1 - player_index] -= sim.damage[player_index]
+			self.SP[player_index] += resources["coresForPlayerDamage"] * sim.damage[player_index]
+
+		# Structures flagged for removal go now, for part of what they cost
+		for (x, y), cell in list(self.state.game_map.occupied()):
+			for unit in list(cell):
+				if unit.stationary and unit.pending_removal:
+					refund = self.config["unitInformation"][self.type_index[unit.unit_type]].get("refundPercentage", 0)
+					self.SP[unit.player_index] += refund * unit.cost[0] * unit.health / unit.max_health
+					self.state.game_map.discard_unit(unit)
+
+		self.turn += 1
+		MP_gained = resources["bitsPerRound"] + resources["bitGrowthRate"] * (self.turn // resources["turnIntervalForBitSchedule"])
+		for player_index in [0, 1]:
+			self.SP[player_index] = round(self.SP[player_index] + resources["coresPerRound"], 1)
+			self.MP[player_index] = min(resources["maxBits"], round(self.MP[player_index] * (1 - resources["bitDecayPerRound"]) + MP_gained, 1))
+
+	def send_breaches(self, sim):
+		# One action frame per phase, with just the breaches, for the strategies' on_action_frame
+		for player_index in [0, 1]:
+			events = {event : [] for event in EVENT_TYPES}
+			for location, damage, owner, unit_type in sim.breaches:
+				events["breach"].append([list(self.view(*location, player_index)), damage, self.type_index[unit_type], "", 1 if owner == player_index else 2])
+			with self.quiet():
+				self.strategies[player_index].on_action_frame(self.turn_string(player_index, 1, 0, events))
+
+	def play(self):
+		"""
+		Plays until a player has no health left or max_turns have been played and returns the
+		winner, 1 or 2, the player with more health left. As in the engine, a tie goes to the
+		player who spent less time computing its turns.
+		"""
+		try:
+			while self.turn < self.max_turns and min(self.health) > 0:
+				moves = [self.ask(player_index) for player_index in [0, 1]]
+				for player_index in [0, 1]:
+					self.apply(player_index, *moves[player_index])
+				sim = self.action_phase()
+				self.send_breaches(sim)
+				self.end_turn(sim)
+		finally:
+			for strategy in self.strategies:
+				with self.quiet():
+					strategy.on_game_end()
+		return self.winner()
+
+	def winner(self):
+		if self.health[0] != self.health[1]:
+			return 1 if self.health[0] > self.health[1] else 2
+		return 1 if self.compute_time[0] <= self.compute_time[1] else 2
+
+def play(config, hparams1, hparams2, **kwargs):
+	"""Plays one arena game, see Arena, and returns the winner, 1 or 2"""
+	return Arena(config, hparams1, hparams2, **kwargs).play()
+
+def _play_pair(args):
+	config, hparams1, hparams2, kwargs = args
+	return play(config, hparams1, hparams2, **kwargs)
+
+def play_many(config, pairs, workers=None, **kwargs):
+	"""
+	Plays an arena game for every (hparams1, hparams2) in pairs, on up to workers processes,
+	and returns the winners in the same order.
+	"""
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		return list(executor.map(_play_pair, [(config, hparams1, hparams2, kwargs) for hparams1, hparams2 in pairs]))
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description="Play one game between two hyperparameter sets without the engine")
+	parser.add_argument("hparams", nargs="*", default=[HPARAMS_PATH, HPARAMS_PATH], help="hyperparameter files for player 1 and player 2")
+	parser.add_argument("--turn-budget", type=float, help="seconds per turn for each strategy")
+	parser.add_argument("--verbose", action="store_true", help="show the strategies' debug output")
+	args = parser.parse_args()
+
+	with open(CONFIG_PATH) as f:
+		config = json.load(f)
+	hparams = []
+	for path in (args.hparams * 2)[:2]:
+		with open(path) as f:
+			hparams.append(json.load(f))
+
+	begin = time.time()
+	arena = Arena(config, hparams[0], hparams[1], turn_budget=args.turn_budget, verbose=args.verbose)
+	winner = arena.play()
+	print(f"winner {winner} after {arena.turn} turns, health {arena.health[0]:g} to {arena.health[1]:g}, {time.time() - begin:.1f}s")
+
+if __name__ == "__main__":
+	main()
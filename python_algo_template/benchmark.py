@@ -0,0 +1,192 @@
+import gamelib
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from algo_strategy import AlgoStrategy
+from optimizer import Optimizer, ENEMY_SPAWNING_LOCATIONS
+from simulator import Simulator, spawn_candidate
+from replay_check import load_replay
+from gamelib.navigation import ShortestPathFinder
+from gamelib import native_path
+
+"""
+Times the hot paths of a turn on a corpus of real turn strings:
+
+	parse        GameState from a turn string
+	pathfinding  ShortestPathFinder from an enemy spawn location, with nothing cached
+	simulate     Simulator on one enemy scout swarm, the candidates compute_danger simulates
+	danger       Optimizer.compute_danger on a fresh optimizer, so nothing is memoized
+	on_turn      AlgoStrategy.on_turn, the whole turn
+
+Every benchmark reports milliseconds per call at the 50th, 90th and 99th percentile.
+--save writes the report to a JSON baseline, --compare flags every benchmark whose median
+is slower than the baseline's by more than --tolerance and exits with 1 if there are any.
+
+The corpus is benchmark_turns.txt, one turn string per line, as the engine sends them.
+--replays adds the deploy phase frames of .replay files to it.
+
+Usage, from this directory:
+	python benchmark.py [--repeat N] [--only NAME ...] [--replays PATH ...] [--save FILE] [--compare FILE]
+"""
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(HERE, "..", "game-configs.json")
+HPARAMS_PATH = os.path.join(HERE, "..", "best_hyperparameters.json")
+CORPUS_PATH = os.path.join(HERE, "benchmark_turns.txt")
+
+PERCENTILES = [50, 90, 99]
+# Swarm size for the simulate and danger benchmarks
+SWARM = 5
+
+def load_corpus(path=CORPUS_PATH, replays=()):
+	with open(path) as f:
+		turns = [line.strip() for line in f if line.strip()]
+	for replay in replays:
+		frames = load_replay(replay)
+		turns.extend(json.dumps(frames[key]) for key in sorted(frames) if key[1] == -1)
+	return turns
+
+def percentile(samples, q):
+	"""Nearest rank percentile of a sorted list"""
+	return samples[min(len(samples) - 1, max(0, -(-q * len(samples) // 100) - 1))]
+
+def summarize(samples):
+	samples = sorted(1000 * sample for sample in samples)
+	summary = {f"p{q}" : percentile(samples, q) for q in PERCENTILES}
+	summary["mean"] = sum(samples) / len(samples)
+	summary["calls"] = len(samples)
+	return summary
+
+def timed(function, *args):
+	begin = time.perf_counter()
+	function(*args)
+	return time.perf_counter() - begin
+
+def bench_parse(config, hparams, turn):
+	return [timed(gamelib.GameState, config, turn)]
+
+def bench_pathfinding(config, hparams, turn):
+	state = gamelib.GameState(config, turn)
+	samples = []
+	for location in ENEMY_SPAWNING_LOCATIONS:
+		if state.contains_stationary_unit(location): continue
+		edge = state.game_map.get_edges()[state.get_target_edge(location)]
+		samples.append(timed(ShortestPathFinder().navigate_multiple_endpoints, location, edge, state))
+	return samples
+
+def bench_simulate(config, hparams, turn):
+	state = gamelib.GameState(config, turn)
+	samples = []
+	for location in ENEMY_SPAWNING_LOCATIONS:
+		if state.contains_stationary_unit(location): continue
+		new_state = spawn_candidate(state, [("PI", location, SWARM, 1, 3)])
+		samples.append(timed(lambda: Simulator(new_state).simulate()))
+	return samples
+
+def bench_danger(config, hparams, turn):
+	state = gamelib.GameState(config, turn)
+	optimizer = Optimizer(state, hparams)
+	return [timed(optimizer.compute_danger, state, SWARM)]
+
+def bench_on_turn(config, hparams, turn):
+	# on_turn submits its moves on stdout and the strategy logs on stderr
+	with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+		strategy = AlgoStrategy()
+		strategy.on_game_start(config, hparams)
+		sample = timed(strategy.on_turn, turn)
+		strategy.on_game_end()
+		return [sample]
+
+BENCHMARKS = {
+	"parse" : bench_parse,
+	"pathfinding" : bench_pathfinding,
+	"simulate" : bench_simulate,
+	"danger" : bench_danger,
+	"on_turn" : bench_on_turn,
+}
+
+def run(config, hparams, turns, repeat, names=None):
+	"""
+	Runs every benchmark in names (all of them by default) repeat times over turns and
+	returns a report of their percentiles in milliseconds.
+	"""
+	report = {
+		"turns" : len(turns),
+		"repeat" : repeat,
+		"native_paths" : native_path.LIBRARY is not None,
+		"benchmarks" : {},
+	}
+	for name in names or BENCHMARKS:
+		random.seed(0)
+		samples = []
+		for _ in range(repeat):
+			for turn in turns:
+				samples.extend(BENCHMARKS[name](config, hparams, turn))
+		report["benchmarks"][name] = summarize(samples)
+	return report
+
+def regressions(report, baseline, tolerance):
+	"""
+	Returns (name, median, baseline median) for every benchmark in both reports whose median
+	grew by more than tolerance, a fraction of the baseline's.
+	"""
+	slower = []
+	for name, summary in report["benchmarks"].items():
+		if name not in baseline["benchmarks"]: continue
+		before = baseline["benchmarks"][name]["p50"]
+		if summary["p50"] > before * (1 + tolerance):
+			slower.append((name, summary["p50"], before))
+	return slower
+
+def print_report(report, baseline=None):
+	print(f"{report['turns']} turns x {report['repeat']}, native paths {'on' if report['native_paths'] else 'off'}")
+	print(f"{'':12}" + "".join(f"{'p' + str(q):>10}" for q in PERCENTILES) + f"{'mean':>10}{'calls':>8}" + (f"{'base p50':>10}" if baseline else ""))
+	for name, summary in report["benchmarks"].items():
+		line = f"{name:12}" + "".join(f"{summary['p' + str(q)]:10.3f}" for q in PERCENTILES) + f"{summary['mean']:10.3f}{summary['calls']:8}"
+		if baseline and name in baseline["benchmarks"]:
+			line += f"{baseline['benchmarks'][name]['p50']:10.3f}"
+		print(line)
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the algo's hot paths")
+	parser.add_argument("--repeat", type=int, default=5, help="times to run each benchmark over the corpus")
+	parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run, all by default")
+	parser.add_argument("--corpus", default=CORPUS_PATH, help="file of turn strings, one per line")
+	parser.add_argument("--replays", nargs="*", default=[], help=".replay files whose deploy frames are added to the corpus")
+	parser.add_argument("--save", help="write the report to this JSON file")
+	parser.add_argument("--compare", help="JSON baseline to check the report against")
+	parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown of a median, as a fraction, counted as a regression")
+	args = parser.parse_args()
+
+	with open(CONFIG_PATH) as f:
+		config = json.load(f)
+	with open(HPARAMS_PATH) as f:
+		hparams = json.load(f)
+
+	report = run(config, hparams, load_corpus(args.corpus, args.replays), args.repeat, args.only)
+	baseline = None
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+	print_report(report, baseline)
+
+	if args.save:
+		with open(args.save, "w") as f:
+			json.dump(report, f, indent=2)
+		print(f"saved to {args.save}")
+
+	if baseline:
+		slower = regressions(report, baseline, args.tolerance)
+		for name, median, before in slower:
+			print(f"REGRESSION {name}: median {median:.3f}ms, baseline {before:.3f}ms (+{100 * (median / before - 1):.0f}%)")
+		if slower:
+			sys.exit(1)
+		print(f"no regressions beyond {100 * args.tolerance:.0f}%")
+
+if __name__ == "__main__":
+	main()
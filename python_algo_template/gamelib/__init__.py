@@ -16,6 +16,8 @@ Investigating it is useful for advanced players interested in getting data from
 The Navigation class in navigation.py contains functions related to path-finding, which are used by GameState in pathing related functions. 
 Investigating it is useful for advanced player who want to optimize the slow default pathing algorithm we provide. \n 
 
+native_path.py loads the optional native pathfinding core built by rust-algo/build_pathcore.py, which navigation.py uses when it is available. \n
+
 util.py contains a small handful of functions that help with communication, including the debug-printing function, debug_write().
 """
 
@@ -25,5 +27,5 @@ from .game_state import GameState
 from .unit import GameUnit
 from .game_map import GameMap
 
-__all__ = ["algocore", "game_state", "game_map", "navigation", "unit", "util"]
+__all__ = ["algocore", "game_state", "game_map", "navigation", "native_path", "unit", "util"]
  
\ No newline at end of file
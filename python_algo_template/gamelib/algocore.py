@@ -43,6 +43,13 @@ class AlgoCore(object):
         """
         pass
 
+    def on_game_end(self):
+        """
+        This function is called once when the game engine sends the end game message,
+        right before the algo stops. Override it to release anything set up in on_game_start.
+        """
+        pass
+
 
     def start(self):
         """ 
@@ -82,6 +89,7 @@ class AlgoCore(object):
                     This is the end game message. This means the game is over so break and finish the program.
                     """
                     debug_write("Got end state, game over. Stopping algo.")
+                    self.on_game_end()
                     break
                 else:
                     """
@@ -1,4 +1,7 @@
 import math
+import copy
+import hashlib
+from collections import Counter
 from .unit import GameUnit
 from .util import debug_write
 
@@ -8,6 +11,61 @@ DISTS = {
     4.5 : [(-4, -2), (-4, -1), (-4, 0), (-4, 1), (-4, 2), (-3, -3), (-3, -2), (-3, -1), (-3, 0), (-3, 1), (-3, 2), (-3, 3), (-2, -4), (-2, -3), (-2, -2), (-2, -1), (-2, 0), (-2, 1), (-2, 2), (-2, 3), (-2, 4), (-1, -4), (-1, -3), (-1, -2), (-1, -1), (-1, 0), (-1, 1), (-1, 2), (-1, 3), (-1, 4), (0, -4), (0, -3), (0, -2), (0, -1), (0, 0), (0, 1), (0, 2), (0, 3), (0, 4), (1, -4), (1, -3), (1, -2), (1, -1), (1, 0), (1, 1), (1, 2), (1, 3), (1, 4), (2, -4), (2, -3), (2, -2), (2, -1), (2, 0), (2, 1), (2, 2), (2, 3), (2, 4), (3, -3), (3, -2), (3, -1), (3, 0), (3, 1), (3, 2), (3, 3), (4, -2), (4, -1), (4, 0), (4, 1), (4, 2)]
 }
 
+# Every location on the diamond shaped board, row by row from the bottom corner, in the order a GameMap iterates them
+CELLS = tuple((x, y) for y in range(28) for x in range(28) if abs(x - 13.5) + abs(y - 13.5) <= 14)
+
+# Each cell paired with its index in GameMap's flat storage, which holds location x, y at x * 28 + y
+_CELL_INDEXES = tuple(((x, y), x * 28 + y) for x, y in CELLS)
+
+def location_bit(x, y):
+    """
+        Returns:
+            The bit standing for location x, y in a bitboard, see GameMap.structure_bits
+    """
+    return 1 << (x * 28 + y)
+
+def bit_indexes(bits):
+    """
+        Args:
+            bits: A bitboard
+
+        Returns:
+            The index x * 28 + y of every location set in bits, in increasing order
+    """
+    indexes = []
+    while bits:
+        low = bits & -bits
+        indexes.append(low.bit_length() - 1)
+        bits ^= low
+    return indexes
+
+# (x, y, unit_type, player_index, upgraded, copies) -> 64 bit key, zobrist_key mixes the unit's health into it
+_zobrist_keys = {}
+_MASK_64 = (1 << 64) - 1
+
+def zobrist_key(x, y, unit, copies=0):
+    """
+        Args:
+            x, y: The location of the unit
+            unit: A GameUnit
+            copies: How many other units at x, y have the same type, owner, upgrade and health as unit
+
+        Returns:
+            The 64 bit key of this unit at this location with its exact health. Keys are derived from the unit's
+            features rather than drawn at random, so they are the same in every process and every run. A stack of
+            n identical units hashes as the keys for 0 to n - 1 copies, so identical units never cancel out.
+    """
+    features = (x, y, unit.unit_type, unit.player_index, unit.upgraded, copies)
+    key = _zobrist_keys.get(features)
+    if key is None:
+        key = _zobrist_keys[features] = int.from_bytes(hashlib.blake2b(repr(features).encode(), digest_size=8).digest(), "little")
+    # The splitmix64 finalizer over the key and the health. Numbers hash the same in every process,
+    # and healths are mixed in rather than looked up so that there is no table of them to grow.
+    z = (key ^ hash(unit.health)) & _MASK_64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return z ^ (z >> 31)
+
 # class LocationIter:
 #     def __init__(self, loc, r):
 #         self.loc = loc
@@ -75,50 +133,94 @@ class GameMap:
         self.BOTTOM_LEFT = 2
         self.BOTTOM_RIGHT = 3
         self.__map = self.__empty_grid()
-        self.__start = [13,0]
+        self.__max_range = max(unit.get('attackRange', 0) for unit in config["unitInformation"])
+        self.__coverage = None
+        self.__targets = None
+        self.__mobiles = None
+        self.__zobrist = None
+        self.__structures = None
     
     def __getitem__(self, location):
         # if len(location) == 2 and self.in_arena_bounds(location):
         x,y = location
-        return self.__map[x][y]
+        return self.__map[x * 28 + y]
         # self._invalid_coordinates(location)
 
     def get_silent(self, location):
         if len(location) == 2 and self.in_arena_bounds(location):
             x,y = location
-            return self.__map[x][y]
+            return self.__map[x * 28 + y]
         return []
 
     def __setitem__(self, location, val):
         if type(location) == tuple and len(location) == 2 and self.in_arena_bounds(location):
-            self.__map[location[0]][location[1]] = val
+            self.__map[location[0] * 28 + location[1]] = val
+            self.__coverage = None
+            self.__targets = None
+            self.__mobiles = None
+            self.__zobrist = None
+            self.__structures = None
             return
         self._invalid_coordinates(location)
 
     def __iter__(self):
-        self.__start = [13,0]
-        return self
-    
-    def __next__(self):
-        location = self.__start
-        if location == [15,27]:
-            raise StopIteration
-        new_location = [location[0]+1, location[1]]
-        while not self.in_arena_bounds(new_location) and not location == [14,27]:
-            if new_location[0] == self.ARENA_SIZE:
-                new_location = [0, new_location[1]+1]
-            else:
-                new_location = [new_location[0]+1, new_location[1]]
-        self.__start = new_location
-        return location 
+        """Iterates over every location on the board as an (x, y) tuple, see CELLS for the order.
+        Each call starts a new iterator, so iterations can be nested.
+        """
+        return iter(CELLS)
+
+    def occupied(self):
+        """Iterates over the locations that hold at least one unit, skipping empty ones
+
+        Yields:
+            (x, y), units pairs in the same order as iterating over the map, where units is the
+            list game_map[x, y] would return
+
+        """
+        grid = self.__map
+        for location, index in _CELL_INDEXES:
+            if grid[index]:
+                yield location, grid[index]
 
     def __empty_grid(self):
-        grid = []
-        for x in range(0, self.ARENA_SIZE):
-            grid.append([])
-            for _ in range(0, self.ARENA_SIZE):
-                grid[x].append([])
-        return grid
+        # One flat list of cells, location x, y is stored at x * 28 + y
+        return [[] for _ in range(self.ARENA_SIZE * self.ARENA_SIZE)]
+
+    def fork(self):
+        """Creates a child map for building hypothetical boards cheaply.
+
+        The child shares the config and constants with this map but owns its own
+        cell lists and shallow copies of every unit, so moving, damaging or removing
+        units on the child never changes this map.
+
+        Returns:
+            A new GameMap holding the same units as this one
+
+        """
+        child = GameMap.__new__(GameMap)
+        child.__dict__.update(self.__dict__)
+        child.__map = [[copy.copy(unit) for unit in cell] if cell else [] for cell in self.__map]
+        # Forks are mostly simulated on, changing health every frame, so a fork only hashes itself once asked to
+        child.__zobrist = None
+        if self.__coverage is not None:
+            child.__coverage = dict(self.__coverage)
+        if self.__targets is not None:
+            child.__targets = dict(self.__targets)
+        if self.__mobiles is not None:
+            child.__mobiles = Counter(self.__mobiles)
+        if self.__structures is not None:
+            child.__structures = dict(self.__structures)
+        return child
+
+    def blocked_locations(self):
+        """Gets every location that holds a structure
+
+        Returns:
+            A frozenset of (x, y) tuples. Two maps with the same structure layout return equal sets,
+            so the result can be used to key anything that only depends on which cells are blocked.
+
+        """
+        return frozenset(divmod(index, 28) for index in bit_indexes(self.structure_bits()))
 
     def _invalid_coordinates(self, location):
         self.warn("{} is out of bounds.".format(str(location)))
@@ -214,9 +316,17 @@ class GameMap:
         x, y = location
         new_unit = GameUnit(unit_type, self.config, player_index, None, location[0], location[1])
         if not new_unit.stationary:
-            self.__map[x][y].append(new_unit)
+            self.__map[x * 28 + y].append(new_unit)
+            if self.__mobiles is not None:
+                self.__mobiles[player_index] += 1
         else:
-            self.__map[x][y] = [new_unit]
+            self.__uncover(x, y)
+            self.__flip_structure(x, y)
+            self.__forget_cell(x, y)
+            self.__map[x * 28 + y] = [new_unit]
+            self.__flip_structure(x, y)
+            self.__cover(x, y)
+        self.__flip_zobrist(new_unit)
 
     def remove_unit(self, location):
         """Remove all units on the map in the given location.
@@ -231,7 +341,278 @@ class GameMap:
             self._invalid_coordinates(location)
         
         x, y = location
-        self.__map[x][y] = []
+        self.__uncover(x, y)
+        self.__flip_structure(x, y)
+        self.__forget_cell(x, y)
+        self.__map[x * 28 + y] = []
+
+    def __forget_cell(self, x, y):
+        """Takes the units at x, y out of the mobile counts and the hash before they are dropped from the map"""
+        if self.__mobiles is not None:
+            self.__mobiles.subtract(unit.player_index for unit in self.__map[x * 28 + y] if not unit.stationary)
+        if self.__zobrist is not None:
+            self.__zobrist ^= self.__cell_zobrist(x, y)
+
+    def __cell_zobrist(self, x, y):
+        """The part of zobrist_hash made of the units at x, y"""
+        key = 0
+        copies = Counter()
+        for unit in self.__map[x * 28 + y]:
+            features = (unit.unit_type, unit.player_index, unit.upgraded, unit.health)
+            key ^= zobrist_key(x, y, unit, copies[features])
+            copies[features] += 1
+        return key
+
+    def __flip_zobrist(self, unit):
+        """Adds a unit that was just put on the map to zobrist_hash, or takes out one about to leave it"""
+        if self.__zobrist is None:
+            return
+        copies = 0
+        for other in self.__map[unit.x * 28 + unit.y]:
+            if other is not unit and other.unit_type == unit.unit_type and other.player_index == unit.player_index and other.upgraded == unit.upgraded and other.health == unit.health:
+                copies += 1
+        self.__zobrist ^= zobrist_key(unit.x, unit.y, unit, copies)
+
+    def discard_unit(self, unit):
+        """Remove a single unit from the map, leaving any other units at its location in place.
+
+        Args:
+            unit: The GameUnit to remove, it must be on this map at [unit.x, unit.y]
+
+        """
+        if unit.stationary:
+            self.__uncover(unit.x, unit.y)
+            self.__flip_structure(unit.x, unit.y)
+        elif self.__mobiles is not None:
+            self.__mobiles[unit.player_index] -= 1
+        self.__flip_zobrist(unit)
+        self.__map[unit.x * 28 + unit.y].remove(unit)
+
+    def upgrade_unit(self, location):
+        """Upgrade the structure at the given location, if there is one.
+
+        Args:
+            location: The location of the structure to upgrade
+
+        This function only changes the data stored in GameMap, see GameState.attempt_upgrade to upgrade as part of your turn.
+        """
+        x, y = location
+        for unit in self.__map[x * 28 + y]:
+            if unit.stationary:
+                self.__uncover(x, y)
+                self.__flip_zobrist(unit)
+                unit.upgrade()
+                self.__flip_zobrist(unit)
+                self.__cover(x, y)
+
+    def move_unit(self, unit, location):
+        """Move a mobile unit to another location, keeping zobrist_hash up to date.
+
+        Args:
+            unit: A mobile GameUnit on this map at [unit.x, unit.y]
+            location: The location to move it to
+
+        """
+        self.__flip_zobrist(unit)
+        self.__map[unit.x * 28 + unit.y].remove(unit)
+        unit.x, unit.y = location[0], location[1]
+        self.__map[unit.x * 28 + unit.y].append(unit)
+        self.__flip_zobrist(unit)
+
+    def set_health(self, unit, health):
+        """Change the health of a unit on the map, keeping zobrist_hash up to date.
+
+        Args:
+            unit: A GameUnit on this map at [unit.x, unit.y]
+            health: Its new health
+
+        """
+        self.__flip_zobrist(unit)
+        unit.health = health
+        self.__flip_zobrist(unit)
+
+    @property
+    def zobrist_hash(self):
+        """A 64 bit hash of every unit on the map, by location, type, owner, upgrade and exact health, counting stacked identical units.
+
+        Maps holding the same units hash the same however they were built, so the hash can key caches of anything
+        worked out from a board. It is computed on first use, forks included, and then updated by add_unit, remove_unit,
+        discard_unit, move_unit, upgrade_unit and set_health, which is how Simulator changes the board. Once it has been
+        computed, a unit moved or given new health directly leaves the hash wrong for as long as the map lives.
+        """
+        if self.__zobrist is None:
+            self.__zobrist = 0
+            for (x, y), _ in self.occupied():
+                self.__zobrist ^= self.__cell_zobrist(x, y)
+        return self.__zobrist
+
+    def structure_bits(self, player_index=None, unit_type=None):
+        """Gets a bitboard of the locations holding structures
+
+        Bit x * 28 + y of the result is set when location x, y holds a matching structure, so bitboards can be
+        combined with | & ^ and tested with location_bit. They are built on first use and kept up to date by
+        add_unit, remove_unit and discard_unit, like the coverage index behind get_attackers.
+
+        Args:
+            player_index: Only include structures of this player, by default both players' are included
+            unit_type: Only include structures of this type, by default every type is included
+
+        Returns:
+            An int holding one bit per matching location
+
+        """
+        if self.__structures is None:
+            self.__structures = {}
+            for (x, y), _ in self.occupied():
+                self.__flip_structure(x, y)
+        return self.__structures.get((player_index, unit_type), 0)
+
+    def __flip_structure(self, x, y):
+        """Adds the structure at x, y to the bitboards, or takes it out again if it is already in them"""
+        if self.__structures is None:
+            return
+        unit = self.__structure(x, y)
+        if unit is None:
+            return
+        bit = 1 << (x * 28 + y)
+        for key in ((None, None), (unit.player_index, None), (None, unit.unit_type), (unit.player_index, unit.unit_type)):
+            self.__structures[key] = self.__structures.get(key, 0) ^ bit
+
+    def get_attackers(self, location, player_index):
+        """Gets the structures that can attack a unit at a given location
+
+        Backed by a coverage index that lists, for every location, the structures in range of it.
+        The index is built on first use and kept up to date by add_unit, remove_unit, discard_unit and
+        upgrade_unit, so changes made by editing the unit lists returned by game_map[x, y] directly are missed.
+
+        Args:
+            location: The location of a hypothetical defender
+            player_index: The index corresponding to the defending player, 0 for you 1 for the enemy
+
+        Returns:
+            A list of structures that would attack a unit controlled by the given player at the given location,
+            in the order get_locations_in_range visits their locations
+
+        """
+        self.index_attackers()
+        attackers = []
+        for _, x, y in self.__coverage.get((location[0], location[1]), ()):
+            for unit in self.__map[x * 28 + y]:
+                if unit.stationary and unit.player_index != player_index:
+                    attackers.append(unit)
+        return attackers
+
+    def index_attackers(self):
+        """Builds the coverage index used by get_attackers, if it has not been built yet.
+        Forks made afterwards inherit the index instead of building their own.
+        """
+        if self.__coverage is None:
+            self.__coverage = {}
+            for (x, y), _ in self.occupied():
+                self.__cover(x, y, (self.__coverage, None))
+
+    def get_target(self, attacking_unit):
+        """Returns the unit the given unit would choose to attack, see GameState.get_target for the priority.
+
+        Structures are looked up in a target index that lists, for every location, the structures within
+        the longest attack range ordered by distance, so only the nearest ones are compared. Mobile units
+        are only searched for while the other player has some on the map. Like get_attackers, both rely on
+        the map being changed through add_unit, remove_unit, discard_unit and upgrade_unit.
+
+        Args:
+            attacking_unit: A GameUnit on this map
+
+        Returns:
+            The GameUnit this unit would choose to attack, or None
+
+        """
+        x, y = attacking_unit.x, attacking_unit.y
+        player_index = attacking_unit.player_index
+        reach = attacking_unit.attackRange ** 2
+        target = None
+        target_priority = None
+
+        if attacking_unit.damage_i > 0:
+            if self.__mobiles is None:
+                self.__mobiles = Counter(unit.player_index for cell in self.__map for unit in cell if not unit.stationary)
+            if sum(self.__mobiles.values()) > self.__mobiles[player_index]:
+                for dx, dy in DISTS[attacking_unit.attackRange]:
+                    if not self.in_arena_bounds([x + dx, y + dy]):
+                        continue
+                    for unit in self.__map[(x + dx) * 28 + y + dy]:
+                        if unit.stationary or unit.player_index == player_index:
+                            continue
+                        priority = self.__target_priority(unit, dx * dx + dy * dy, player_index)
+                        if target is None or priority < target_priority:
+                            target = unit
+                            target_priority = priority
+                if target is not None:
+                    return target
+
+        if attacking_unit.damage_f > 0:
+            self.index_targets()
+            for distance, sx, sy in self.__targets.get((x, y), ()):
+                if distance > reach or (target is not None and distance > target_priority[0]):
+                    break
+                for unit in self.__map[sx * 28 + sy]:
+                    if not unit.stationary or unit.player_index == player_index:
+                        continue
+                    priority = self.__target_priority(unit, distance, player_index)
+                    if target is None or priority < target_priority:
+                        target = unit
+                        target_priority = priority
+        return target
+
+    def __target_priority(self, unit, distance, player_index):
+        """Nearest, then lowest health, then closest to the attacker's own edge, then furthest from the center column"""
+        return (distance, unit.health, unit.y if player_index == 0 else -unit.y, -abs(self.HALF_ARENA - 0.5 - unit.x))
+
+    def index_targets(self):
+        """Builds the target index used by get_target, if it has not been built yet.
+        Forks made afterwards inherit the index instead of building their own.
+        """
+        if self.__targets is None:
+            self.__targets = {}
+            for (x, y), _ in self.occupied():
+                self.__cover(x, y, (None, self.__targets))
+
+    def __structure(self, x, y):
+        for unit in self.__map[x * 28 + y]:
+            if unit.stationary:
+                return unit
+        return None
+
+    def __cover(self, x, y, indexes=None):
+        """Adds the structure at x, y to the given coverage and target indexes, by default the ones that have been built"""
+        coverage, targets = indexes or (self.__coverage, self.__targets)
+        unit = self.__structure(x, y)
+        if unit is None:
+            return
+        attacking = coverage is not None and unit.damage_i + unit.damage_f > 0
+        if not attacking and targets is None:
+            return
+        for rank, (dx, dy) in enumerate(DISTS[self.__max_range]):
+            # dx, dy is the offset of the structure as seen from the indexed location
+            key = (x - dx, y - dy)
+            distance = dx * dx + dy * dy
+            if attacking and distance <= unit.attackRange ** 2:
+                coverage[key] = tuple(sorted(coverage.get(key, ()) + ((rank, x, y),)))
+            if targets is not None:
+                targets[key] = tuple(sorted(targets.get(key, ()) + ((distance, x, y),)))
+
+    def __uncover(self, x, y):
+        unit = self.__structure(x, y)
+        if unit is None:
+            return
+        attacking = self.__coverage is not None and unit.damage_i + unit.damage_f > 0
+        if not attacking and self.__targets is None:
+            return
+        for rank, (dx, dy) in enumerate(DISTS[self.__max_range]):
+            key = (x - dx, y - dy)
+            if attacking and key in self.__coverage:
+                self.__coverage[key] = tuple(entry for entry in self.__coverage[key] if entry != (rank, x, y))
+            if self.__targets is not None and key in self.__targets:
+                self.__targets[key] = tuple(entry for entry in self.__targets[key] if entry[1:] != (x, y))
 
     def get_locations_in_range(self, location, radius):
         """Gets locations in a circular area around a location
@@ -1,6 +1,6 @@
 import math
 import json
-import sys
+import copy
 
 from .navigation import ShortestPathFinder
 from .util import send_command, debug_write
@@ -100,6 +100,25 @@ class GameState:
         # debug_write(serialized_string)
         self.__parse_state(serialized_string)
 
+    def fork(self):
+        """Creates a child gamestate that can be freely modified.
+
+        This is a much cheaper alternative to copy.deepcopy for hypothetical boards.
+        The config, turn information and path finder (with its cache of pathing results per
+        structure layout) are shared with this gamestate, while the map, resources and
+        build/deploy stacks are copied. See GameMap.fork.
+
+        Returns:
+            A new GameState with the same board and resources as this one
+
+        """
+        child = copy.copy(self)
+        child.game_map = self.game_map.fork()
+        child._build_stack = list(self._build_stack)
+        child._deploy_stack = list(self._deploy_stack)
+        child._player_resources = [dict(resources) for resources in self._player_resources]
+        return child
+
     def __parse_state(self, state_line):
         """
         Fills in map based on the serialized game state so that self.game_map[x,y] is a list of GameUnits at that location.
@@ -140,13 +159,14 @@ class GameState:
                 x, y = map(int, [sx, sy])
                 hp = float(shp)
                 # This depends on RM and UP always being the last types to be processed
+                # Units are appended to the cells directly, so the map's structure bitboards must not be built yet
                 if unit_type == REMOVE:
                     # Quick fix will deploy engine fix soon
-                    if self.contains_stationary_unit([x,y]):
+                    if any(unit.stationary for unit in self.game_map[x,y]):
                         self.game_map[x,y][0].pending_removal = True
                 elif unit_type == UPGRADE:
-                    if self.contains_stationary_unit([x,y]):
-                        self.game_map[x,y][0].upgrade()
+                    if any(unit.stationary for unit in self.game_map[x,y]):
+                        self.game_map.upgrade_unit([x,y])
                 else:
                     unit = GameUnit(unit_type, self.config, player_number, hp, x, y)
                     self.game_map[x,y].append(unit)
@@ -457,7 +477,7 @@ class GameState:
                     if resources[SP] >= costs[SP] and resources[MP] >= costs[MP]:
                         self.__set_resource(SP, 0 - costs[SP])
                         self.__set_resource(MP, 0 - costs[MP])
-                        existing_unit.upgrade()
+                        self.game_map.upgrade_unit([x, y])
                         self._build_stack.append((UPGRADE, x, y))
                         spawned_units += 1
             else:
@@ -466,9 +486,7 @@ class GameState:
 
     def unsafe_upgrade(self, location):
         x, y = map(int, location)
-        for unit in self.game_map[x,y]:
-            if unit.stationary:
-                unit.upgrade()
+        self.game_map.upgrade_unit([x, y])
 
     def get_target_edge(self, start_location):
         """Gets the target edge given a starting location
@@ -493,13 +511,14 @@ class GameState:
         elif right and top:
             return self.game_map.BOTTOM_LEFT
 
-    def find_path_to_edge(self, start_location, target_edge=None):
+    def find_path_to_edge(self, start_location, target_edge=None, initial_move_direction=0):
         """Gets the path a unit at a given location would take. 
         If final point is not on an edge, it is a self destruct path
 
         Args:
             start_location: The location of a hypothetical unit
             target_edge: The edge the unit wants to reach. game_map.TOP_LEFT, game_map.BOTTOM_RIGHT, etc. Induced from start_location if None.
+            initial_move_direction: The direction of the unit's last move, when it is re-pathing after the map changed
 
         Returns:
             A list of locations corresponding to the path the unit would take 
@@ -514,7 +533,21 @@ class GameState:
             target_edge = self.get_target_edge(start_location)
 
         end_points = self.game_map.get_edge_locations(target_edge)
-        return self._shortest_path_finder.navigate_multiple_endpoints(start_location, end_points, self)
+        return self._shortest_path_finder.navigate_multiple_endpoints(start_location, end_points, self, initial_move_direction)
+
+    def get_path_table(self, target_edge):
+        """Gets the paths toward an edge from every location at once, for pathing many units over the same board
+
+        Args:
+            target_edge: The edge the units want to reach. game_map.TOP_LEFT, game_map.BOTTOM_RIGHT, etc.
+
+        Returns:
+            A PathTable, whose path_from(start_location, initial_move_direction) returns the same path as
+            find_path_to_edge(start_location, target_edge, initial_move_direction)
+
+        """
+        end_points = self.game_map.get_edge_locations(target_edge)
+        return self._shortest_path_finder.get_path_table(end_points, self)
 
     def unsafe_pathfind(self, start_location, target_edge=None, initial_move_direction=0):
         if self.contains_stationary_unit(start_location):
@@ -542,7 +575,9 @@ class GameState:
         if not self.game_map.in_arena_bounds(location):
             self.warn('Checked for stationary unit outside of arena bounds')
             return False
-        x, y = map(int, location)
+        x, y = int(location[0]), int(location[1])
+        if not self.game_map.structure_bits() >> (x * 28 + y) & 1:
+            return False
         for unit in self.game_map[x,y]:
             if unit.stationary:
                 return unit
@@ -561,7 +596,9 @@ class GameState:
         if not self.game_map.in_arena_bounds(location):
             self.warn('Checked for stationary unit outside of arena bounds')
             return False
-        x, y = map(int, location)
+        x, y = int(location[0]), int(location[1])
+        if not (self.game_map.structure_bits() ^ self.game_map.structure_bits(unit_type=SUPPORT)) >> (x * 28 + y) & 1:
+            return False
         for unit in self.game_map[x,y]:
             if unit.stationary and unit.unit_type != "EF" and (force_turrets or (unit.unit_type != "DF" or unit.upgraded)):
                 return unit
@@ -604,65 +641,7 @@ class GameState:
             self.warn("Passed a {} to get_target as attacking_unit. Expected a GameUnit.".format(type(attacking_unit)))
             return
 
-        attacker_location = [attacking_unit.x, attacking_unit.y]
-        possible_locations = self.game_map.get_locations_in_range(attacker_location, attacking_unit.attackRange)
-        target = None
-        target_stationary = True
-        target_distance = sys.maxsize
-        target_health = sys.maxsize
-        target_y = self.ARENA_SIZE
-        target_x_distance = 0
-
-        for location in possible_locations:
-            for unit in self.game_map[location]:
-                if unit.player_index == attacking_unit.player_index or (attacking_unit.damage_f == 0 and is_stationary(unit.unit_type)) or (attacking_unit.damage_i == 0 and not(is_stationary(unit.unit_type))):
-                    continue
-
-                new_target = False
-                unit_stationary = unit.stationary
-                unit_distance = self.game_map.distance_between_locations(location, [attacking_unit.x, attacking_unit.y])
-                unit_health = unit.health
-                unit_y = unit.y
-                unit_x_distance = abs(self.HALF_ARENA - 0.5 - unit.x)
-
-                if target_stationary and not unit_stationary:
-                    new_target = True
-                elif not target_stationary and unit_stationary:
-                    continue
-                
-                if target_distance > unit_distance:
-                    new_target = True
-                elif target_distance < unit_distance and not new_target:
-                    continue
-
-                if target_health > unit_health:
-                    new_target = True
-                elif target_health < unit_health and not new_target:
-                    continue
-
-                # Compare height heuristic relative to attacking unit's player index
-                if attacking_unit.player_index == 0:
-                    if target_y > unit_y:
-                        new_target = True
-                    elif target_y < unit_y and not new_target:
-                        continue
-                else:
-                    if target_y < unit_y:
-                        new_target = True
-                    elif target_y > unit_y and not new_target:
-                        continue
-
-                if target_x_distance < unit_x_distance:
-                    new_target = True
-                
-                if new_target:
-                    target = unit
-                    target_stationary = unit_stationary
-                    target_distance = unit_distance
-                    target_health = unit_health
-                    target_y = unit_y
-                    target_x_distance = unit_x_distance
-        return target
+        return self.game_map.get_target(attacking_unit)
 
     def get_attackers(self, location, player_index):
         """Gets the stationary units threatening a given location
@@ -681,17 +660,4 @@ class GameState:
         if not self.game_map.in_arena_bounds(location):
             self.warn("Location {} is not in the arena bounds.".format(location))
 
-        attackers = []
-        """
-        Get locations in the range of TURRET units
-        """
-        max_range = 0
-        for unit in self.config["unitInformation"]:
-            if unit.get('attackRange', 0) >= max_range:
-                max_range = unit.get('attackRange', 0)
-        possible_locations= self.game_map.get_locations_in_range(location, max_range)
-        for location_unit in possible_locations:
-            for unit in self.game_map[location_unit]:
-                if unit.damage_i + unit.damage_f > 0 and unit.player_index != player_index and self.game_map.distance_between_locations(location, location_unit) <= unit.attackRange:
-                    attackers.append(unit)
-        return attackers
+        return self.game_map.get_attackers(location, player_index)
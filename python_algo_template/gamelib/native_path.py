@@ -0,0 +1,113 @@
+"""
+Optional native pathfinding core.
+
+rust-algo/pathcore builds a small library that finds paths with the same rules as
+ShortestPathFinder and builds PathTable's tables. rust-algo/build_pathcore.py builds it and
+copies it next to this file. When the library is missing or cannot be loaded, LIBRARY and
+TABLE_BUILDER are None and ShortestPathFinder and PathTable keep pathing in Python.
+"""
+import ctypes
+import os
+import sys
+
+from .util import debug_write
+
+if sys.platform == "win32":
+    LIBRARY_NAME = "pathcore.dll"
+elif sys.platform == "darwin":
+    LIBRARY_NAME = "libpathcore.dylib"
+else:
+    LIBRARY_NAME = "libpathcore.so"
+
+# Results of pathcore_find_path other than a path length, see rust-algo/pathcore/src/lib.rs
+START_BLOCKED = -1
+PATH_TOO_LONG = -2
+OFF_BOARD = -3
+# Ideal tiles pathcore_build_table gives other than a flat index
+NO_POCKET = -1
+REACHES_EDGE = -2
+
+# The argument types of the library's functions
+SIGNATURES = {
+    "pathcore_find_path": [ctypes.c_char_p, ctypes.POINTER(ctypes.c_int32), ctypes.c_size_t, ctypes.c_int32, ctypes.c_int32, ctypes.POINTER(ctypes.c_int32), ctypes.c_size_t],
+    "pathcore_build_table": [ctypes.c_char_p, ctypes.POINTER(ctypes.c_int32), ctypes.c_size_t, ctypes.POINTER(ctypes.c_int32), ctypes.POINTER(ctypes.c_int32)],
+}
+
+def load_library(path=None, name="pathcore_find_path"):
+    """Loads a function of the native core
+
+    Args:
+        path: The library to load, by default LIBRARY_NAME in this directory
+        name: The function to load, one of SIGNATURES
+
+    Returns:
+        The library's function, or None if the library is missing, cannot be loaded or was built without the function
+
+    """
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), LIBRARY_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        function = getattr(ctypes.CDLL(path), name)
+    except (OSError, AttributeError) as e:
+        debug_write("Native pathfinding unavailable, pathing in Python: {}".format(e))
+        return None
+    function.argtypes = SIGNATURES[name]
+    function.restype = ctypes.c_ssize_t
+    return function
+
+LIBRARY = load_library()
+TABLE_BUILDER = load_library(name="pathcore_build_table")
+
+# Paths never visit a location twice, so they fit in one slot per location. Shared by every call in this process.
+_path = (ctypes.c_int32 * 784)()
+# The tables pathcore_build_table fills in, also shared
+_pathlengths = (ctypes.c_int32 * 784)()
+_ideal_tiles = (ctypes.c_int32 * 784)()
+# End points as passed to the library, by the tuple of their locations
+_end_points = {}
+
+def _end_point_array(end_points):
+    key = tuple(map(tuple, end_points))
+    ends = _end_points.get(key)
+    if ends is None:
+        ends = _end_points[key] = (ctypes.c_int32 * len(key))(*(x * 28 + y for x, y in key))
+    return ends
+
+def find_path(structures, end_points, start_point, initial_move_direction=0):
+    """Finds the path a unit would take, the same one ShortestPathFinder.navigate_multiple_endpoints finds
+
+    Args:
+        * structures: The locations holding structures, as a bitboard from GameMap.structure_bits
+        * end_points: The end points of the unit, should be a list of edge locations
+        * start_point: The starting location of the unit
+        * initial_move_direction: The direction of the unit's last move, ShortestPathFinder.HORIZONTAL or VERTICAL, 0 if it has not moved
+
+    Returns:
+        A list of locations from start_point to the end of the path, or None if start_point is blocked
+
+    """
+    length = LIBRARY(structures.to_bytes(98, "little"), _end_point_array(end_points), len(end_points), start_point[0] * 28 + start_point[1], initial_move_direction, _path, len(_path))
+    if length == START_BLOCKED:
+        return None
+    if length < 0:
+        raise ValueError("Native pathfinding failed with {} from {} toward {}".format(length, start_point, end_points))
+    return [start_point] + [list(divmod(index, 28)) for index in _path[1:length]]
+
+def build_table(structures, end_points):
+    """Builds the tables of a PathTable, the same ones PathTable builds in Python
+
+    Args:
+        * structures: The locations holding structures, as a bitboard from GameMap.structure_bits
+        * end_points: The end points of the paths, should be a list of edge locations
+
+    Returns:
+        The pathlength of every location by flat index, and the flat index of the ideal tile of its
+        pocket, REACHES_EDGE if the pocket reaches the edge or NO_POCKET where there is no pocket
+
+    """
+    result = TABLE_BUILDER(structures.to_bytes(98, "little"), _end_point_array(end_points), len(end_points), _pathlengths, _ideal_tiles)
+    if result < 0:
+        raise ValueError("Native table building failed with {} toward {}".format(result, end_points))
+    return _pathlengths[:], _ideal_tiles[:]
@@ -1,7 +1,9 @@
+import copy
 import heapq
 import math
 import sys
-import queue
+from collections import deque
+from . import native_path
 from .util import debug_write
 
 class Node:
@@ -20,6 +22,322 @@ class Node:
         self.blocked = False
         self.pathlength = -1
 
+# Stands in for the ideal tile when a pocket can reach its target edge, since every edge tile is then a target
+REACHES_EDGE = "edge"
+MAX_CACHED_LAYOUTS = 128
+# Layouts that differ from the last one used for an edge by at most this many cells are repaired instead of searched again
+MAX_REPAIRED_CELLS = 4
+
+def _on_board(x, y):
+    return 0 <= x < 28 and 0 <= y < 28 and abs(x - 13.5) + abs(y - 13.5) <= 14
+
+# The searches work on flat cell indexes, location x, y being index x * 28 + y.
+# NEIGHBORS[index] holds the on board neighbors of a location, in the order _get_neighbors lists them.
+NEIGHBORS = tuple(
+    tuple(nx * 28 + ny for nx, ny in ((x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y)) if _on_board(nx, ny)) if _on_board(x, y) else ()
+    for x in range(28) for y in range(28))
+# The ideal tiles of native_path.build_table by index + 2, after its REACHES_EDGE and NO_POCKET
+_NATIVE_IDEAL_TILES = (REACHES_EDGE, None) + tuple(divmod(index, 28) for index in range(784))
+
+class PathTable:
+    """The paths toward one edge from every location, for one structure layout
+
+    Every pocket of pathable space is searched once for its ideal tile and validated once, using the same
+    rules as ShortestPathFinder, so path_from can then walk from any start without searching again.
+    Locations are stored by flat index x * 28 + y. Given the structures' bitboard, the tables are built
+    by the native core when it is built.
+
+    Attributes :
+        * blocked (frozenset): The locations holding a structure
+        * end_points (list): The edge locations the paths lead to
+        * pathlengths (list): The distance of every location to the ideal tile of its pocket, -1 off the board
+        * ideal_tiles (list): The ideal tile of every location's pocket, REACHES_EDGE if the pocket reaches the edge, None where blocked
+
+    """
+    def __init__(self, blocked, end_points, structures=None):
+        """
+        Args:
+            * blocked: The locations holding a structure
+            * end_points: The edge locations the paths lead to
+            * structures: blocked as a bitboard from GameMap.structure_bits, to build the tables with the native core
+        """
+        self.blocked = blocked
+        self.end_points = [list(location) for location in end_points]
+        self._walls = [False] * 784
+        for x, y in blocked:
+            self._walls[x * 28 + y] = True
+        x, y = end_points[0]
+        self._direction = (1 if x >= 14 else -1, 1 if y >= 14 else -1)
+        self._ends = frozenset(x * 28 + y for x, y in end_points)
+
+        if structures is not None and native_path.TABLE_BUILDER is not None:
+            self.pathlengths, ideal_tiles = native_path.build_table(structures, end_points)
+            self.ideal_tiles = [_NATIVE_IDEAL_TILES[index + 2] for index in ideal_tiles]
+            return
+        self.pathlengths = [-1] * 784
+        self.ideal_tiles = [None] * 784
+        # Every pocket holding a free end point reaches the edge
+        for index in self._validate(self._ends):
+            if not self._walls[index]:
+                self.ideal_tiles[index] = REACHES_EDGE
+        self._search_pockets(range(784))
+
+    def _search_pockets(self, tiles):
+        """Gives each of tiles that is not yet in a pocket the pocket's most ideal tile, which is unique as no two tiles are equally ideal"""
+        for index in tiles:
+            if not NEIGHBORS[index] or self._walls[index] or self.ideal_tiles[index] is not None:
+                continue
+            pocket = self._pocket(index)
+            ideal = max(pocket, key=self._idealness)
+            self._validate([ideal])
+            for tile in pocket:
+                self.ideal_tiles[tile] = divmod(ideal, 28)
+
+    def repaired(self, blocked):
+        """Builds the table for another structure layout by repairing this one around each location that changed
+
+        Args:
+            * blocked: The locations holding a structure in the other layout
+
+        Returns:
+            A new PathTable equal to PathTable(blocked, end_points), or None if more than MAX_REPAIRED_CELLS locations changed
+
+        """
+        changed = self.blocked ^ blocked
+        if len(changed) > MAX_REPAIRED_CELLS:
+            return None
+        table = copy.copy(self)
+        table.blocked = blocked
+        table.pathlengths = list(self.pathlengths)
+        table.ideal_tiles = list(self.ideal_tiles)
+        table._walls = list(self._walls)
+        for x, y in sorted(changed):
+            if table._walls[x * 28 + y]:
+                table._unblock(x * 28 + y)
+            else:
+                table._block(x * 28 + y)
+        return table
+
+    def _unblock(self, index):
+        """Updates the table after the structure at index was removed. The pockets around it merge into one."""
+        self._walls[index] = False
+        pockets = {self.ideal_tiles[neighbor] for neighbor in NEIGHBORS[index] if not self._walls[neighbor]}
+        if index in self._ends or REACHES_EDGE in pockets:
+            merged = REACHES_EDGE
+        else:
+            merged = max(pockets | {divmod(index, 28)}, key=lambda tile: self._idealness(tile[0] * 28 + tile[1]))
+        self.ideal_tiles[index] = merged
+
+        # The pockets that did not lead to the merged ideal tile are measured again from scratch
+        pockets.discard(merged)
+        if pockets:
+            for tile in range(784):
+                if self.ideal_tiles[tile] in pockets:
+                    self.ideal_tiles[tile] = merged
+                    self.pathlengths[tile] = -1
+        if merged == divmod(index, 28):
+            self._validate([index])
+            return
+        if index not in self._ends:
+            self.pathlengths[index] = min(self.pathlengths[neighbor] for neighbor in NEIGHBORS[index] if not self._walls[neighbor] and self.pathlengths[neighbor] != -1) + 1
+        self._lower(index)
+
+    def _block(self, index):
+        """Updates the table after a structure was placed on index. Its pocket may split."""
+        ideal = self.ideal_tiles[index]
+        old_length = self.pathlengths[index]
+        self._walls[index] = True
+        self.ideal_tiles[index] = None
+        # _validate gives blocked end points a pathlength of 0 as well
+        self.pathlengths[index] = 0 if index in self._ends else -1
+
+        if ideal == divmod(index, 28):
+            # The pocket lost its ideal tile, so what is left of it is searched again
+            pocket = [tile for tile in range(784) if self.ideal_tiles[tile] == ideal]
+            for tile in pocket:
+                self.ideal_tiles[tile] = None
+                self.pathlengths[tile] = -1
+        else:
+            # Tiles cut off from the ideal tile are in a new pocket with an ideal tile of its own
+            pocket = [tile for tile in self._raise(index, old_length) if self.pathlengths[tile] == -1]
+            for tile in pocket:
+                self.ideal_tiles[tile] = None
+        self._search_pockets(pocket)
+
+    def _lower(self, index):
+        """
+        Lowers the pathlengths around index, which just became pathable, to the ones _validate
+        would now find. Pathlengths can only shrink, so the repair spreads out from index and
+        stops wherever nothing improves.
+        """
+        walls = self._walls
+        pathlengths = self.pathlengths
+        frontier = [index]
+        head = 0
+        while head < len(frontier):
+            current = frontier[head]
+            head += 1
+            length = pathlengths[current] + 1
+            for neighbor in NEIGHBORS[current]:
+                if not walls[neighbor] and (pathlengths[neighbor] == -1 or pathlengths[neighbor] > length):
+                    pathlengths[neighbor] = length
+                    frontier.append(neighbor)
+
+    def _raise(self, index, old_length):
+        """
+        Raises the pathlengths that went through index, which is no longer pathable, and returns
+        the tiles it recomputed. Only the tiles left without a neighbor one step closer to the
+        target are recomputed, starting from the tiles around them that kept their pathlength.
+        Tiles that can no longer reach the target are left at -1.
+        """
+        walls = self._walls
+        pathlengths = self.pathlengths
+        # Tiles are checked in order of pathlength, so all the tiles one step closer have already been settled
+        invalid = set()
+        checked = set()
+        pending = deque(neighbor for neighbor in NEIGHBORS[index] if not walls[neighbor] and pathlengths[neighbor] == old_length + 1)
+        while pending:
+            tile = pending.popleft()
+            if tile in checked:
+                continue
+            checked.add(tile)
+            length = pathlengths[tile]
+            if length == 0:
+                continue
+            if any(not walls[neighbor] and pathlengths[neighbor] == length - 1 and neighbor not in invalid for neighbor in NEIGHBORS[tile]):
+                continue
+            invalid.add(tile)
+            pending.extend(neighbor for neighbor in NEIGHBORS[tile] if not walls[neighbor] and pathlengths[neighbor] == length + 1)
+
+        for tile in invalid:
+            pathlengths[tile] = -1
+        frontier = []
+        for tile in invalid:
+            lengths = [pathlengths[neighbor] for neighbor in NEIGHBORS[tile] if not walls[neighbor] and pathlengths[neighbor] != -1]
+            if lengths:
+                heapq.heappush(frontier, (min(lengths) + 1, tile))
+        while frontier:
+            length, tile = heapq.heappop(frontier)
+            if pathlengths[tile] != -1:
+                continue
+            pathlengths[tile] = length
+            for neighbor in NEIGHBORS[tile]:
+                if neighbor in invalid and pathlengths[neighbor] == -1:
+                    heapq.heappush(frontier, (length + 1, neighbor))
+        return invalid
+
+    def _idealness(self, index):
+        x, y = divmod(index, 28)
+        return 28 * (y if self._direction[1] == 1 else 27 - y) + (x if self._direction[0] == 1 else 27 - x)
+
+    def _pocket(self, index):
+        walls = self._walls
+        seen = {index}
+        pocket = [index]
+        head = 0
+        while head < len(pocket):
+            for neighbor in NEIGHBORS[pocket[head]]:
+                if not walls[neighbor] and neighbor not in seen:
+                    seen.add(neighbor)
+                    pocket.append(neighbor)
+            head += 1
+        return pocket
+
+    def _validate(self, sources):
+        """Breadth first search from sources like ShortestPathFinder._validate, returns the locations it reached"""
+        walls = self._walls
+        pathlengths = self.pathlengths
+        frontier = list(sources)
+        for index in frontier:
+            pathlengths[index] = 0
+        head = 0
+        while head < len(frontier):
+            index = frontier[head]
+            head += 1
+            if walls[index]:
+                continue
+            length = pathlengths[index] + 1
+            for neighbor in NEIGHBORS[index]:
+                if pathlengths[neighbor] == -1 and not walls[neighbor]:
+                    pathlengths[neighbor] = length
+                    frontier.append(neighbor)
+        return frontier
+
+    def path_from(self, start, initial_direction=0):
+        """The path a unit at start would take, the same one ShortestPathFinder.navigate_multiple_endpoints finds
+
+        Args:
+            * start: The starting location of the unit
+            * initial_direction: The direction of the unit's last move, ShortestPathFinder.HORIZONTAL or VERTICAL, 0 if it has not moved
+
+        Returns:
+            A list of locations from start to the end of the path, or None if start is blocked
+
+        """
+        index = start[0] * 28 + start[1]
+        if self._walls[index]:
+            return None
+        if not NEIGHBORS[index]:
+            # Off the board, where ShortestPathFinder finds the start itself is its most ideal tile
+            return [start]
+        path = [start]
+        direction = initial_direction
+        while self.pathlengths[index] != 0:
+            next_index = self._next_move(index, direction)
+            direction = 2 if next_index // 28 == index // 28 else 1
+            index = next_index
+            path.append(list(divmod(index, 28)))
+        return path
+
+    def next_move(self, start, initial_direction=0):
+        """The first step of path_from(start, initial_direction)
+
+        Returns:
+            The next location and ShortestPathFinder.HORIZONTAL or VERTICAL for the direction of the move,
+            or None if start is blocked or already at the end of its path
+
+        """
+        index = start[0] * 28 + start[1]
+        if self._walls[index] or self.pathlengths[index] <= 0:
+            return None
+        next_index = self._next_move(index, initial_direction)
+        return list(divmod(next_index, 28)), 2 if next_index // 28 == index // 28 else 1
+
+    def _next_move(self, index, previous_direction):
+        """ShortestPathFinder._choose_next_move and _better_direction over flat indexes"""
+        walls = self._walls
+        pathlengths = self.pathlengths
+        x, y = divmod(index, 28)
+        best = index
+        best_x, best_y = x, y
+        best_pathlength = pathlengths[index]
+        for neighbor in NEIGHBORS[index]:
+            if walls[neighbor]:
+                continue
+            pathlength = pathlengths[neighbor]
+            if pathlength > best_pathlength:
+                continue
+            nx, ny = divmod(neighbor, 28)
+            if pathlength == best_pathlength:
+                if previous_direction == 1 and nx != best_x:
+                    better = y != ny
+                elif previous_direction == 2 and ny != best_y:
+                    better = x != nx
+                elif previous_direction == 0:
+                    better = y != ny
+                elif ny == best_y:
+                    better = nx > best_x if self._direction[0] == 1 else nx < best_x
+                elif nx == best_x:
+                    better = ny > best_y if self._direction[1] == 1 else ny < best_y
+                else:
+                    better = True
+                if not better:
+                    continue
+            best = neighbor
+            best_x, best_y = nx, ny
+            best_pathlength = pathlength
+        return best
+
 """
 This class helps with pathfinding. We guarantee the results will
 be accurate, but top players may want to write their own pathfinding
@@ -36,10 +354,17 @@ class ShortestPathFinder:
         * game_map (:obj: GameMap): The current gamemap
 
     """
-    def __init__(self):
+    def __init__(self, native=True):
+        """
+        Args:
+            * native: Path with the native core from native_path when it is built, otherwise always in Python
+        """
         self.HORIZONTAL = 1
         self.VERTICAL = 2
+        self.native = native and native_path.LIBRARY is not None
         self.initialized = False
+        self._path_tables = {}
+        self._last_tables = {}
 
     def initialize_map(self, game_state):
         """Initializes the map
@@ -52,13 +377,14 @@ class ShortestPathFinder:
         self.game_state = game_state
         self.game_map = [[Node() for x in range(self.game_state.ARENA_SIZE)] for y in range(self.game_state.ARENA_SIZE)]
 
-    def navigate_multiple_endpoints(self, start_point, end_points, game_state):
+    def navigate_multiple_endpoints(self, start_point, end_points, game_state, initial_move_direction=0):
         """Finds the path a unit would take to reach a set of endpoints
 
         Args:
             * start_point: The starting location of the unit
             * end_points: The end points of the unit, should be a list of edge locations
             * game_state: The current game state
+            * initial_move_direction: The direction of the unit's last move, for a unit that is re-pathing mid-walk
 
         Returns:
             The path a unit at start_point would take when trying to reach end_points given the current game state.
@@ -68,63 +394,118 @@ class ShortestPathFinder:
         if game_state.contains_stationary_unit(start_point):
             return
 
-        #Initialize map 
-        self.initialize_map(game_state)
-        #Fill in walls
-        for location in self.game_state.game_map:
-            if self.game_state.contains_stationary_unit(location):
-                self.game_map[location[0]][location[1]].blocked = True
-        #Do pathfinding
-        ideal_endpoints = self._idealness_search(start_point, end_points)
-        self._validate(ideal_endpoints, end_points)
-        return self._get_path(start_point, end_points)
+        if self.native:
+            return native_path.find_path(game_state.game_map.structure_bits(), end_points, start_point, initial_move_direction)
+        return self.get_path_table(end_points, game_state).path_from(start_point, initial_move_direction)
+
+    def get_path_table(self, end_points, game_state):
+        """Gets the PathTable toward end_points over the current structure layout
+
+        Tables are kept for the last MAX_CACHED_LAYOUTS layouts and edges, so every start
+        location pathing toward the same edge over the same board shares one table. A new
+        layout that is only a few structures away from the last one used for the edge, like
+        a board where a structure just died, gets a table repaired from that one rather than
+        searched from scratch.
+
+        Args:
+            * end_points: The end points of the units, should be a list of edge locations
+            * game_state: The current game state
+
+        Returns:
+            A PathTable answering path_from for every start location
+
+        """
+        edge = tuple(map(tuple, end_points))
+        key = (game_state.game_map.structure_bits(), edge)
+        table = self._path_tables.get(key)
+        if table is None:
+            if len(self._path_tables) >= MAX_CACHED_LAYOUTS:
+                del self._path_tables[next(iter(self._path_tables))]
+            blocked = game_state.game_map.blocked_locations()
+            parent = self._last_tables.get(edge)
+            if parent is not None:
+                table = parent.repaired(blocked)
+            if table is None:
+                table = PathTable(blocked, end_points, key[0] if self.native else None)
+            self._path_tables[key] = table
+        self._last_tables[edge] = table
+        return table
 
     def unsafe_pathfind(self, start_point, end_points, game_state, initial_move_direction=0):
         if game_state.contains_stationary_unit(start_point):
             return
 
-        #Initialize map 
-        self.initialize_map(game_state)
-        #Fill in walls
-        for location in self.game_state.game_map:
-            if self.game_state.contains_stationary_unit(location):
-                self.game_map[location[0]][location[1]].blocked = True
-        #Do pathfinding
-        ideal_endpoints = self._idealness_search(start_point, end_points)
-        self._validate(ideal_endpoints, end_points)
+        if self.native:
+            path = native_path.find_path(game_state.game_map.structure_bits(), end_points, start_point, initial_move_direction)
+            if len(path) == 1:
+                return
+            return path[1], self.VERTICAL if path[0][0] == path[1][0] else self.HORIZONTAL
+        return self.get_path_table(end_points, game_state).next_move(start_point, initial_move_direction)
 
-        return self._unsafe_get_next_move(start_point, end_points, initial_move_direction)
+    def search_path(self, start_point, end_points, game_state, initial_move_direction=0):
+        """Finds the same path as navigate_multiple_endpoints with a search over a fresh grid of Nodes
 
+        This is the search every PathTable is built to agree with, one pocket at a time and without
+        any caching. It is much slower, but leaves its grid in place for print_map.
+
+        Args:
+            * start_point: The starting location of the unit
+            * end_points: The end points of the unit, should be a list of edge locations
+            * game_state: The current game state
+            * initial_move_direction: The direction of the unit's last move, for a unit that is re-pathing mid-walk
+
+        Returns:
+            The path a unit at start_point would take, or None if start_point is blocked
+
+        """
+        if game_state.contains_stationary_unit(start_point):
+            return
+
+        self.initialize_map(game_state)
+        for x, y in game_state.game_map.blocked_locations():
+            self.game_map[x][y].blocked = True
+        ideal_tile = self._idealness_search(start_point, end_points)
+        self._validate(ideal_tile, end_points)
+        return self._get_path(start_point, end_points, initial_move_direction)
 
     def _idealness_search(self, start, end_points):
         """
         Finds the most ideal tile in our 'pocket' of pathable space. 
         The edge if it is available, or the best self destruct location otherwise
         """
-        current = queue.Queue()
-        current.put(start)
-        best_idealness = self._get_idealness(start, end_points)
-        self.game_map[start[0]][start[1]].visited_idealness = True
-        most_ideal = start
+        nodes = [node for column in self.game_map for node in column]
+        ends = {x * 28 + y for x, y in end_points}
+        direction = self._get_direction_from_endpoints(end_points)
+        flip_x = direction[0] != 1
+        flip_y = direction[1] != 1
 
-        while not current.empty():
-            search_location = current.get()
-            for neighbor in self._get_neighbors(search_location):
-                if not self.game_state.game_map.in_arena_bounds(neighbor) or self.game_map[neighbor[0]][neighbor[1]].blocked:
+        best_idealness = self._get_idealness(start, end_points)
+        nodes[start[0] * 28 + start[1]].visited_idealness = True
+        most_ideal = None
+        # Each tile is queued at most once, so the frontier is a list read from the front
+        frontier = [start[0] * 28 + start[1]]
+        head = 0
+        while head < len(frontier):
+            index = frontier[head]
+            head += 1
+            for neighbor in NEIGHBORS[index]:
+                node = nodes[neighbor]
+                # A visited tile's idealness was already compared when it was queued
+                if node.blocked or node.visited_idealness:
                     continue
+                node.visited_idealness = True
+                frontier.append(neighbor)
 
-                x, y = neighbor
-                current_idealness = self._get_idealness(neighbor, end_points)
-
-                if current_idealness > best_idealness:
-                    best_idealness = current_idealness
+                if neighbor in ends:
+                    idealness = sys.maxsize
+                else:
+                    x, y = divmod(neighbor, 28)
+                    idealness = 28 * (27 - y if flip_y else y) + (27 - x if flip_x else x)
+                if idealness > best_idealness:
+                    best_idealness = idealness
                     most_ideal = neighbor
 
-                if not self.game_map[x][y].visited_idealness and not self.game_map[x][y].blocked:
-                    self.game_map[x][y].visited_idealness = True
-                    current.put(neighbor)
-
-        return most_ideal
+        return start if most_ideal is None else list(divmod(most_ideal, 28))
 
     def _get_neighbors(self, location):
         """Get the locations adjacent to a location
@@ -179,46 +560,40 @@ class ShortestPathFinder:
         """Breadth first search of the grid, setting the pathlengths of each node
 
         """
-        #VALIDATION
-        #Add our most ideal tiles to current
-        current = queue.Queue()
-        if ideal_tile in end_points:
-            for location in end_points:
-               current.put(location)
-               #Set current pathlength to 0
-               self.game_map[location[0]][location[1]].pathlength = 0
-               self.game_map[location[0]][location[1]].visited_validate = True
-        else:
-            current.put(ideal_tile)
-            self.game_map[ideal_tile[0]][ideal_tile[1]].pathlength = 0
-            self.game_map[ideal_tile[0]][ideal_tile[1]].visited_validate = True
-
-        #While current is not empty
-        while not current.empty():
-            current_location = current.get()
-            current_node = self.game_map[current_location[0]][current_location[1]]
-            for neighbor in self._get_neighbors(current_location):
-                if not self.game_state.game_map.in_arena_bounds(neighbor) or self.game_map[neighbor[0]][neighbor[1]].blocked:
-                    continue
-
-                neighbor_node = self.game_map[neighbor[0]][neighbor[1]]
-                if not neighbor_node.visited_validate and not current_node.blocked:
+        nodes = [node for column in self.game_map for node in column]
+        #Add our most ideal tiles to the frontier, with a pathlength of 0
+        frontier = [x * 28 + y for x, y in (end_points if ideal_tile in end_points else [ideal_tile])]
+        for index in frontier:
+            nodes[index].pathlength = 0
+            nodes[index].visited_validate = True
+
+        head = 0
+        while head < len(frontier):
+            current_node = nodes[frontier[head]]
+            neighbors = NEIGHBORS[frontier[head]]
+            head += 1
+            # Blocked end points are queued too, but nothing paths through them
+            if current_node.blocked:
+                continue
+            for neighbor in neighbors:
+                neighbor_node = nodes[neighbor]
+                if not neighbor_node.visited_validate and not neighbor_node.blocked:
                     neighbor_node.pathlength = current_node.pathlength + 1
                     neighbor_node.visited_validate = True
-                    current.put(neighbor)
+                    frontier.append(neighbor)
 
         #debug_write("Print after validate")
         #self.print_map()
         return
 
-    def _get_path(self, start_point, end_points):
+    def _get_path(self, start_point, end_points, initial_move_direction=0):
         """Once all nodes are validated, and a target is found, the unit can path to its target
 
         """
         #GET THE PATH
         path = [start_point]
         current = start_point
-        move_direction = 0
+        move_direction = initial_move_direction
 
         while not self.game_map[current[0]][current[1]].pathlength == 0:
             #debug_write("current tile {} has cost {}".format(current, self.game_map[current[0]][current[1]].pathlength))
@@ -235,28 +610,6 @@ class ShortestPathFinder:
         #debug_write(path)
         return path
 
-    def _unsafe_get_next_move(self, start_point, end_points, initial_move_direction=0):
-        """Once all nodes are validated, and a target is found, the unit can path to its target
-
-        """
-        #GET THE PATH
-        path = [start_point]
-        current = start_point
-        move_direction = initial_move_direction
-
-        if self.game_map[current[0]][current[1]].pathlength == 0: return
-
-        next_move = self._choose_next_move(current, move_direction, end_points)
-        #debug_write(next_move)
-
-        if current[0] == next_move[0]:
-            move_direction = self.VERTICAL
-        else:
-            move_direction = self.HORIZONTAL
-        
-        #debug_write(path)
-        return next_move, move_direction
-  
     def _choose_next_move(self, current_point, previous_move_direction, end_points):
         """Given the current location and adjacent locations, return the best 'next step' for a given unit to take
         """
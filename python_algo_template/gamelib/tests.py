@@ -1,7 +1,68 @@
 import unittest
 import json
+import queue
+import random
 from .game_state import GameState
 from .unit import GameUnit
+from .navigation import ShortestPathFinder, PathTable
+from . import native_path
+
+class QueuePathFinder(ShortestPathFinder):
+    """The queue.Queue searches ShortestPathFinder used before its flat index ones, kept as a reference for them"""
+
+    def __init__(self):
+        super().__init__(native=False)
+
+    def _idealness_search(self, start, end_points):
+        current = queue.Queue()
+        current.put(start)
+        best_idealness = self._get_idealness(start, end_points)
+        self.game_map[start[0]][start[1]].visited_idealness = True
+        most_ideal = start
+
+        while not current.empty():
+            search_location = current.get()
+            for neighbor in self._get_neighbors(search_location):
+                if not self.game_state.game_map.in_arena_bounds(neighbor) or self.game_map[neighbor[0]][neighbor[1]].blocked:
+                    continue
+
+                x, y = neighbor
+                current_idealness = self._get_idealness(neighbor, end_points)
+
+                if current_idealness > best_idealness:
+                    best_idealness = current_idealness
+                    most_ideal = neighbor
+
+                if not self.game_map[x][y].visited_idealness and not self.game_map[x][y].blocked:
+                    self.game_map[x][y].visited_idealness = True
+                    current.put(neighbor)
+
+        return most_ideal
+
+    def _validate(self, ideal_tile, end_points):
+        current = queue.Queue()
+        if ideal_tile in end_points:
+            for location in end_points:
+               current.put(location)
+               self.game_map[location[0]][location[1]].pathlength = 0
+               self.game_map[location[0]][location[1]].visited_validate = True
+        else:
+            current.put(ideal_tile)
+            self.game_map[ideal_tile[0]][ideal_tile[1]].pathlength = 0
+            self.game_map[ideal_tile[0]][ideal_tile[1]].visited_validate = True
+
+        while not current.empty():
+            current_location = current.get()
+            current_node = self.game_map[current_location[0]][current_location[1]]
+            for neighbor in self._get_neighbors(current_location):
+                if not self.game_state.game_map.in_arena_bounds(neighbor) or self.game_map[neighbor[0]][neighbor[1]].blocked:
+                    continue
+
+                neighbor_node = self.game_map[neighbor[0]][neighbor[1]]
+                if not neighbor_node.visited_validate and not current_node.blocked:
+                    neighbor_node.pathlength = current_node.pathlength + 1
+                    neighbor_node.visited_validate = True
+                    current.put(neighbor)
 
 class BasicTests(unittest.TestCase):
 
@@ -235,6 +296,151 @@ class BasicTests(unittest.TestCase):
             game.game_map.add_unit("FF", [13,13])
         self.assertEqual(1, len(game.game_map[13,13]), "Towers seem to be stacking")
         
+    def test_fork(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13,6], 0)
+        child = game.fork()
+        child.game_map.add_unit("SI", [13,0], 0)
+        child.game_map[13,6][0].health -= 10
+        child.game_map.remove_unit([13,6])
+        self.assertEqual(0, len(game.game_map[13,0]), "Units added to a fork should not appear on the parent")
+        self.assertEqual(1, len(game.game_map[13,6]), "Units removed from a fork should stay on the parent")
+        self.assertEqual(90, game.game_map[13,6][0].health, "Damage dealt on a fork should not reach the parent")
+        child.attempt_spawn("DF", [13,7])
+        self.assertEqual([], game._build_stack, "The build queue of a fork should be independent")
+        self.assertNotEqual(game.get_resource(game.SP), child.get_resource(game.SP), "The resources of a fork should be independent")
+
+    def test_cached_paths(self):
+        game = self.make_turn_0_map()
+        for location in [[10,12], [11,12], [12,12], [13,12], [14,12], [15,12], [16,12], [5,10], [6,9], [7,8]]:
+            game.game_map.add_unit("FF", location, 0)
+        # A sealed pocket, so units starting in it need a self destruct path
+        for location in [[20,5], [21,4], [21,6], [22,5]]:
+            game.game_map.add_unit("FF", location, 0)
+        starts = [[13,0], [14,0], [3,10], [24,10], [13,11], [21,5], [13,27], [8,20]]
+        for _ in range(2):
+            for start in starts:
+                fresh = game.fork()
+                fresh._shortest_path_finder = ShortestPathFinder()
+                self.assertEqual(fresh.find_path_to_edge(start), game.find_path_to_edge(start), "Cached path from {} differs from a fresh search".format(start))
+        game.game_map.remove_unit([13,12])
+        for start in starts:
+            fresh = game.fork()
+            fresh._shortest_path_finder = ShortestPathFinder()
+            self.assertEqual(fresh.find_path_to_edge(start), game.find_path_to_edge(start), "Cached path from {} was not invalidated by a structure change".format(start))
+
+    def test_repaired_paths(self):
+        game = self.make_turn_0_map()
+        for location in [[10,12], [11,12], [12,12], [13,12], [14,12], [15,12], [16,12], [20,5], [21,4], [21,6], [22,5]]:
+            game.game_map.add_unit("FF", location, 0)
+        starts = [[13,0], [14,0], [3,10], [24,10], [13,11], [21,5], [20,6], [8,20]]
+        # Open and close the wall line, the sealed pocket and an edge tile, one structure at a time
+        changes = [([13,12], False), ([21,4], False), ([21,4], True), ([14,0], True), ([13,12], True), ([12,12], False), ([14,0], False)]
+        for location, blocked in changes:
+            for start in starts:
+                if not game.contains_stationary_unit(start):
+                    game.find_path_to_edge(start)
+            if blocked:
+                game.game_map.add_unit("FF", location, 0)
+            else:
+                game.game_map.remove_unit(location)
+            for start in starts:
+                if game.contains_stationary_unit(start):
+                    continue
+                for direction in [0, 1, 2]:
+                    fresh = game.fork()
+                    fresh._shortest_path_finder = ShortestPathFinder()
+                    self.assertEqual(fresh.find_path_to_edge(start, initial_move_direction=direction), game.find_path_to_edge(start, initial_move_direction=direction), "Repaired path from {} differs from a fresh search after changing {}".format(start, location))
+
+    def test_search_matches_queue_search(self):
+        rng = random.Random(16)
+        for _ in range(8):
+            game = self.make_turn_0_map()
+            cells = list(game.game_map)
+            for location in rng.sample(cells, rng.randrange(20, 160)):
+                game.game_map.add_unit("FF", location, rng.randrange(2))
+            for start in rng.sample(cells, 10):
+                if game.contains_stationary_unit(start):
+                    continue
+                end_points = game.game_map.get_edge_locations(game.get_target_edge(start))
+                for direction in [0, 1, 2]:
+                    fresh = game.fork()
+                    fresh._shortest_path_finder = ShortestPathFinder(native=False)
+                    reference = QueuePathFinder().search_path(list(start), end_points, game, direction)
+                    self.assertEqual(reference, fresh.find_path_to_edge(list(start), initial_move_direction=direction), "Path from {} differs from the queue search".format(start))
+
+    def test_path_table(self):
+        rng = random.Random(17)
+        for _ in range(4):
+            game = self.make_turn_0_map()
+            cells = list(game.game_map)
+            for location in rng.sample(cells, rng.randrange(20, 160)):
+                game.game_map.add_unit("FF", location, rng.randrange(2))
+            for edge in range(4):
+                table = game.get_path_table(edge)
+                self.assertIs(table, game.get_path_table(edge), "The table should be reused while the structures stay the same")
+                for start in rng.sample(cells, 20):
+                    if game.contains_stationary_unit(start):
+                        self.assertIsNone(table.path_from(list(start)))
+                        continue
+                    for direction in [0, 1, 2]:
+                        self.assertEqual(game.find_path_to_edge(list(start), edge, direction), table.path_from(list(start), direction), "Path from {} differs from find_path_to_edge".format(start))
+            game.game_map.remove_unit(next(iter(game.game_map.blocked_locations())))
+            self.assertIsNot(table, game.get_path_table(3), "Changing the structures should give a new table")
+
+    def test_repaired_path_tables(self):
+        rng = random.Random(19)
+        game = self.make_turn_0_map()
+        cells = list(game.game_map)
+        for _ in range(40):
+            blocked = frozenset(rng.sample(cells, rng.randrange(0, 300)))
+            for edge in game.game_map.get_edges():
+                table = PathTable(blocked, edge)
+                for _ in range(4):
+                    # Mostly structures dying, as in a simulation, sometimes new ones
+                    if blocked and rng.random() < 0.6:
+                        changed = rng.sample(sorted(blocked), min(len(blocked), rng.randrange(1, 5)))
+                    else:
+                        changed = rng.sample(cells, rng.randrange(1, 5))
+                    blocked = blocked ^ frozenset(changed)
+                    table = table.repaired(blocked)
+                    fresh = PathTable(blocked, edge)
+                    self.assertEqual(fresh.pathlengths, table.pathlengths, "Repaired pathlengths differ from a fresh table after changing {}".format(sorted(changed)))
+                    self.assertEqual(fresh.ideal_tiles, table.ideal_tiles, "Repaired pockets differ from a fresh table after changing {}".format(sorted(changed)))
+        self.assertIsNone(PathTable(frozenset(), edge).repaired(frozenset(cells[:5])), "A layout more than MAX_REPAIRED_CELLS away should be searched again")
+
+    @unittest.skipUnless(native_path.LIBRARY, "the native pathfinding core is not built")
+    def test_native_paths(self):
+        rng = random.Random(18)
+        for _ in range(8):
+            game = self.make_turn_0_map()
+            cells = list(game.game_map)
+            for location in rng.sample(cells, rng.randrange(20, 160)):
+                game.game_map.add_unit("FF", location, rng.randrange(2))
+            python = game.fork()
+            python._shortest_path_finder = ShortestPathFinder(native=False)
+            for start in rng.sample(cells, 10):
+                for edge in range(4):
+                    for direction in [0, 1, 2]:
+                        self.assertEqual(python.find_path_to_edge(list(start), edge, direction), game.find_path_to_edge(list(start), edge, direction), "Native path from {} differs from the Python one".format(start))
+                        self.assertEqual(python.unsafe_pathfind(list(start), edge, direction), game.unsafe_pathfind(list(start), edge, direction), "Native next move from {} differs from the Python one".format(start))
+
+    @unittest.skipUnless(native_path.TABLE_BUILDER, "the native pathfinding core is not built")
+    def test_native_path_tables(self):
+        rng = random.Random(20)
+        game = self.make_turn_0_map()
+        cells = list(game.game_map)
+        for _ in range(40):
+            blocked = frozenset(rng.sample(cells, rng.randrange(0, 300)))
+            structures = sum(1 << (x * 28 + y) for x, y in blocked)
+            for edge in game.game_map.get_edges():
+                python = PathTable(blocked, edge)
+                native = PathTable(blocked, edge, structures)
+                self.assertEqual(python.pathlengths, native.pathlengths, "Native pathlengths differ from the Python ones")
+                self.assertEqual(python.ideal_tiles, native.ideal_tiles, "Native pockets differ from the Python ones")
+                changed = frozenset(rng.sample(cells, 3))
+                self.assertEqual(python.repaired(blocked ^ changed).pathlengths, native.repaired(blocked ^ changed).pathlengths, "A native table should repair like a Python one")
+
     def test_get_units_in_range(self):
         game = self.make_turn_0_map()
         self.assertEqual(1, len(game.game_map.get_locations_in_range([13,13], 0)), "We should be in 0 range of ourself")
@@ -256,6 +462,135 @@ class BasicTests(unittest.TestCase):
         game.game_map.add_unit("DF", [14,14], 1)
         self.assertEqual(3, len(game.get_attackers([13,13], 0)), "We should be in danger from 3 places")
 
+    def test_attacker_index(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [12,14], 1)
+        game.game_map.add_unit("DF", [16,13], 1)
+        game.game_map.add_unit("FF", [13,14], 1)
+        self.assertEqual([[12,14]], [[unit.x, unit.y] for unit in game.get_attackers([13,13], 0)], "Only the turret in range should attack")
+        game.unsafe_upgrade([16,13])
+        self.assertEqual([[12,14], [16,13]], [[unit.x, unit.y] for unit in game.get_attackers([13,13], 0)], "Upgrading a turret should extend its range")
+        child = game.fork()
+        child.game_map.discard_unit(child.game_map[12,14][0])
+        child.game_map.add_unit("DF", [14,14], 0)
+        self.assertEqual([[16,13]], [[unit.x, unit.y] for unit in child.get_attackers([13,13], 0)], "Removed turrets should stop attacking")
+        self.assertEqual([[14,14]], [[unit.x, unit.y] for unit in child.get_attackers([13,13], 1)], "New turrets should attack the other player")
+        self.assertEqual(2, len(game.get_attackers([13,13], 0)), "Changes to a fork should not reach the parent's index")
+        game.game_map.remove_unit([12,14])
+        self.assertEqual(1, len(game.get_attackers([13,13], 0)), "Removed turrets should stop attacking")
+
+    def test_target_index(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("FF", [13,15], 1)
+        game.game_map.add_unit("FF", [12,14], 1)
+        game.game_map.add_unit("FF", [14,14], 1)
+        game.game_map.add_unit("EI", [13,13], 0)
+        demolisher = game.game_map[13,13][0]
+        self.assertEqual([12,14], [game.get_target(demolisher).x, game.get_target(demolisher).y], "Ties in distance should go to the structure furthest from the center")
+        game.game_map[14,14][0].health = 10
+        self.assertEqual([14,14], [game.get_target(demolisher).x, game.get_target(demolisher).y], "Ties in distance should go to the weakest structure")
+        child = game.fork()
+        child.game_map.add_unit("PI", [13,17], 1)
+        self.assertEqual("PI", child.get_target(child.game_map[13,13][0]).unit_type, "Mobile units should be targeted before structures")
+        child.game_map.discard_unit(child.game_map[13,17][0])
+        child.game_map.remove_unit([14,14])
+        self.assertEqual([12,14], [child.get_target(child.game_map[13,13][0]).x, child.get_target(child.game_map[13,13][0]).y], "Removed units should not be targeted")
+        self.assertEqual([14,14], [game.get_target(demolisher).x, game.get_target(demolisher).y], "Changes to a fork should not reach the parent's index")
+
+    def test_zobrist_hash(self):
+        game = self.make_turn_0_map()
+        other = self.make_turn_0_map()
+        empty = game.game_map.zobrist_hash
+        game.game_map.add_unit("DF", [13,13], 0)
+        game.game_map.add_unit("FF", [14,13], 0)
+        game.game_map.add_unit("PI", [13,0], 0)
+        other.game_map.add_unit("PI", [13,0], 0)
+        other.game_map.add_unit("FF", [14,13], 0)
+        other.game_map.add_unit("DF", [13,13], 0)
+        self.assertEqual(game.game_map.zobrist_hash, other.game_map.zobrist_hash, "The same units should hash the same whatever order they were added in")
+        child = game.fork()
+        self.assertEqual(game.game_map.zobrist_hash, child.game_map.zobrist_hash, "A fork should hash like its parent")
+        child.game_map.upgrade_unit([13,13])
+        self.assertNotEqual(game.game_map.zobrist_hash, child.game_map.zobrist_hash, "Upgrading should change the hash")
+        child.game_map.set_health(child.game_map[14,13][0], 10)
+        child.game_map.discard_unit(child.game_map[13,0][0])
+        changed = child.game_map.zobrist_hash
+        child.game_map[0,13] = []
+        self.assertEqual(changed, child.game_map.zobrist_hash, "Replacing a cell list should rehash the map")
+        child = game.fork()
+        child.game_map.set_health(child.game_map[14,13][0], child.game_map[14,13][0].health - 0.5)
+        self.assertNotEqual(game.game_map.zobrist_hash, child.game_map.zobrist_hash, "Any change of health should change the hash")
+        child.game_map.move_unit(child.game_map[13,0][0], [13,1])
+        self.assertEqual((1, 0), (len(child.game_map[13,1]), len(child.game_map[13,0])), "move_unit should move the unit between cells")
+        moved = child.game_map.zobrist_hash
+        child.game_map[0,13] = []
+        self.assertEqual(moved, child.game_map.zobrist_hash, "Moves and health changes should hash like a map hashed from scratch")
+        child = game.fork()
+        single = child.game_map.zobrist_hash
+        child.game_map.add_unit("PI", [13,0], 0)
+        child.game_map.add_unit("PI", [13,0], 0)
+        self.assertNotEqual(single, child.game_map.zobrist_hash, "Identical units stacked on a cell should not cancel out")
+        stacked = child.game_map.zobrist_hash
+        child.game_map[0,13] = []
+        self.assertEqual(stacked, child.game_map.zobrist_hash, "A stack should hash like one hashed from scratch")
+        child.game_map.set_health(child.game_map[13,0][0], 5)
+        child.game_map.set_health(child.game_map[13,0][0], 5)
+        child.game_map.move_unit(child.game_map[13,0][2], [13,1])
+        child.game_map.move_unit(child.game_map[13,1][0], [13,0])
+        child.game_map.set_health(child.game_map[13,0][1], child.game_map[13,0][2].health)
+        child.game_map.set_health(child.game_map[13,0][0], child.game_map[13,0][2].health)
+        self.assertEqual(stacked, child.game_map.zobrist_hash, "Changing units of a stack and back should restore its hash")
+        child.game_map.discard_unit(child.game_map[13,0][0])
+        child.game_map.discard_unit(child.game_map[13,0][0])
+        self.assertEqual(single, child.game_map.zobrist_hash, "Discarding stacked units should restore the hash")
+        game.game_map.remove_unit([13,13])
+        game.game_map.remove_unit([14,13])
+        game.game_map.remove_unit([13,0])
+        self.assertEqual(empty, game.game_map.zobrist_hash, "Removing every unit should restore the empty hash")
+
+    def test_map_iteration(self):
+        game = self.make_turn_0_map()
+        cells = list(game.game_map)
+        self.assertEqual((420, (13,0), (14,27)), (len(cells), cells[0], cells[-1]), "Iterating should visit every location on the board, row by row")
+        self.assertEqual(420 * 420, sum(1 for _ in game.game_map for _ in game.game_map), "Nested iterations should not interfere")
+        game.game_map.add_unit("FF", [14,13], 0)
+        game.game_map.add_unit("PI", [13,0], 1)
+        game.game_map.add_unit("PI", [13,0], 1)
+        self.assertEqual([((13,0), 2), ((14,13), 1)], [(location, len(units)) for location, units in game.game_map.occupied()], "occupied should only visit locations holding units")
+
+    def test_structure_bits(self):
+        from .game_map import location_bit
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13,13], 0)
+        game.game_map.add_unit("FF", [14,13], 0)
+        game.game_map.add_unit("EF", [13,14], 1)
+        game.game_map.add_unit("PI", [13,0], 0)
+        self.assertEqual(location_bit(13,13) | location_bit(14,13) | location_bit(13,14), game.game_map.structure_bits(), "Every structure should be in the bitboard")
+        self.assertEqual(location_bit(13,14), game.game_map.structure_bits(1), "Only player 1's structures should be in its bitboard")
+        self.assertEqual(location_bit(13,13), game.game_map.structure_bits(0, "DF"), "Only player 0's turrets should be in its turret bitboard")
+        child = game.fork()
+        child.game_map.remove_unit([13,13])
+        child.game_map.discard_unit(child.game_map[14,13][0])
+        child.game_map.add_unit("DF", [13,14], 0)
+        self.assertEqual((location_bit(13,14), 0), (child.game_map.structure_bits(0), child.game_map.structure_bits(1)), "The bitboards should follow units being removed and replaced")
+        self.assertEqual(location_bit(13,13) | location_bit(14,13), game.game_map.structure_bits(0), "Changes to a fork should not reach the parent")
+        self.assertEqual({(13,13), (14,13), (13,14)}, game.game_map.blocked_locations())
+        self.assertTrue(game.contains_stationary_unit([14,13]))
+        self.assertFalse(game.contains_stationary_unit([13,0]))
+
+    def test_unit_stats(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13,13], 0)
+        game.game_map.add_unit("DF", [14,13], 0)
+        turret = game.game_map[13,13][0]
+        turret.upgrade()
+        self.assertEqual((True, 3.5, 15.0, [6.0, 0]), (turret.upgraded, turret.attackRange, turret.damage_i, turret.cost), "Upgrading should switch to the upgraded stats")
+        self.assertEqual((False, 2.5, 5.0, [2.0, 0]), (game.game_map[14,13][0].upgraded, game.game_map[14,13][0].attackRange, game.game_map[14,13][0].damage_i, game.game_map[14,13][0].cost), "Upgrading should not change other units of the same type")
+        child = game.fork()
+        child.game_map[13,13][0].health = 1
+        child.game_map[14,13][0].upgrade()
+        self.assertEqual((90.0, False), (turret.health, game.game_map[14,13][0].upgraded), "Changes to units of a fork should not reach the parent")
+
     def test_print_unit(self):
         game = self.make_turn_0_map()
 
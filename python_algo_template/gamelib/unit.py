@@ -9,9 +9,75 @@ def is_stationary(unit_type, structure_types):
     return unit_type in structure_types
 
 
+class UnitStats:
+    """The stats shared by every unit of one type and upgrade level, see GameUnit for what each one means.
+
+    Tables are built once per config by unit_stats and shared by all units made from that config.
+    """
+    __slots__ = ("config", "upgraded", "stationary", "speed", "damage_f", "damage_i", "attackRange", "shieldRange",
+                 "max_health", "shieldPerUnit", "shieldBonusPerY", "cost")
+
+    def __init__(self, config, type_config, base=None):
+        self.config = config
+        if base is None:
+            self.upgraded = False
+            self.stationary = type_config["unitCategory"] == 0
+            self.speed = type_config.get("speed", 0)
+            self.damage_f = type_config.get("attackDamageTower", 0)
+            self.damage_i = type_config.get("attackDamageWalker", 0)
+            self.attackRange = type_config.get("attackRange", 0)
+            self.shieldRange = type_config.get("shieldRange", 0)
+            self.max_health = type_config.get("startHealth", 0)
+            self.shieldPerUnit = type_config.get("shieldPerUnit", 0)
+            self.shieldBonusPerY = type_config.get("shieldBonusPerY", 0)
+            self.cost = (type_config.get("cost1", 0), type_config.get("cost2", 0))
+        else:
+            upgrade = type_config.get("upgrade", {})
+            self.upgraded = True
+            self.stationary = base.stationary
+            self.speed = upgrade.get("speed", base.speed)
+            self.damage_f = upgrade.get("attackDamageTower", base.damage_f)
+            self.damage_i = upgrade.get("attackDamageWalker", base.damage_i)
+            self.attackRange = upgrade.get("attackRange", base.attackRange)
+            self.shieldRange = upgrade.get("shieldRange", base.shieldRange)
+            self.max_health = upgrade.get("startHealth", base.max_health)
+            self.shieldPerUnit = upgrade.get("shieldPerUnit", base.shieldPerUnit)
+            self.shieldBonusPerY = upgrade.get("shieldBonusPerY", base.shieldBonusPerY)
+            self.cost = (upgrade.get("cost1", 0) + base.cost[0], upgrade.get("cost2", 0) + base.cost[1])
+
+
+# id(config) -> (config, {(unit_type, upgraded): UnitStats}), the config is kept so its id is never reused
+_stat_tables = {}
+
+def unit_stats(config, unit_type, upgraded=False):
+    """
+        Args:
+            config: The game config the unit was made from
+            unit_type: A unit type
+            upgraded: Whether the unit is upgraded
+
+        Returns:
+            The shared UnitStats for this type and upgrade level
+    """
+    entry = _stat_tables.get(id(config))
+    if entry is None or entry[0] is not config:
+        from .game_state import UNIT_TYPE_TO_INDEX
+        table = {}
+        for unit_type_ in UNIT_TYPE_TO_INDEX:
+            type_config = config["unitInformation"][UNIT_TYPE_TO_INDEX[unit_type_]]
+            if "unitCategory" in type_config:
+                table[unit_type_, False] = UnitStats(config, type_config)
+                table[unit_type_, True] = UnitStats(config, type_config, table[unit_type_, False])
+        entry = _stat_tables[id(config)] = (config, table)
+    return entry[1][unit_type, upgraded]
+
+
 class GameUnit:
     """Holds information about a Unit. 
 
+    Everything but the unit's position, owner, health and removal flag is read from a UnitStats table
+    shared with every other unit of the same type and upgrade level.
+
     Attributes :
         * unit_type (string): This unit's type
         * config (JSON): Contains information about the game
@@ -32,49 +98,46 @@ class GameUnit:
         * upgraded (boolean): If this unit is upgraded
 
     """
+    __slots__ = ("unit_type", "player_index", "pending_removal", "x", "y", "health", "__stats")
+
     def __init__(self, unit_type, config, player_index=None, health=None, x=-1, y=-1):
         """ Initialize unit variables using args passed
 
         """
         self.unit_type = unit_type
-        self.config = config
         self.player_index = player_index
         self.pending_removal = False
-        self.upgraded = False
         self.x = x
         self.y = y
-        self.__serialize_type()
+        self.__stats = unit_stats(config, unit_type)
         self.health = self.max_health if not health else health
 
-    def __serialize_type(self):
-        from .game_state import STRUCTURE_TYPES, UNIT_TYPE_TO_INDEX, SUPPORT
-        type_config = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[self.unit_type]]
-        self.stationary = type_config["unitCategory"] == 0
-        self.speed = type_config.get("speed", 0)
-        self.damage_f = type_config.get("attackDamageTower", 0)
-        self.damage_i = type_config.get("attackDamageWalker", 0)
-        self.attackRange = type_config.get("attackRange", 0)
-        self.shieldRange = type_config.get("shieldRange", 0)
-        self.max_health = type_config.get("startHealth", 0)
-        self.shieldPerUnit = type_config.get("shieldPerUnit", 0)
-        self.shieldBonusPerY = type_config.get("shieldBonusPerY", 0)
-        self.cost = [type_config.get("cost1", 0), type_config.get("cost2", 0)]
-
+    def __copy__(self):
+        unit = GameUnit.__new__(GameUnit)
+        unit.unit_type = self.unit_type
+        unit.player_index = self.player_index
+        unit.pending_removal = self.pending_removal
+        unit.x = self.x
+        unit.y = self.y
+        unit.health = self.health
+        unit.__stats = self.__stats
+        return unit
 
     def upgrade(self):
-        from .game_state import UNIT_TYPE_TO_INDEX
-        type_config = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[self.unit_type]].get("upgrade", {})
-        self.speed = type_config.get("speed", self.speed)
-        self.damage_f = type_config.get("attackDamageTower", self.damage_f)
-        self.damage_i = type_config.get("attackDamageWalker", self.damage_i)
-        self.attackRange = type_config.get("attackRange", self.attackRange)
-        self.shieldRange = type_config.get("shieldRange", self.shieldRange)
-        self.max_health = type_config.get("startHealth", self.max_health)
-        self.shieldPerUnit = type_config.get("shieldPerUnit", self.shieldPerUnit)
-        self.shieldBonusPerY = type_config.get("shieldBonusPerY", self.shieldBonusPerY)
-        self.cost = [type_config.get("cost1", 0) + self.cost[0], type_config.get("cost2", 0) + self.cost[1]]
-        self.upgraded = True
+        self.__stats = unit_stats(self.config, self.unit_type, True)
 
+    config = property(lambda self: self.__stats.config)
+    upgraded = property(lambda self: self.__stats.upgraded)
+    stationary = property(lambda self: self.__stats.stationary)
+    speed = property(lambda self: self.__stats.speed)
+    damage_f = property(lambda self: self.__stats.damage_f)
+    damage_i = property(lambda self: self.__stats.damage_i)
+    attackRange = property(lambda self: self.__stats.attackRange)
+    shieldRange = property(lambda self: self.__stats.shieldRange)
+    max_health = property(lambda self: self.__stats.max_health)
+    shieldPerUnit = property(lambda self: self.__stats.shieldPerUnit)
+    shieldBonusPerY = property(lambda self: self.__stats.shieldBonusPerY)
+    cost = property(lambda self: list(self.__stats.cost))
 
     def __toString(self):
         owner = "Friendly" if self.player_index == 0 else "Enemy"
@@ -10,11 +10,23 @@ import copy
 from collections import Counter
 
 SPAWNING_LOCATIONS = [[0, 13], [1, 12], [2, 11], [3, 10], [4, 9], [5, 8], [6, 7], [7, 6], [8, 5], [9, 4], [10, 3], [11, 2], [12, 1], [13, 0], [14, 0], [15, 1], [16, 2], [17, 3], [18, 4], [19, 5], [20, 6], [21, 7], [22, 8], [23, 9], [24, 10], [25, 11], [26, 12], [27, 13]]
+# A structure change further than this from an attack's path cannot change how the attack plays out
+# (longest attack range is 4.5, longest shield range is 6)
+DANGER_RADIUS = 6
+
 ENEMY_SPAWNING_LOCATIONS = [[13, 27], [14, 27], [12, 26], [15, 26], [11, 25], [16, 25], [10, 24], [17, 24], [9, 23], [18, 23], [8, 22], [19, 22], [7, 21], [20, 21], [6, 20], [21, 20], [5, 19], [22, 19], [4, 18], [23, 18], [3, 17], [24, 17], [2, 16], [25, 16], [1, 15], [26, 15], [0, 14], [27, 14]]
 
+def board_snapshot(state):
+	# Every occupied cell and what is on it, two states with equal snapshots simulate the same way
+	return {(x, y) : tuple((unit.unit_type, unit.player_index, unit.health, unit.upgraded) for unit in cell) for (x, y), cell in state.game_map.occupied()}
+
 class Optimizer:
-	def __init__(self, initial_board_state, hparams):
+	def __init__(self, initial_board_state, hparams, pool=None, deadline=None, hints=None):
 		self.initial_board_state = initial_board_state
+		self.pool = pool # simulation_pool.SimulationPool, or None to simulate serially
+		self.deadline = deadline # time.time() after which no more candidates are simulated, None for no limit
+		self.hints = hints if hints is not None else {} # best locations found on earlier turns, simulated first
+		self.danger_memo = {} # (enemy MP, spawn location) -> (board hash, board, path, result), see simulate_danger
 		self.danger_zone_priority = {
 			"LL" : [[4, 13], [4, 12], [0, 13], [3, 13], [3, 12],  [1, 13], [2, 13], [2, 12],  [3, 11], [4, 11], [5, 13], [5, 12], [5, 11]],
 			"L" : [[4, 13], [4, 12], [10, 13], [10, 12], [5, 13], [5, 12], [9, 13], [9, 12], [5, 11], [9, 11], [4, 11], [10, 11]],
@@ -31,6 +43,26 @@ class Optimizer:
 
 		# self.support_priority = [[14, 1], [13, 2], [12, 3], [11, 4], [10, 5], [9, 6], [8, 7], [7, 8], [6, 9], [15, 1], [14, 2], [13, 3], [12, 4], [11, 5], [10, 6], [9, 7], [8, 8], [15, 2], [14, 3], [13, 4], [12, 5], [11, 6], [10, 7], [9, 8], [7, 9], [8, 9]]
 
+	def simulate_many(self, state, candidates, first=()):
+		"""
+		Simulates candidates until the deadline, those whose index is in first before
+		the others. Results come back in the order of candidates, None for every
+		candidate that was not simulated in time.
+		"""
+		order = sorted(range(len(candidates)), key=lambda i: i not in first)
+		ordered = [candidates[i] for i in order]
+		if self.pool is not None:
+			ordered_results = self.pool.simulate_many(state, ordered, self.deadline)
+		else:
+			ordered_results = Simulator.simulate_many(state, ordered, self.deadline)
+			if None in ordered_results:
+				gamelib.debug_write(f"Turn deadline passed, {ordered_results.count(None)} of {len(candidates)} candidates skipped")
+
+		results = [None] * len(candidates)
+		for i, result in zip(order, ordered_results):
+			results[i] = result
+		return results
+
 	def optimize_offense(self): # Returns the optimal location and unit for a scout/demo swarm. Returns None if no good move
 		best = self.hparams["best"]
 		bestloc = None
@@ -41,10 +73,10 @@ class Optimizer:
 		if num_scouts > self.hparams["minscouts"]:
 			best = 0
 
+		candidates = []
 		for loc in SPAWNING_LOCATIONS:
 			if self.initial_board_state.contains_stationary_unit(loc): continue
 			# for self_destruct in range(allow_sd + 1):
-			new_state = copy.deepcopy(self.initial_board_state)
 
 			for offset in [[-1, -2], [0, -2], [1, -2], [1, -1], [-1, -1],  [0, -1], [-2, -1], [2, -1], [2, 0], [-2, 0], [-1, 0], [1, 0], [-1, 1], [0, 1], [1, 1], [-2, 1], [2, 1], [-1, 2], [0, 2], [1, 2]]:
 				val = [offset[0] + loc[0], offset[1] + loc[1]]
@@ -52,14 +84,17 @@ class Optimizer:
 				if not self.initial_board_state.game_map.in_arena_bounds(val): continue
 				if self.initial_board_state.contains_stationary_unit(val): continue
 				break
-			
-			new_state.unsafe_spawn("PI", loc, num=num_scouts)
-
-			new_state.unsafe_spawn("EF", val)
 
 			# if self_destruct: new_state.unsafe_spawn("DF", [5, 10])
 
-			PD, SPD, SPD2, _, _, _ = Simulator(new_state).simulate()
+			candidates.append((loc, val, [("PI", loc, num_scouts, 0), ("EF", val, 1, 0)]))
+
+		first = [i for i, (loc, _, _) in enumerate(candidates) if loc == self.hints.get("offense")]
+		results = self.simulate_many(self.initial_board_state, [spawns for _, _, spawns in candidates], first)
+
+		for (loc, val, _), result in zip(candidates, results):
+			if result is None: continue # missed the turn deadline
+			PD, SPD, SPD2, _, _, _ = result
 			# print(loc, PD, SPD, SPD2)
 			score = PD * self.hparams["attack_(s)pdratio"] + SPD #- self_destruct
 			if (PD > 0 or SPD > 3) and score > best:
@@ -68,6 +103,8 @@ class Optimizer:
 				shieldloc = val
 				# sding = self_destruct
 
+		if bestloc is not None:
+			self.hints["offense"] = bestloc
 		return bestloc, shieldloc
 
 	def optimize_defense_mandatory(self, sp, force_upgrade_turrets=True):
@@ -258,30 +295,79 @@ class Optimizer:
 		best_paths = set()
 		walls_in_danger = []
 		best_values = []
+		candidates = []
 		for loc in ENEMY_SPAWNING_LOCATIONS:
 			if self.initial_board_state.contains_stationary_unit(loc): continue
 			for unit in ["PI"]:
-				new_state = copy.deepcopy(substate)
-				
-				new_state.unsafe_spawn(unit, loc, num=num, player=1)
-				for unit in new_state.game_map[loc[0], loc[1]]:
-					unit.health += 3
-				
-				PD, SPD, SPD2, walls_destroyed, route, values = Simulator(new_state).simulate()
-				walls_in_danger += walls_destroyed
-
-				score = PD * self.hparams["defend_(s)pdratio"] + SPD
-				if score > danger:
-					danger = score
-					best_paths = {route}
-					best_values = [values]
-				if score == danger:
-					best_paths.add(route)
-					best_values.append(values)
+				candidates.append([(unit, loc, num, 1, 3)])
+
+		dangerous = self.hints.get("danger", [])
+		first = [i for i, spawns in enumerate(candidates) if spawns[0][1] in dangerous]
+		worst = []
+		for spawns, result in zip(candidates, self.simulate_danger(substate, num, candidates, first)):
+			if result is None: continue # missed the turn deadline
+			PD, SPD, SPD2, walls_destroyed, route, values = result
+			walls_in_danger += walls_destroyed
+
+			score = PD * self.hparams["defend_(s)pdratio"] + SPD
+			if score > danger:
+				danger = score
+				best_paths = {route}
+				best_values = [values]
+				worst = []
+			if score == danger:
+				best_paths.add(route)
+				best_values.append(values)
+				worst.append(spawns[0][1])
+
+		if danger > 0:
+			self.hints["danger"] = worst
 
 		# gamelib.debug_write(danger, best_values, best_paths)
 		return danger, best_paths, walls_in_danger
 
+	def simulate_danger(self, substate, num, candidates, first=()):
+		"""
+		simulate_many for compute_danger's candidates, reusing results from earlier calls on this
+		optimizer. A result is reused when the board hashes the same as when it was simulated, or
+		when no structure changed within DANGER_RADIUS of the path the attack took. Attacks that
+		destroyed a structure re-path mid-simulation, so their path is unknown and only the first
+		rule applies to them.
+		"""
+		board_hash = substate.game_map.zobrist_hash
+		board = None # board_snapshot(substate), taken once a board has to be compared cell by cell
+		changes = {} # id(old board) -> cells that differ from board
+		results = [None] * len(candidates)
+		pending = []
+		for i, spawns in enumerate(candidates):
+			entry = self.danger_memo.get((num, tuple(spawns[0][1])))
+			if entry is not None and entry[0] == board_hash:
+				results[i] = entry[3]
+				continue
+			if entry is not None and entry[2] is not None:
+				_, old_board, path, result = entry
+				if board is None:
+					board = board_snapshot(substate)
+				if id(old_board) not in changes:
+					changes[id(old_board)] = [cell for cell in old_board.keys() | board.keys() if old_board.get(cell) != board.get(cell)]
+				if not any((x - px)**2 + (y - py)**2 <= DANGER_RADIUS**2 for x, y in changes[id(old_board)] for px, py in path):
+					results[i] = result
+					continue
+			pending.append(i)
+
+		if pending and board is None:
+			board = board_snapshot(substate)
+		simulated = self.simulate_many(substate, [candidates[i] for i in pending], [j for j, i in enumerate(pending) if i in first])
+		for i, result in zip(pending, simulated):
+			if result is None: continue # missed the turn deadline
+			results[i] = result
+			loc = candidates[i][0][1]
+			path = None
+			if result[1] == 0: # nothing destroyed, so the attack followed its path from the spawn location
+				path = substate.get_path_table(substate.get_target_edge(loc)).path_from(loc)
+			self.danger_memo[num, tuple(loc)] = (board_hash, board, path, result)
+		return results
+
 	# def compute_danger_loc(self, substate, loc, num):
 	# 	if self.initial_board_state.contains_stationary_unit(loc): return 0
 	# 	for unit in ["PI"]:
@@ -0,0 +1,234 @@
+import gamelib
+import argparse
+import json
+import os
+import sys
+import time
+from simulator import Simulator
+
+"""
+Measures how far Simulator drifts from the engine, using recorded .replay files.
+
+Every turn with mobile units is replayed from its first action frame, the board as the
+engine left it once both players had deployed. Simulator ticks once per recorded frame
+after that, and after each tick the units it holds are compared with the ones in the
+frame: a unit is its owner, type and location, and units found on one side only are
+position errors. Where both sides hold the same units at a location, their healths are
+compared in ascending order. Units with no health left are skipped on both sides.
+
+The divergence stats are printed together with the simulator's throughput, the frames it
+ticked per second of Simulator time (building it and ticking it, not parsing or comparing),
+so a speedup can be checked against what it costs in accuracy.
+
+With --arena, arena.ArenaSimulator is checked instead, the simulator arena games are played with.
+
+Usage, from this directory:
+	python replay_check.py [REPLAY_OR_FOLDER ...] [--arena] [--json]
+By default every .replay in ../replays is checked.
+"""
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "game-configs.json")
+REPLAY_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "replays")
+
+# Healths closer than this count as equal, the engine rounds shielding
+HEALTH_TOLERANCE = 0.01
+# Ticks Simulator may run past the last recorded frame before a turn is cut off
+MAX_EXTRA_TICKS = 100
+
+def load_replay(path):
+	"""
+	Reads a .replay file the way get_results.Replay.load_data does and returns its frames
+	keyed by (turn, frame). A turn's deploy phase is frame -1 and its action phase frames 0 and up.
+	"""
+	frames = {}
+	with open(path) as f:
+		for line in f:
+			line = line.replace("\n", "").replace("\t", "")
+			if line == '': continue
+			data = json.loads(line)
+			if 'debug' in data: continue
+			frames[(data["turnInfo"][1], data["turnInfo"][2])] = data
+	return frames
+
+def recorded_units(config, frame):
+	"""
+	Returns the units in a recorded frame as {(player_index, unit_type, x, y): sorted healths}.
+	"""
+	units = {}
+	for player_index, key in enumerate(["p1Units", "p2Units"]):
+		# The last two lists are the pending removals and upgrades, not units
+		for type_index, unit_list in enumerate(frame[key][:6]):
+			unit_type = config["unitInformation"][type_index]["shorthand"]
+			for x, y, health, *_ in unit_list:
+				if float(health) > 0:
+					units.setdefault((player_index, unit_type, int(x), int(y)), []).append(float(health))
+	for healths in units.values():
+		healths.sort()
+	return units
+
+def simulated_units(sim : Simulator):
+	"""
+	Returns the units Simulator holds, in the same form as recorded_units. A group of mobile
+	units is on the map once, its members' healths are in its GameUnitData.
+	"""
+	groups = {id(obj.unit) : obj for obj in sim.units if obj.healths is not None}
+	units = {}
+	for (x, y), cell in sim.state.game_map.occupied():
+		for unit in cell:
+			obj = groups.get(id(unit))
+			for health in ([unit.health] if obj is None else obj.healths):
+				if health > 0:
+					units.setdefault((unit.player_index, unit.unit_type, x, y), []).append(health)
+	for healths in units.values():
+		healths.sort()
+	return units
+
+def compare_units(recorded, simulated):
+	"""
+	Returns the number of units found on one side only and the health differences of the
+	units found on both.
+	"""
+	position_errors = 0
+	health_errors = []
+	for key in recorded.keys() | simulated.keys():
+		a, b = recorded.get(key, []), simulated.get(key, [])
+		if len(a) != len(b):
+			position_errors += abs(len(a) - len(b))
+			continue
+		health_errors.extend(abs(x - y) for x, y in zip(a, b))
+	return position_errors, health_errors
+
+def has_mobile_units(sim : Simulator):
+	return len(sim.scouts) + len(sim.interceptors) + len(sim.demolishers) > 0
+
+def check_turn(config, frames, turn, simulator=Simulator):
+	"""
+	Replays one turn's action phase in simulator, Simulator or a subclass of it. Returns None
+	if the turn has no mobile units.
+	"""
+	action = sorted(frame for t, frame in frames if t == turn and frame >= 0)
+	if not action or action[0] != 0: return None
+	start = frames[(turn, 0)]
+	if not any(start[key][i] for key in ["p1Units", "p2Units"] for i in range(3, 6)): return None
+
+	state = gamelib.GameState(config, json.dumps(start))
+	begin = time.perf_counter()
+	sim = simulator(state)
+	elapsed = time.perf_counter() - begin
+
+	stats = {
+		"frames" : 0,
+		"divergent_frames" : 0,
+		"first_divergence" : None,
+		"position_errors" : 0,
+		"health_error" : 0.0,
+		"max_health_error" : 0.0,
+		"ticks" : 0,
+	}
+	for frame in action[1:]:
+		if has_mobile_units(sim):
+			begin = time.perf_counter()
+			sim.tick()
+			elapsed += time.perf_counter() - begin
+			stats["ticks"] += 1
+		position_errors, health_errors = compare_units(recorded_units(config, frames[(turn, frame)]), simulated_units(sim))
+		stats["frames"] += 1
+		stats["position_errors"] += position_errors
+		stats["health_error"] += sum(health_errors)
+		stats["max_health_error"] = max([stats["max_health_error"]] + health_errors)
+		if position_errors or any(error > HEALTH_TOLERANCE for error in health_errors):
+			stats["divergent_frames"] += 1
+			if stats["first_divergence"] is None:
+				stats["first_divergence"] = frame
+
+	# Simulator may still have units moving once the engine's action phase is over
+	while has_mobile_units(sim) and stats["ticks"] < len(action) - 1 + MAX_EXTRA_TICKS:
+		begin = time.perf_counter()
+		sim.tick()
+		elapsed += time.perf_counter() - begin
+		stats["ticks"] += 1
+
+	stats["length_error"] = stats["ticks"] - (len(action) - 1)
+	stats["seconds"] = elapsed
+	return stats
+
+def check_replays(paths, config, simulator=Simulator):
+	"""
+	Replays every turn of every replay in paths in simulator and returns the divergence and
+	throughput stats.
+	"""
+	turns = []
+	for path in paths:
+		frames = load_replay(path)
+		for turn in sorted({t for t, _ in frames}):
+			stats = check_turn(config, frames, turn, simulator)
+			if stats is not None:
+				turns.append(stats)
+
+	frames = sum(stats["frames"] for stats in turns)
+	ticks = sum(stats["ticks"] for stats in turns)
+	seconds = sum(stats["seconds"] for stats in turns)
+	diverged = [stats["first_divergence"] for stats in turns if stats["first_divergence"] is not None]
+	return {
+		"replays" : len(paths),
+		"turns" : len(turns),
+		"frames" : frames,
+		"divergent_frames" : sum(stats["divergent_frames"] for stats in turns),
+		"divergent_turns" : len(diverged),
+		"mean_first_divergence" : sum(diverged) / len(diverged) if diverged else None,
+		"position_errors" : sum(stats["position_errors"] for stats in turns),
+		"health_error" : sum(stats["health_error"] for stats in turns),
+		"max_health_error" : max([0.0] + [stats["max_health_error"] for stats in turns]),
+		"mean_length_error" : sum(abs(stats["length_error"]) for stats in turns) / len(turns) if turns else 0.0,
+		"ticks" : ticks,
+		"seconds" : seconds,
+		"frames_per_second" : ticks / seconds if seconds else 0.0,
+	}
+
+def find_replays(paths):
+	replays = []
+	for path in paths:
+		if os.path.isdir(path):
+			replays.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".replay"))
+		elif os.path.isfile(path):
+			replays.append(path)
+	return replays
+
+def print_report(report):
+	frames = max(report["frames"], 1)
+	print(f"{report['replays']} replays, {report['turns']} turns with mobile units, {report['frames']} frames")
+	print(f"divergent frames: {report['divergent_frames']} ({100 * report['divergent_frames'] / frames:.1f}%)")
+	first = report["mean_first_divergence"]
+	print(f"divergent turns: {report['divergent_turns']} of {report['turns']}" + (f", first divergence at frame {first:.1f} on average" if first is not None else ""))
+	print(f"position errors: {report['position_errors']} ({report['position_errors'] / frames:.2f} per frame)")
+	print(f"health error: {report['health_error']:.1f} total, {report['health_error'] / frames:.2f} per frame, {report['max_health_error']:.1f} max")
+	print(f"action phase length off by {report['mean_length_error']:.2f} frames on average")
+	print(f"throughput: {report['ticks']} ticks in {report['seconds']:.3f}s, {report['frames_per_second']:.0f} frames/sec")
+
+def main():
+	parser = argparse.ArgumentParser(description="Compare Simulator with recorded replays")
+	parser.add_argument("paths", nargs="*", default=[REPLAY_FOLDER], help=".replay files or folders holding them")
+	parser.add_argument("--config", default=CONFIG_PATH, help="the game config the replays were played with")
+	parser.add_argument("--arena", action="store_true", help="check the arena's ArenaSimulator instead of Simulator")
+	parser.add_argument("--json", action="store_true", help="print the report as JSON")
+	args = parser.parse_args()
+
+	with open(args.config) as f:
+		config = json.load(f)
+	paths = find_replays(args.paths)
+	if not paths:
+		print("No replays found")
+		sys.exit(1)
+
+	simulator = Simulator
+	if args.arena:
+		from arena import ArenaSimulator
+		simulator = ArenaSimulator
+	report = check_replays(paths, config, simulator)
+	if args.json:
+		print(json.dumps(report, indent=2))
+	else:
+		print_report(report)
+
+if __name__ == "__main__":
+	main()
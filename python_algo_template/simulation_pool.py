@@ -0,0 +1,153 @@
+import gamelib
+import json
+import time
+import multiprocessing
+import threading
+from simulator import Simulator
+
+"""
+Opt-in process pool for Optimizer's candidate simulations.
+
+The pool is created once in AlgoStrategy.on_game_start. Every batch of spawn
+candidates is split into contiguous chunks, and each chunk is sent to a worker
+together with a compact copy of the board (one tuple per unit). The worker
+rebuilds the board on its own empty GameState and runs Simulator.simulate_many on
+it, so results come back in the same order a serial run would produce them.
+
+Each batch has a hard deadline, the planner's deadline for the step it belongs to. A
+chunk that has not come back when the deadline passes gets None for each of its
+candidates. The busy workers are then terminated in the background, and the next batch
+starts a fresh pool before it runs, so a turn that is already late never waits for the
+pool to be torn down or started again. If the pool cannot be started, every batch runs
+serially in this process. A chunk that fails in a worker, or that has not come back after
+STALL_TIMEOUT when there is no deadline, is simulated serially in this process, along with
+every chunk after it, and the pool is replaced like a timed out one. AlgoStrategy closes
+the pool when the game ends.
+"""
+
+EMPTY_TURN = json.dumps({
+	"turnInfo" : [0, 0, 0, 0],
+	"p1Stats" : [0, 0, 0, 0],
+	"p2Stats" : [0, 0, 0, 0],
+	"p1Units" : [[] for _ in range(8)],
+	"p2Units" : [[] for _ in range(8)],
+})
+
+# How long a batch without a deadline waits on the pool before taking it to be broken, in seconds
+STALL_TIMEOUT = 30
+
+# Set in each worker by _init_worker
+_worker_state = None
+
+def serialize_board(state : gamelib.GameState):
+	"""
+	Returns every unit on the board as (unit_type, x, y, player_index, health, upgraded, pending_removal),
+	cell by cell in the order the units are stored.
+	"""
+	board = []
+	for (x, y), cell in state.game_map.occupied():
+		for unit in cell:
+			board.append((unit.unit_type, x, y, unit.player_index, unit.health, unit.upgraded, unit.pending_removal))
+	return tuple(board)
+
+def deserialize_board(base : gamelib.GameState, board):
+	state = base.fork()
+	for unit_type, x, y, player_index, health, upgraded, pending_removal in board:
+		state.game_map.add_unit(unit_type, [x, y], player_index)
+		if upgraded:
+			state.game_map.upgrade_unit([x, y])
+		unit = state.game_map[x, y][-1]
+		state.game_map.set_health(unit, health)
+		unit.pending_removal = pending_removal
+	return state
+
+def _init_worker(config):
+	global _worker_state
+	_worker_state = gamelib.GameState(config, EMPTY_TURN)
+
+def _simulate_chunk(board, candidates, deadline):
+	return Simulator.simulate_many(deserialize_board(_worker_state, board), candidates, deadline)
+
+class SimulationPool:
+	def __init__(self, config, workers):
+		self.config = config
+		self.workers = workers
+		self.pool = None
+		self.restart = False # the last batch timed out, the next one needs a fresh pool
+		self.start()
+
+	def start(self):
+		try:
+			self.pool = multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(self.config,))
+		except (OSError, ValueError) as e:
+			gamelib.debug_write(f"Simulation pool unavailable, simulating serially: {e}")
+			self.pool = None
+
+	def close(self):
+		self.restart = False
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool = None
+
+	def retire(self):
+		# The workers may still be busy with skipped chunks. Terminating them waits on every
+		# worker to exit, so that happens on another thread.
+		threading.Thread(target=self.pool.terminate, daemon=True).start()
+		self.pool = None
+		self.restart = True
+
+	def simulate_many(self, state : gamelib.GameState, candidates, deadline=None):
+		"""
+		Same as Simulator.simulate_many, except that candidates which miss the deadline
+		get None instead of a result, even if they were already running.
+		"""
+		if self.restart and candidates:
+			self.restart = False
+			self.start()
+		if self.pool is None or not candidates:
+			return Simulator.simulate_many(state, candidates, deadline)
+		if deadline is not None and time.time() >= deadline:
+			return [None] * len(candidates)
+
+		board = serialize_board(state)
+		size = -(-len(candidates) // (2 * self.workers))
+		chunks = [candidates[i:i + size] for i in range(0, len(candidates), size)]
+		try:
+			pending = [self.pool.apply_async(_simulate_chunk, (board, chunk, deadline)) for chunk in chunks]
+		except ValueError as e: # the pool was closed under us
+			gamelib.debug_write(f"Simulation pool unavailable, simulating serially: {e}")
+			self.pool = None
+			return Simulator.simulate_many(state, candidates, deadline)
+
+		results = [None] * len(chunks) # the results of each chunk, None until it comes back
+		timed_out = False
+		failed = [] # the chunks the pool could not simulate, simulated here instead
+		limit = deadline if deadline is not None else time.time() + STALL_TIMEOUT
+		for i, result in enumerate(pending):
+			if failed:
+				failed.append(i)
+				continue
+			remaining = limit - time.time()
+			if deadline is not None and remaining <= 0:
+				timed_out = True
+				continue
+			try:
+				results[i] = result.get(max(remaining, 0))
+			except multiprocessing.TimeoutError:
+				if deadline is not None:
+					timed_out = True
+				else:
+					gamelib.debug_write(f"Simulation pool stalled for {STALL_TIMEOUT}s, simulating serially")
+					failed.append(i)
+			except Exception as e:
+				gamelib.debug_write(f"Simulation pool failed, simulating serially: {e!r}")
+				failed.append(i)
+
+		if timed_out or failed:
+			self.retire()
+		for i in failed:
+			results[i] = Simulator.simulate_many(state, chunks[i], deadline)
+		results = [result for chunk, chunk_results in zip(chunks, results) for result in (chunk_results if chunk_results is not None else [None] * len(chunk))]
+		if timed_out:
+			gamelib.debug_write(f"Simulation deadline passed, {results.count(None)} of {len(candidates)} candidates skipped")
+		return results
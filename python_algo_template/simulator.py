@@ -6,6 +6,7 @@ from sys import maxsize
 import json
 from gamelib import GameState
 import sys
+import time
 
 """
 Here's my plan.
@@ -89,24 +90,76 @@ COSTS = {
 	"FF" : [2, 2],
 }
 
+# Move directions, as used by gamelib's ShortestPathFinder
+HORIZONTAL = 1
+VERTICAL = 2
+
 class GameUnitData:
-	def __init__(self, unit, id : int, target_edge : list):
+	"""
+	A structure, or a group of mobile units that share a location, type, owner and
+	path. A group moves and is shielded as one: unit stands for every member on the
+	board, healths holds each member's health in ascending order, and unit.health
+	mirrors healths[0]. Members killed by turrets this frame are counted in fallen,
+	they are the first ones in healths.
+	"""
+	def __init__(self, unit, id : int, target_edge : list, healths = None):
 		self.unit = unit
+		self.healths = healths
+		self.fallen = 0
 
 		if unit.unit_type == "EF":
 			self.shields_given = False # list of ids
 
 		self.target_edge = target_edge
 		self.path = []
+		self.move_direction = 0
 
 		self.id = id
 
 	def __hash__(self):
 		return self.id
 
-class Simulator:
+	def set_health(self, game_map, i, health):
+		self.healths[i] = health
+		if i == 0:
+			game_map.set_health(self.unit, health)
+
+	def add_health(self, game_map, amount):
+		self.healths = [health + amount for health in self.healths]
+		game_map.set_health(self.unit, self.healths[0])
+
+class SharedLayout:
+	"""
+	Everything about a board that stays the same for every candidate spawned on it:
+	the occupied cells in warmup scan order and the edge sets. Built once by
+	Simulator.simulate_many, which also indexes the board's attackers and targets so
+	that every fork starts from the same coverage and target indexes.
+	"""
 	def __init__(self, state : gamelib.GameState):
 		self.state = state
+		self.edges = [{(x, y) for x, y in edge} for edge in state.game_map.get_edges()]
+		self.occupied = sorted((x, y) for (x, y), _ in state.game_map.occupied() if x < 27 and y < 27)
+		state.game_map.index_attackers()
+		state.game_map.index_targets()
+
+def spawn_candidate(state : gamelib.GameState, spawns):
+	"""
+	Forks state and spawns a candidate on it. spawns is a list of
+	(unit_type, location, num, player) tuples, optionally followed by extra health
+	given to every unit on that location.
+	"""
+	new_state = state.fork()
+	for unit_type, location, num, player, *bonus in spawns:
+		new_state.unsafe_spawn(unit_type, location, num=num, player=player)
+		for unit in new_state.game_map[location[0], location[1]]:
+			new_state.game_map.set_health(unit, unit.health + sum(bonus))
+	return new_state
+
+class Simulator:
+	def __init__(self, state : gamelib.GameState, shared : SharedLayout = None, spawned = ()):
+		self.state = state
+		self.shared = shared
+		self.spawned = spawned # locations spawned on since the shared layout was built
 		self.PLAYER_DMG = 0
 		self.SP_DESTROYED = 0
 		self.SP_DMG = 0
@@ -115,6 +168,16 @@ class Simulator:
 		self.centers = {"LL" : [2, 12], "L" : [7, 12], "M" : [13.5, 12], "R" : [20, 12], "RR" : [25, 12]}
 		self.warmup()
 
+	def warmup_locations(self):
+		# Units on the last row or column are left out, they stay on the board as they are
+		if self.shared:
+			return sorted(set(self.shared.occupied).union((x, y) for x, y in self.spawned if x < 27 and y < 27))
+		return sorted((x, y) for (x, y), _ in self.state.game_map.occupied() if x < 27 and y < 27)
+
+	def group_key(self, unit):
+		# Mobile units on a location with the same key are simulated as one group, see GameUnitData
+		return (unit.unit_type, unit.player_index)
+
 	def warmup(self):
 		# TODO Parse game state to get GameUnitData. ID each creature.
 
@@ -130,37 +193,49 @@ class Simulator:
 		self.units_teamed = {0:set(), 1:set()}
 
 		id = 0
-		for x in range(27):
-			for y in range(27):
-				location = [x, y]
-				targ = None
-				if any([not unit.stationary for unit in self.state.game_map.get_silent(location)]):
-					targ = self.state.get_target_edge(location)
-					path = self.state.find_path_to_edge(location, target_edge=targ)
-					if len(path) > 0: path = path[1:]
-				for unit in self.state.game_map.get_silent(location):
+		for x, y in self.warmup_locations():
+			location = [x, y]
+			targ = None
+			if any([not unit.stationary for unit in self.state.game_map.get_silent(location)]):
+				targ = self.state.get_target_edge(location)
+				path = self.state.get_path_table(targ).path_from(location)
+				if len(path) > 0: path = path[1:]
+			groups = {}
+			for unit in self.state.game_map.get_silent(location):
+				if not unit.stationary:
+					groups.setdefault(self.group_key(unit), []).append(unit)
+			for unit in self.state.game_map.get_silent(location).copy():
+				if not unit.stationary:
+					members = groups.pop(self.group_key(unit), None)
+					if members is None: continue
+					# Only the first member stays on the board, it stands in for the whole group
+					for member in members[1:]:
+						self.state.game_map.discard_unit(member)
+					obj = GameUnitData(unit, id, targ, sorted(member.health for member in members))
+					self.state.game_map.set_health(unit, obj.healths[0])
+				else:
 					obj = GameUnitData(unit, id, targ)
-					if unit.unit_type == "EF":
-						self.shields.add(obj)
-					elif unit.unit_type == "FF":
-						self.walls.add(obj)
-					elif unit.unit_type == "DF":
-						self.turrets.add(obj)
-					elif unit.unit_type == "PI":
-						self.scouts.add(obj)
-					elif unit.unit_type == "EI":
-						self.demolishers.add(obj)
-					elif unit.unit_type == "SI": 
-						self.interceptors.add(obj)
-
-					self.units_teamed[unit.player_index].add(obj)
-					id += 1
-
-					if not unit.stationary:
-						self.unit_location = (unit.x, unit.y)
-						self.unit_team = unit.player_index
-						self.lowest_health = obj
-						obj.path = path.copy()
+				if unit.unit_type == "EF":
+					self.shields.add(obj)
+				elif unit.unit_type == "FF":
+					self.walls.add(obj)
+				elif unit.unit_type == "DF":
+					self.turrets.add(obj)
+				elif unit.unit_type == "PI":
+					self.scouts.add(obj)
+				elif unit.unit_type == "EI":
+					self.demolishers.add(obj)
+				elif unit.unit_type == "SI": 
+					self.interceptors.add(obj)
+
+				self.units_teamed[unit.player_index].add(obj)
+				id += len(obj.healths) if obj.healths else 1
+
+				if not unit.stationary:
+					self.unit_location = (unit.x, unit.y)
+					self.unit_team = unit.player_index
+					self.lowest_health = obj
+					obj.path = path.copy()
 
 		self.time = 0
 
@@ -171,11 +246,13 @@ class Simulator:
 
 		self.units = self.attacking_units.union(self.shields).union(self.walls).union(self.turrets)
 
+	def get_edge(self, target_edge):
+		if self.shared:
+			return self.shared.edges[target_edge]
+		return [(x, y) for x, y in self.state.game_map.get_edges()[target_edge]]
+
 	def move(self, unit, l1, l2):
-		self.state.game_map[l1[0], l1[1]].remove(unit)
-		self.state.game_map[l2[0], l2[1]].append(unit)
-		unit.x = l2[0]
-		unit.y = l2[1]
+		self.state.game_map.move_unit(unit, l2)
 		self.unit_location = tuple(l2)
 
 	def move_action(self, unit):
@@ -188,22 +265,26 @@ class Simulator:
 		if unit.unit.unit_type != "SI":
 			for field in self.lane_amounts:
 				if (unit.unit.x - self.centers[field][0])**2 + (unit.unit.y - self.centers[field][1])**2 < 25:
-					self.lane_amounts[field] += 1
+					self.lane_amounts[field] += len(unit.healths)
 		if path:
+			unit.move_direction = VERTICAL if loc[0] == path[0] else HORIZONTAL
 			self.move(unit.unit, loc, path)
-		elif loc in [(x, y) for x, y in self.state.game_map.get_edges()[unit.target_edge]]:
-			unit.unit.health = 0
-			self.PLAYER_DMG += 1 if unit.unit.unit_type != "EI" else 2
+			return
+		if loc in self.get_edge(unit.target_edge):
+			self.PLAYER_DMG += (1 if unit.unit.unit_type != "EI" else 2) * len(unit.healths)
 		elif self.time >= 5:
-			hp = unit.unit.health
-			for unit2 in self.units_teamed[1-unit.unit.player_index]:
-				if abs(unit2.unit.x - unit.unit.x) <= 1 and abs(unit2.unit.y - unit.unit.y) <= 1:
-					unit2.health -= hp + (3 if unit.unit.unit_type == "PI" else (10 if unit.unit.unit_type == "SI" else 0))
-					if unit2.stationary:
-						self.SP_DMG += COSTS[unit2.unit_type][unit2.upgraded] * min(hp, unit2.health) / unit2.max_health
-			unit.unit.health = 0
-		else:
-			unit.unit.health = 0
+			bonus = 3 if unit.unit.unit_type == "PI" else (10 if unit.unit.unit_type == "SI" else 0)
+			for hp in unit.healths:
+				for unit2 in self.units_teamed[1-unit.unit.player_index]:
+					if abs(unit2.unit.x - unit.unit.x) <= 1 and abs(unit2.unit.y - unit.unit.y) <= 1:
+						if unit2.healths is not None:
+							unit2.add_health(self.state.game_map, -(hp + bonus))
+							continue
+						self.state.game_map.set_health(unit2.unit, unit2.unit.health - (hp + bonus))
+						if unit2.unit.stationary:
+							self.SP_DMG += COSTS[unit2.unit.unit_type][unit2.unit.upgraded] * min(hp, unit2.unit.health) / unit2.unit.max_health
+		unit.healths = [0] * len(unit.healths)
+		self.state.game_map.set_health(unit.unit, 0)
 
 
 	def tick(self):
@@ -220,7 +301,7 @@ class Simulator:
 			if (abs(self.unit_location[0] - shield.unit.x), abs(self.unit_location[1] - shield.unit.y)) in DISTANCES[shield_range]:
 				shield.shields_given = True
 				for unit in self.attacking_units:
-					unit.unit.health += shield_amount
+					unit.add_health(self.state.game_map, shield_amount)
 
 
 		for scout in self.scouts:
@@ -235,25 +316,32 @@ class Simulator:
 				for interceptor in self.interceptors:
 					self.move_action(interceptor)
 
+		# Every member of a group fires, they all see the same targets
 		target = None
-		for unit in self.attacking_units:
-			if target is None or target.health <= 0:
-				target = self.state.get_target(unit.unit)
+		for unit in sorted(self.attacking_units, key=lambda unit: unit.id):
+			for _ in unit.healths:
+				if target is None or target.health <= 0:
+					target = self.state.get_target(unit.unit)
+				if target is None: break
+				hp = target.health
+				self.state.game_map.set_health(target, hp - unit.unit.damage_f)
+				self.SP_DMG += COSTS[target.unit_type][target.upgraded] * min(hp, unit.unit.damage_f) / target.max_health
 			if target is None: break
-			hp = target.health
-			target.health -= unit.unit.damage_f
-			self.SP_DMG += COSTS[target.unit_type][target.upgraded] * min(hp, unit.unit.damage_f) / target.max_health
 
 		if len(self.attacking_units):
 			for attacker in self.state.get_attackers(self.unit_location, self.unit_team):
-				self.lowest_health.unit.health -= attacker.damage_i
-				if self.lowest_health.unit.health <= 0:
-					self.attacking_units.remove(self.lowest_health)
-					if len(self.attacking_units) == 0:
-						self.lowest_health = None
-						break
-					self.lowest_health = self.attacking_units.pop()
-					self.attacking_units.add(self.lowest_health)
+				victim = self.lowest_health
+				# A group that left the board this frame still takes the shot
+				if victim in self.attacking_units:
+					victim.set_health(self.state.game_map, victim.fallen, victim.healths[victim.fallen] - attacker.damage_i)
+					if victim.healths[victim.fallen] > 0: continue
+					victim.fallen += 1
+					if victim.fallen == len(victim.healths):
+						self.attacking_units.remove(victim)
+				if len(self.attacking_units) == 0:
+					self.lowest_health = None
+					break
+				self.lowest_health = min(self.attacking_units, key=lambda unit: unit.id)
 
 		# units_attacked = set()
 		# places_checked = set()
@@ -277,9 +365,19 @@ class Simulator:
 		# 				if target2: target2.health -= unit.unit.damage_i
 
 
+		self.remove_dead()
+		self.time += 1
+
+	def remove_dead(self):
+		# 0HP DEATH, then every mobile unit paths again if a structure died
 		self.modified = False
 		for unit in self.units.copy():
-			if unit.unit.health <= 0:
+			if unit.healths is not None:
+				unit.healths = [health for health in unit.healths if health > 0]
+				unit.fallen = 0
+				if unit.healths:
+					self.state.game_map.set_health(unit.unit, unit.healths[0])
+			if (unit.unit.health <= 0) if unit.healths is None else not unit.healths:
 				if unit.unit.unit_type in COSTS:
 					self.SP_DESTROYED += COSTS[unit.unit.unit_type][unit.unit.upgraded]
 					self.modified = True
@@ -288,14 +386,25 @@ class Simulator:
 				for S in [self.scouts, self.demolishers, self.interceptors, self.shields, self.turrets, self.walls, self.attacking_units, self.units_teamed[0], self.units_teamed[1], self.units]:
 					if unit in S:
 						S.remove(unit)
-				self.state.game_map[unit.unit.x, unit.unit.y].remove(unit.unit)
+				self.state.game_map.discard_unit(unit.unit)
 
-		self.time += 1
+		if self.modified:
+			self.repath()
+
+	def repath(self):
+		# A structure died, so every mobile unit paths again from where it stands, keeping its last move direction
+		paths = {}
+		for unit in self.scouts.union(self.demolishers).union(self.interceptors):
+			key = (unit.unit.x, unit.unit.y, unit.target_edge, unit.move_direction)
+			if key not in paths:
+				path = self.state.get_path_table(unit.target_edge).path_from([unit.unit.x, unit.unit.y], unit.move_direction)
+				paths[key] = path[1:]
+			unit.path = paths[key].copy()
 
 	def __str__(self):
 		s = f"{self.PLAYER_DMG} {self.SP_DESTROYED} {self.SP_DMG} {self.unit_location} {self.unit_team}\n" 
 		for unit in self.units:
-			s += f"\t{str(unit.unit)}\n"
+			s += f"\t{str(unit.unit)}\n" if unit.healths is None else f"\t{len(unit.healths)} x {str(unit.unit)}\n"
 		return s
 
 	def simulate(self):
@@ -306,6 +415,24 @@ class Simulator:
 			self.tick()
 		return (self.PLAYER_DMG, self.SP_DESTROYED, self.SP_DMG, self.PATH_LOCATIONS, max(self.lane_amounts, key = self.lane_amounts.get), self.lane_amounts)
 
+	@staticmethod
+	def simulate_many(state : gamelib.GameState, candidates, deadline = None):
+		"""
+		Simulates every candidate (a list of spawns, see spawn_candidate) on its own fork
+		of state and returns one simulate() result per candidate. The board layout and
+		edge sets are worked out once and shared by all of them. Candidates that have not
+		been started when time.time() reaches deadline get None.
+		"""
+		shared = SharedLayout(state)
+		results = []
+		for spawns in candidates:
+			if deadline is not None and time.time() >= deadline:
+				results.append(None)
+				continue
+			new_state = spawn_candidate(state, spawns)
+			results.append(Simulator(new_state, shared, [location for _, location, _, _, *_ in spawns]).simulate())
+		return results
+
 	# def convert(self, unit):
 	# 	print(unit, [str(i.unit) for i in self.units])
 	# 	for unit_2 in self.units:
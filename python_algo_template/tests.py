@@ -0,0 +1,384 @@
+import gamelib
+import contextlib
+import io
+import itertools
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+import simulation_pool
+import benchmark
+import replay_check
+import simulator
+import algo_strategy
+from algo_strategy import AlgoStrategy
+from arena import Arena
+from simulation_pool import SimulationPool
+from simulator import Simulator, spawn_candidate
+from optimizer import board_snapshot, Optimizer, DANGER_RADIUS, SPAWNING_LOCATIONS, ENEMY_SPAWNING_LOCATIONS
+
+"""
+Tests for the simulation code around gamelib, on the turns of benchmark_turns.txt.
+gamelib has its own tests in gamelib/tests.py.
+
+Usage, from this directory:
+	python -m unittest tests
+"""
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(HERE, "..", "game-configs.json")
+CORPUS_PATH = os.path.join(HERE, "benchmark_turns.txt")
+HPARAMS_PATH = os.path.join(HERE, "..", "best_hyperparameters.json")
+
+def load_config():
+	with open(CONFIG_PATH) as f:
+		return json.load(f)
+
+def load_hparams():
+	with open(HPARAMS_PATH) as f:
+		return json.load(f)
+
+def load_turns():
+	with open(CORPUS_PATH) as f:
+		return [line.strip() for line in f if line.strip()]
+
+def attack_candidates(state, num):
+	"""A swarm from every free spawn location on either side, the candidates optimize_offense and compute_danger try"""
+	candidates = []
+	for locations, player in [(SPAWNING_LOCATIONS, 0), (ENEMY_SPAWNING_LOCATIONS, 1)]:
+		for location in locations:
+			if not state.contains_stationary_unit(location):
+				candidates.append([("PI", location, num, player)])
+	return candidates
+
+def _failing_chunk(board, candidates, deadline):
+	raise RuntimeError("worker failed")
+
+class SimulateManyTests(unittest.TestCase):
+	def test_simulate_many_matches_single_runs(self):
+		config = load_config()
+		for turn in load_turns():
+			state = gamelib.GameState(config, turn)
+			state.suppress_warnings(True)
+			before = board_snapshot(state)
+			candidates = attack_candidates(state, 6)
+			# A candidate with two spawns, as optimize_offense tries
+			if not state.contains_stationary_unit([13, 0]) and not state.contains_stationary_unit([14, 0]):
+				candidates.append([("PI", [13, 0], 4, 0), ("EI", [14, 0], 2, 0)])
+			with contextlib.redirect_stderr(io.StringIO()):
+				single = [Simulator(spawn_candidate(state, spawns)).simulate() for spawns in candidates]
+				self.assertEqual(single, Simulator.simulate_many(state, candidates), "A shared layout should simulate like a fresh Simulator")
+			self.assertEqual(before, board_snapshot(state), "simulate_many should leave the board it is given as it was")
+
+class DeadlineTests(unittest.TestCase):
+	def setUp(self):
+		self.config = load_config()
+		self.state = gamelib.GameState(self.config, load_turns()[1])
+		self.state.suppress_warnings(True)
+		self.candidates = attack_candidates(self.state, 5)
+		self.serial = Simulator.simulate_many(self.state, self.candidates)
+
+	def clock(self):
+		# A time.time for simulator that moves on a second every time it is read, from 0
+		return mock.patch.object(simulator, "time", mock.Mock(time=mock.Mock(side_effect=itertools.count())))
+
+	def test_past_deadline(self):
+		self.assertEqual([None] * len(self.candidates), Simulator.simulate_many(self.state, self.candidates, time.time() - 1))
+		optimizer = Optimizer(self.state, load_hparams(), deadline=time.time() - 1)
+		with contextlib.redirect_stderr(io.StringIO()):
+			self.assertEqual((None, None), optimizer.optimize_offense(), "No attack should be planned without results")
+			self.assertEqual((0, set(), []), optimizer.compute_danger(self.state, 8), "No danger should be found without results")
+
+	def test_partial_results(self):
+		with self.clock():
+			results = Simulator.simulate_many(self.state, self.candidates, 3)
+		self.assertEqual(self.serial[:3] + [None] * (len(self.candidates) - 3), results, "Candidates started before the deadline should be simulated in full")
+
+	def test_first_candidates_simulated_first(self):
+		optimizer = Optimizer(self.state, load_hparams(), deadline=2)
+		with self.clock(), contextlib.redirect_stderr(io.StringIO()):
+			results = optimizer.simulate_many(self.state, self.candidates, first=[5, 9])
+		expected = [None] * len(self.candidates)
+		expected[5], expected[9] = self.serial[5], self.serial[9]
+		self.assertEqual(expected, results, "The hinted candidates should be simulated before the others")
+
+	def test_turn_submitted_after_deadline(self):
+		hparams = dict(load_hparams(), parallel_workers=0, turn_budget=0)
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+			strategy = AlgoStrategy()
+			strategy.on_game_start(self.config, hparams)
+			strategy.on_turn(load_turns()[1])
+			strategy.on_game_end()
+		build, deploy = [json.loads(line) for line in output.getvalue().splitlines()]
+		self.assertIsInstance(build, list)
+		self.assertIsInstance(deploy, list)
+
+def frame_of(config, turn, frame, units, stats):
+	"""A replay frame holding units, given as replay_check.recorded_units returns them"""
+	type_index = {unit["shorthand"] : i for i, unit in enumerate(config["unitInformation"])}
+	lists = [[[] for _ in range(8)], [[] for _ in range(8)]]
+	for (player_index, unit_type, x, y), healths in sorted(units.items()):
+		for health in healths:
+			lists[player_index][type_index[unit_type]].append([x, y, health, ""])
+	return dict(stats, p1Units=lists[0], p2Units=lists[1], turnInfo=[1, turn, frame, 0])
+
+class ReplayCheckTests(unittest.TestCase):
+	def setUp(self):
+		self.config = load_config()
+		start = json.loads(load_turns()[1])
+		# Two swarms of different health on one location, so that healths are compared in order
+		start["p1Units"][3] = [[13, 0, 15.0, ""]] * 3 + [[13, 0, 12.0, ""]] * 2
+		self.stats = {key : start[key] for key in ["p1Stats", "p2Stats", "events"]}
+		state = gamelib.GameState(self.config, json.dumps(start))
+		state.suppress_warnings(True)
+		# A replay Simulator itself would have recorded, turn 5 of a game
+		sim = Simulator(state)
+		self.frames = [dict(start, turnInfo=[1, 5, 0, 0])]
+		while replay_check.has_mobile_units(sim):
+			sim.tick()
+			self.frames.append(frame_of(self.config, 5, len(self.frames), replay_check.simulated_units(sim), self.stats))
+
+	def check(self, frames):
+		with tempfile.TemporaryDirectory() as folder:
+			path = os.path.join(folder, "game.replay")
+			with open(path, "w") as f:
+				f.write(json.dumps({"debug" : {}}) + "\n\n")
+				for frame in frames:
+					f.write(json.dumps(frame) + "\n")
+			return replay_check.check_replays(replay_check.find_replays([folder]), self.config)
+
+	def test_recorded_by_simulator(self):
+		report = self.check(self.frames)
+		self.assertEqual((1, 1, len(self.frames) - 1), (report["replays"], report["turns"], report["frames"]))
+		self.assertEqual(0, report["divergent_frames"])
+		self.assertEqual(0, report["position_errors"])
+		self.assertEqual(0.0, report["max_health_error"])
+		self.assertEqual(0.0, report["mean_length_error"])
+		self.assertEqual(len(self.frames) - 1, report["ticks"])
+
+	def test_divergence(self):
+		frames = json.loads(json.dumps(self.frames))
+		frames[3]["p1Units"][3][-1][0] += 1 # a position error, counted on both locations
+		frames[4]["p1Units"][3][0][2] -= 4 # a health error
+		report = self.check(frames[:-2])
+		self.assertEqual(1, report["divergent_turns"])
+		self.assertEqual(3, report["mean_first_divergence"])
+		self.assertEqual(2, report["divergent_frames"])
+		self.assertEqual(2, report["position_errors"])
+		self.assertAlmostEqual(4.0, report["max_health_error"])
+		self.assertEqual(2, report["mean_length_error"], "The simulator should have run on past the recorded frames")
+
+	def test_recorded_units(self):
+		frame = self.frames[0]
+		frame["p1Units"][6].append([13, 0, 0.0, ""]) # a removal is not a unit
+		frame["p1Units"][4].append([13, 1, 0.0, ""]) # nor is a dead demolisher
+		units = replay_check.recorded_units(self.config, frame)
+		self.assertEqual([12.0, 12.0, 15.0, 15.0, 15.0], units[0, "PI", 13, 0])
+		self.assertNotIn((0, "EI", 13, 1), units)
+		self.assertEqual((0, [3.0]), replay_check.compare_units({(0, "PI", 1, 1) : [5.0]}, {(0, "PI", 1, 1) : [8.0]}))
+		self.assertEqual((2, []), replay_check.compare_units({(0, "PI", 1, 1) : [5.0, 5.0]}, {}))
+
+class BenchmarkTests(unittest.TestCase):
+	def test_percentile(self):
+		samples = list(range(1, 101))
+		self.assertEqual([1, 50, 90, 99, 100], [benchmark.percentile(samples, q) for q in [0, 50, 90, 99, 100]])
+		self.assertEqual([7, 7, 7], [benchmark.percentile([7], q) for q in benchmark.PERCENTILES])
+		self.assertEqual([2, 4, 4], [benchmark.percentile([1, 2, 3, 4], q) for q in benchmark.PERCENTILES], "Nearest rank rounds up")
+
+	def test_summarize(self):
+		summary = benchmark.summarize([0.003, 0.001, 0.002])
+		self.assertEqual(3, summary["calls"])
+		self.assertAlmostEqual(2.0, summary["p50"])
+		self.assertAlmostEqual(3.0, summary["p99"])
+		self.assertAlmostEqual(2.0, summary["mean"])
+
+	def test_regressions(self):
+		def report(**medians):
+			return {"benchmarks" : {name : {"p50" : p50} for name, p50 in medians.items()}}
+		baseline = report(parse=1.0, simulate=2.0, danger=10.0)
+		self.assertEqual([("simulate", 2.5, 2.0)], benchmark.regressions(report(parse=1.1, simulate=2.5, on_turn=50.0), baseline, 0.2), "Only a median more than 20% slower is a regression, and only against a benchmark in the baseline")
+		self.assertEqual([], benchmark.regressions(report(parse=0.5, danger=12.0), baseline, 0.2))
+
+	def test_run(self):
+		config = load_config()
+		turns = load_turns()[:2]
+		report = benchmark.run(config, load_hparams(), turns, 2, ["parse", "pathfinding"])
+		self.assertEqual(["parse", "pathfinding"], list(report["benchmarks"]))
+		self.assertEqual(4, report["benchmarks"]["parse"]["calls"], "parse should be timed once per turn and repeat")
+		spawns = sum(not gamelib.GameState(config, turn).contains_stationary_unit(location) for turn in turns for location in ENEMY_SPAWNING_LOCATIONS)
+		self.assertEqual(2 * spawns, report["benchmarks"]["pathfinding"]["calls"], "pathfinding should be timed from every free enemy spawn location")
+
+	def test_corpus_with_replays(self):
+		with tempfile.TemporaryDirectory() as folder:
+			path = os.path.join(folder, "game.replay")
+			with open(path, "w") as f:
+				for turn, frame in [(1, -1), (1, 0), (1, 1), (2, -1)]:
+					f.write(json.dumps({"turnInfo" : [0 if frame == -1 else 1, turn, frame, 0]}) + "\n")
+			corpus = benchmark.load_corpus(CORPUS_PATH, [path])
+		self.assertEqual(load_turns(), corpus[:-2])
+		self.assertEqual([[0, 1, -1, 0], [0, 2, -1, 0]], [json.loads(turn)["turnInfo"] for turn in corpus[-2:]], "Only the deploy phase frames should be added")
+
+class UngroupedSimulator(Simulator):
+	# Every mobile unit is a group of its own
+	def group_key(self, unit):
+		return id(unit)
+
+class GroupingTests(unittest.TestCase):
+	def test_groups_match_separate_units(self):
+		config = load_config()
+		for turn in load_turns():
+			state = gamelib.GameState(config, turn)
+			state.suppress_warnings(True)
+			# The same board with an upgraded support, so that groups get shielded
+			supported = state.fork()
+			for location in [[13, 3], [14, 3], [13, 2]]:
+				if not supported.contains_stationary_unit(location):
+					supported.unsafe_spawn("EF", location)
+					supported.unsafe_upgrade(location)
+					break
+			for board in [state, supported]:
+				for unit_type, num in [("PI", 1), ("PI", 7), ("EI", 4), ("SI", 3)]:
+					for location in SPAWNING_LOCATIONS[::3]:
+						if board.contains_stationary_unit(location): continue
+						spawns = [(unit_type, location, num, 0)]
+						# Interceptors outlast simulate's 100 tick warning, which is not what is tested here
+						with contextlib.redirect_stderr(io.StringIO()):
+							grouped = Simulator(spawn_candidate(board, spawns)).simulate()
+							separate = UngroupedSimulator(spawn_candidate(board, spawns)).simulate()
+						self.assertEqual(separate, grouped, f"{num} {unit_type} at {location} should play out the same as a group")
+
+class SimulationPoolTests(unittest.TestCase):
+	def setUp(self):
+		self.config = load_config()
+		self.pool = SimulationPool(self.config, 2)
+
+	def tearDown(self):
+		self.pool.close()
+
+	def test_pool_matches_serial(self):
+		for turn in load_turns():
+			state = gamelib.GameState(self.config, turn)
+			state.suppress_warnings(True)
+			candidates = attack_candidates(state, 5)
+			self.assertEqual(Simulator.simulate_many(state, candidates), self.pool.simulate_many(state, candidates), "The pool should simulate like a serial run")
+
+	def test_failed_pool_simulates_serially(self):
+		state = gamelib.GameState(self.config, load_turns()[1])
+		state.suppress_warnings(True)
+		candidates = attack_candidates(state, 5)
+		serial = Simulator.simulate_many(state, candidates)
+		with mock.patch.object(simulation_pool, "_simulate_chunk", _failing_chunk):
+			self.assertEqual(serial, self.pool.simulate_many(state, candidates), "Chunks that fail in a worker should be simulated serially")
+		self.assertTrue(self.pool.restart, "A failed pool should be replaced before the next batch")
+		self.assertEqual(serial, self.pool.simulate_many(state, candidates), "The replacement pool should simulate like a serial run")
+		self.assertIsNotNone(self.pool.pool, "The next batch should have started a new pool")
+
+class DangerMemoTests(unittest.TestCase):
+	def distance_to_paths(self, optimizer, cell):
+		paths = [entry[2] for entry in optimizer.danger_memo.values() if entry[2] is not None]
+		return min((cell[0] - x)**2 + (cell[1] - y)**2 for path in paths for x, y in path)
+
+	def test_memo_matches_fresh_optimizer(self):
+		config = load_config()
+		hparams = load_hparams()
+		reused = 0
+		for turn in load_turns():
+			state = gamelib.GameState(config, turn)
+			state.suppress_warnings(True)
+			optimizer = Optimizer(state, hparams)
+			num = 8
+			self.assertEqual(optimizer.compute_danger(state, num), Optimizer(state, hparams).compute_danger(state, num))
+
+			free = [[x, y] for x in range(28) for y in range(14) if state.game_map.in_arena_bounds([x, y]) and not state.contains_stationary_unit([x, y])]
+			near = min(free, key=lambda cell: self.distance_to_paths(optimizer, cell))
+			far = max(free, key=lambda cell: self.distance_to_paths(optimizer, cell))
+			for cell, unit_type in [(far, "DF"), (near, "DF"), (far, "FF")]:
+				if state.contains_stationary_unit(cell): continue
+				state.game_map.add_unit(unit_type, cell, 0)
+				with mock.patch.object(Optimizer, "simulate_many", wraps=optimizer.simulate_many) as simulate_many:
+					danger = optimizer.compute_danger(state, num)
+				simulated = sum(len(call.args[1]) for call in simulate_many.call_args_list)
+				reused += len([loc for loc in ENEMY_SPAWNING_LOCATIONS if not state.contains_stationary_unit(loc)]) - simulated
+				self.assertEqual(danger, Optimizer(state, hparams).compute_danger(state, num), f"Memoized danger should match a fresh optimizer after a {unit_type} at {cell}")
+		self.assertGreater(reused, 0, "Structures far from every path should let results be reused")
+
+class HparamsTests(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.folder.name, "individual.json")
+		with open(self.path, "w") as f:
+			json.dump({"minscouts" : 7}, f)
+		# No hyperparameters.json next to the algo unless a test puts one there
+		patcher = mock.patch.object(algo_strategy, "HPARAMS_FILE", os.path.join(self.folder.name, "hyperparameters.json"))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def load(self, value=None):
+		with mock.patch.dict(os.environ):
+			os.environ.pop(algo_strategy.HPARAMS_ENV, None)
+			if value is not None:
+				os.environ[algo_strategy.HPARAMS_ENV] = value
+			return algo_strategy.load_hparams()
+
+	def test_json_in_environment(self):
+		self.assertEqual({"minscouts" : 3, "best" : 1.5}, self.load(' {"minscouts": 3, "best": 1.5}\n'))
+
+	def test_path_in_environment(self):
+		self.assertEqual({"minscouts" : 7}, self.load(self.path))
+		with self.assertRaises(FileNotFoundError, msg="A missing file named in the environment should not be ignored"):
+			self.load(os.path.join(self.folder.name, "missing.json"))
+
+	def test_file_next_to_algo(self):
+		self.assertEqual({}, self.load(), "Without the variable or the file there are no hyperparameters")
+		os.rename(self.path, algo_strategy.HPARAMS_FILE)
+		self.assertEqual({"minscouts" : 7}, self.load())
+		self.assertEqual({"minscouts" : 3}, self.load('{"minscouts": 3}'), "The variable should win over the file")
+
+class ArenaTests(unittest.TestCase):
+	def setUp(self):
+		self.config = load_config()
+		hparams = load_hparams()
+		self.arena = Arena(self.config, hparams, hparams, max_turns=0)
+
+	def test_turn_accounting(self):
+		# Player 1 sends 3 scouts across an empty board, player 2 removes a damaged wall
+		arena = self.arena
+		arena.state.game_map.add_unit("FF", [0, 14], 1)
+		wall = arena.state.game_map[0, 14][0]
+		arena.state.game_map.set_health(wall, 32)
+		arena.apply(0, arena.turn_string(0), [], [["PI", 13, 0]] * 3)
+		arena.apply(1, arena.turn_string(1), [["RM", 27, 13]], [])
+		self.assertEqual(arena.MP, [2, 5], "Spawning should cost the scouts' MP")
+		self.assertTrue(wall.pending_removal, "The removal should be made on player 2's own view of the board")
+
+		expected_MP = []
+		for player_index in [0, 1]:
+			state = gamelib.GameState(self.config, arena.turn_string(player_index))
+			expected_MP.append(state.project_future_MP(1))
+		sim = arena.action_phase()
+		arena.end_turn(sim)
+
+		self.assertEqual(sim.damage, [3, 0], "Every scout should breach")
+		self.assertEqual(arena.health, [30, 27], "Each breach should take a health point")
+		self.assertEqual(arena.SP, [48, 46.2], "Player 1 gets 40 + 3 for breaches + 5, player 2 40 + 0.75 * 2 * 32/40 + 5")
+		self.assertEqual(arena.MP, expected_MP, "MP should decay and grow the way GameState.project_future_MP says")
+		self.assertEqual(list(arena.state.game_map.occupied()), [], "The removed wall and the scouts should be off the board")
+		self.assertEqual(arena.turn, 1)
+
+	def test_tie_break(self):
+		# As in the engine, a tie in health goes to the player who computed for less time
+		self.arena.compute_time = [2.0, 1.0]
+		self.assertEqual(self.arena.play(), 2)
+		self.arena.compute_time = [1.0, 2.0]
+		self.assertEqual(self.arena.play(), 1)
+		self.arena.health = [10, 20]
+		self.assertEqual(self.arena.play(), 2, "Health decides before time")
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,81 @@
+import os
+import json
+import hashlib
+from typing import Dict, Optional, Tuple
+
+"""
+Keeps the winners of engine games between hyperparameter sets, so a search never plays the
+same matchup twice, in one tournament, across generations or across runs.
+
+A matchup is keyed by a hash of both players' hyperparameters, written as canonical JSON,
+and of the algo's code version, a hash of the files that decide how it plays. Changing the
+algo or the game config starts a fresh set of results without deleting the old ones. The two
+players are put in a fixed order before hashing, so a matchup found with its sides swapped
+is reused with its winner swapped too. Engine games are not deterministic, the first result
+of a matchup is the one kept.
+
+Results are appended to RESULTS_PATH as they come in, one JSON line each, so an interrupted
+search keeps every game it finished.
+"""
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_PATH = os.path.join(ROOT, 'match_results.jsonl')
+ALGO_FOLDER = os.path.join(ROOT, 'python_algo_template')
+# Files in the algo folder that never run in a game
+ALGO_TOOLS = ['arena.py', 'benchmark.py', 'old_algo_strategy.py', 'replay_check.py', 'test.py', 'tests.py']
+
+def canonical(params: Dict) -> str:
+    return json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+def code_version(algo: str = ALGO_FOLDER) -> str:
+    """Hashes the algo's Python files and the game config"""
+    paths = [os.path.join(ROOT, 'game-configs.json')]
+    for folder in [algo, os.path.join(algo, 'gamelib')]:
+        paths.extend(os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                     if name.endswith('.py') and name not in ALGO_TOOLS)
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.relpath(path, ROOT).replace(os.sep, '/').encode())
+        with open(path, 'rb') as f:
+            # Line endings differ between checkouts, not between versions
+            digest.update(f.read().replace(b'\r\n', b'\n'))
+    return digest.hexdigest()[:16]
+
+class ResultCache:
+    def __init__(self, path: str = RESULTS_PATH, version: Optional[str] = None):
+        self.path = path
+        self.version = version or code_version()
+        self.winners = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A search stopped halfway through writing its last result
+                        continue
+                    self.winners[entry['key']] = entry['winner']
+
+    def key(self, params1: Dict, params2: Dict) -> Tuple[str, bool]:
+        """Returns the matchup's key and whether its players were swapped to make it"""
+        first, second = canonical(params1), canonical(params2)
+        swapped = second < first
+        if swapped:
+            first, second = second, first
+        return hashlib.sha256('\n'.join([self.version, first, second]).encode()).hexdigest(), swapped
+
+    def get(self, params1: Dict, params2: Dict) -> Optional[int]:
+        """Returns the winner, 1 or 2, of params1 (player 1) against params2, None if they have not played"""
+        key, swapped = self.key(params1, params2)
+        winner = self.winners.get(key)
+        if winner is None or not swapped:
+            return winner
+        return 3 - winner
+
+    def put(self, params1: Dict, params2: Dict, winner: int):
+        key, swapped = self.key(params1, params2)
+        if key in self.winners:
+            return
+        self.winners[key] = 3 - winner if swapped else winner
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'key': key, 'version': self.version, 'winner': self.winners[key]}) + '\n')
@@ -0,0 +1,47 @@
+import subprocess
+import shutil
+import platform
+import os
+
+from os import path
+
+"""
+Builds the pathcore library and copies it into the Python algo's gamelib, where
+gamelib/native_path.py loads it. Without it the Python algo paths in pure Python.
+"""
+
+def library_name():
+    if platform.system() == 'Windows':
+        return 'pathcore.dll'
+    if platform.system() == 'Darwin':
+        return 'libpathcore.dylib'
+    return 'libpathcore.so'
+
+def compile_pathcore(destination=path.join('..', 'python_algo_template', 'gamelib')):
+    # pathcore has no dependencies, so it builds offline and outside of the workspace
+    command = ['cargo', 'build', '--release', '--offline']
+    print("running: {}".format(command))
+    try:
+        subprocess.check_output(command, cwd='pathcore')
+    except (OSError, subprocess.CalledProcessError) as e:
+        print("cargo failed: {}".format(e))
+        return False
+
+    library = path.join('pathcore', 'target', 'release', library_name())
+    move_to = path.join(destination, library_name())
+    print("copying {} to {}".format(library, move_to))
+    shutil.copy(library, move_to)
+    print("copied")
+
+    return True
+
+
+if __name__ == '__main__':
+    abspath = os.path.abspath(__file__)
+    dname = os.path.dirname(abspath)
+    os.chdir(dname)
+
+    result = compile_pathcore()
+
+    if not result:
+        print("!--build failure--!")
@@ -0,0 +1,366 @@
+//! A native pathfinding core for the Python algo's `gamelib/native_path.py`.
+//!
+//! It finds single paths and builds the tables of `PathTable`, following the rules of
+//! `ShortestPathFinder` and `PathTable` in `gamelib/navigation.py` rather than the
+//! `algo` crate's `pathfinding` module, whose tie breaks differ, so that the Python algo
+//! paths the same way whether or not this library is built. Locations are passed as flat
+//! indexes, `x * 28 + y`, and the blocked cells as a bitmap with bit `x * 28 + y` set for
+//! every location holding a structure.
+
+use std::{collections::VecDeque, slice};
+
+const BOARD_SIZE: i32 = 28;
+const CELLS: usize = (BOARD_SIZE * BOARD_SIZE) as usize;
+
+const HORIZONTAL: i32 = 1;
+const VERTICAL: i32 = 2;
+
+/// The result of `pathcore_find_path` when the start location is blocked.
+pub const START_BLOCKED: isize = -1;
+/// The result of `pathcore_find_path` when the path does not fit in the output buffer.
+pub const PATH_TOO_LONG: isize = -2;
+/// The result of `pathcore_find_path` when it is given an end point off the board or a start off the grid.
+pub const OFF_BOARD: isize = -3;
+
+/// The ideal tile `pathcore_build_table` gives the locations of a pocket that reaches the edge.
+pub const REACHES_EDGE: i32 = -2;
+/// The ideal tile `pathcore_build_table` gives blocked and off board locations.
+pub const NO_POCKET: i32 = -1;
+
+fn in_arena(x: i32, y: i32) -> bool {
+    // abs(x - 13.5) + abs(y - 13.5) <= 14, doubled to stay in integers
+    (2 * x - 27).abs() + (2 * y - 27).abs() <= 28
+}
+
+fn index(x: i32, y: i32) -> usize {
+    (x * BOARD_SIZE + y) as usize
+}
+
+/// The on board neighbors of a location, in the order `ShortestPathFinder._get_neighbors` lists them.
+fn neighbors(x: i32, y: i32) -> impl Iterator<Item = (i32, i32)> {
+    [(x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y)]
+        .into_iter()
+        .filter(|&(nx, ny)| in_arena(nx, ny))
+}
+
+struct Search<'a> {
+    blocked: &'a [bool; CELLS],
+    end_points: &'a [(i32, i32)],
+    is_end_point: [bool; CELLS],
+    direction: (i32, i32),
+    pathlength: [i32; CELLS],
+}
+
+impl<'a> Search<'a> {
+    fn new(blocked: &'a [bool; CELLS], end_points: &'a [(i32, i32)]) -> Self {
+        let (x, y) = end_points[0];
+        let mut is_end_point = [false; CELLS];
+        for &(x, y) in end_points {
+            is_end_point[index(x, y)] = true;
+        }
+        Search {
+            blocked,
+            end_points,
+            is_end_point,
+            direction: (if x < BOARD_SIZE / 2 { -1 } else { 1 }, if y < BOARD_SIZE / 2 { -1 } else { 1 }),
+            pathlength: [-1; CELLS],
+        }
+    }
+
+    fn idealness(&self, x: i32, y: i32) -> u64 {
+        if self.is_end_point[index(x, y)] {
+            return u64::MAX;
+        }
+        let row = if self.direction.1 == 1 { y } else { BOARD_SIZE - 1 - y };
+        let column = if self.direction.0 == 1 { x } else { BOARD_SIZE - 1 - x };
+        (BOARD_SIZE * row + column) as u64
+    }
+
+    /// `ShortestPathFinder._idealness_search`, the most ideal tile of the start's pocket.
+    fn idealness_search(&self, start: (i32, i32)) -> (i32, i32) {
+        let mut visited = [false; CELLS];
+        let mut queue = VecDeque::with_capacity(CELLS);
+        queue.push_back(start);
+        visited[index(start.0, start.1)] = true;
+        let mut best_idealness = self.idealness(start.0, start.1);
+        let mut most_ideal = start;
+
+        while let Some((x, y)) = queue.pop_front() {
+            for (nx, ny) in neighbors(x, y) {
+                if self.blocked[index(nx, ny)] || visited[index(nx, ny)] {
+                    continue;
+                }
+                visited[index(nx, ny)] = true;
+                let idealness = self.idealness(nx, ny);
+                if idealness > best_idealness {
+                    best_idealness = idealness;
+                    most_ideal = (nx, ny);
+                }
+                queue.push_back((nx, ny));
+            }
+        }
+        most_ideal
+    }
+
+    /// `ShortestPathFinder._validate`, the pathlength of every tile toward the ideal tile or the whole edge.
+    fn validate(&mut self, ideal_tile: (i32, i32)) {
+        let mut queue = VecDeque::with_capacity(CELLS);
+        if self.is_end_point[index(ideal_tile.0, ideal_tile.1)] {
+            queue.extend(self.end_points.iter().cloned());
+        } else {
+            queue.push_back(ideal_tile);
+        }
+        for &(x, y) in queue.iter() {
+            self.pathlength[index(x, y)] = 0;
+        }
+
+        while let Some((x, y)) = queue.pop_front() {
+            // Blocked end points are queued too, but nothing paths through them
+            if self.blocked[index(x, y)] {
+                continue;
+            }
+            let length = self.pathlength[index(x, y)] + 1;
+            for (nx, ny) in neighbors(x, y) {
+                if self.pathlength[index(nx, ny)] == -1 && !self.blocked[index(nx, ny)] {
+                    self.pathlength[index(nx, ny)] = length;
+                    queue.push_back((nx, ny));
+                }
+            }
+        }
+    }
+
+    /// `ShortestPathFinder._better_direction`
+    fn better_direction(&self, previous: (i32, i32), new: (i32, i32), best: (i32, i32), previous_direction: i32) -> bool {
+        if previous_direction == HORIZONTAL && new.0 != best.0 {
+            return previous.1 != new.1;
+        }
+        if previous_direction == VERTICAL && new.1 != best.1 {
+            return previous.0 != new.0;
+        }
+        if previous_direction == 0 {
+            return previous.1 != new.1;
+        }
+        if new.1 == best.1 {
+            return if self.direction.0 == 1 { new.0 > best.0 } else { new.0 < best.0 };
+        }
+        if new.0 == best.0 {
+            return if self.direction.1 == 1 { new.1 > best.1 } else { new.1 < best.1 };
+        }
+        true
+    }
+
+    /// `ShortestPathFinder._choose_next_move`
+    fn next_move(&self, current: (i32, i32), previous_direction: i32) -> (i32, i32) {
+        let mut best = current;
+        let mut best_pathlength = self.pathlength[index(current.0, current.1)];
+        for (nx, ny) in neighbors(current.0, current.1) {
+            if self.blocked[index(nx, ny)] {
+                continue;
+            }
+            let pathlength = self.pathlength[index(nx, ny)];
+            if pathlength > best_pathlength {
+                continue;
+            }
+            if pathlength == best_pathlength && !self.better_direction(current, (nx, ny), best, previous_direction) {
+                continue;
+            }
+            best = (nx, ny);
+            best_pathlength = pathlength;
+        }
+        best
+    }
+}
+
+/// Reads the 98 byte little endian bitmap of the locations holding structures.
+unsafe fn read_walls(blocked: *const u8) -> [bool; CELLS] {
+    let bitmap = slice::from_raw_parts(blocked, (CELLS + 7) / 8);
+    let mut walls = [false; CELLS];
+    for (i, wall) in walls.iter_mut().enumerate() {
+        *wall = bitmap[i / 8] >> (i % 8) & 1 == 1;
+    }
+    walls
+}
+
+/// Reads `num_end_points` flat indexes, or returns `None` if one is off the board.
+unsafe fn read_end_points(end_points: *const i32, num_end_points: usize) -> Option<Vec<(i32, i32)>> {
+    let mut ends = Vec::with_capacity(num_end_points);
+    for &end in slice::from_raw_parts(end_points, num_end_points) {
+        let (x, y) = (end / BOARD_SIZE, end % BOARD_SIZE);
+        if end < 0 || !in_arena(x, y) {
+            return None;
+        }
+        ends.push((x, y));
+    }
+    Some(ends)
+}
+
+/// Finds the path a unit at `start` takes toward `end_points`, like `ShortestPathFinder.navigate_multiple_endpoints`.
+///
+/// `blocked` points to a 98 byte little endian bitmap of the locations holding structures, `end_points`
+/// to `num_end_points` flat indexes and `path` to room for `capacity` flat indexes. `initial_direction`
+/// is the unit's last move, 1 for horizontal, 2 for vertical or 0 if it has not moved.
+///
+/// Returns the number of locations written to `path`, starting with `start`, or one of
+/// `START_BLOCKED`, `PATH_TOO_LONG` and `OFF_BOARD`.
+///
+/// # Safety
+///
+/// The pointers must be valid for the lengths given above.
+#[no_mangle]
+pub unsafe extern "C" fn pathcore_find_path(
+    blocked: *const u8,
+    end_points: *const i32,
+    num_end_points: usize,
+    start: i32,
+    initial_direction: i32,
+    path: *mut i32,
+    capacity: usize,
+) -> isize {
+    let walls = read_walls(blocked);
+    let ends = match read_end_points(end_points, num_end_points) {
+        Some(ends) => ends,
+        None => return OFF_BOARD,
+    };
+    // Like ShortestPathFinder, a start off the diamond is allowed as long as it is on the grid
+    if ends.is_empty() || start < 0 || start as usize >= CELLS {
+        return OFF_BOARD;
+    }
+    let start = (start / BOARD_SIZE, start % BOARD_SIZE);
+    if walls[index(start.0, start.1)] {
+        return START_BLOCKED;
+    }
+
+    let mut search = Search::new(&walls, &ends);
+    let ideal_tile = search.idealness_search(start);
+    search.validate(ideal_tile);
+
+    let out = slice::from_raw_parts_mut(path, capacity);
+    let mut length = 0;
+    let mut current = start;
+    let mut direction = initial_direction;
+    loop {
+        if length == capacity {
+            return PATH_TOO_LONG;
+        }
+        out[length] = current.0 * BOARD_SIZE + current.1;
+        length += 1;
+        if search.pathlength[index(current.0, current.1)] == 0 {
+            return length as isize;
+        }
+        let next = search.next_move(current, direction);
+        direction = if next.0 == current.0 { VERTICAL } else { HORIZONTAL };
+        current = next;
+    }
+}
+
+/// `PathTable._validate`, a breadth first search from `sources` over the locations with no pathlength yet.
+/// Returns the locations it reached.
+fn spread(walls: &[bool; CELLS], pathlengths: &mut [i32], sources: &[usize]) -> Vec<usize> {
+    let mut frontier = sources.to_vec();
+    for &tile in sources {
+        pathlengths[tile] = 0;
+    }
+    let mut head = 0;
+    while head < frontier.len() {
+        let tile = frontier[head];
+        head += 1;
+        // Blocked end points are sources too, but nothing paths through them
+        if walls[tile] {
+            continue;
+        }
+        let length = pathlengths[tile] + 1;
+        let (x, y) = (tile as i32 / BOARD_SIZE, tile as i32 % BOARD_SIZE);
+        for (nx, ny) in neighbors(x, y) {
+            let neighbor = index(nx, ny);
+            if pathlengths[neighbor] == -1 && !walls[neighbor] {
+                pathlengths[neighbor] = length;
+                frontier.push(neighbor);
+            }
+        }
+    }
+    frontier
+}
+
+/// Builds the tables of a `PathTable` toward `end_points`, like `PathTable.__init__`.
+///
+/// `blocked` and `end_points` are as for `pathcore_find_path`. `pathlengths` and `ideal_tiles` point to
+/// room for one entry per location, by flat index. Every location gets its distance to the ideal tile of
+/// its pocket, -1 where there is none, and the flat index of that ideal tile, `REACHES_EDGE` if the
+/// pocket reaches the edge or `NO_POCKET` where the location is blocked or off the board.
+///
+/// Returns 0, or `OFF_BOARD` if an end point is off the board or there are none.
+///
+/// # Safety
+///
+/// The pointers must be valid for the lengths given above.
+#[no_mangle]
+pub unsafe extern "C" fn pathcore_build_table(
+    blocked: *const u8,
+    end_points: *const i32,
+    num_end_points: usize,
+    pathlengths: *mut i32,
+    ideal_tiles: *mut i32,
+) -> isize {
+    let walls = read_walls(blocked);
+    let ends = match read_end_points(end_points, num_end_points) {
+        Some(ends) => ends,
+        None => return OFF_BOARD,
+    };
+    if ends.is_empty() {
+        return OFF_BOARD;
+    }
+    let pathlengths = slice::from_raw_parts_mut(pathlengths, CELLS);
+    let ideal_tiles = slice::from_raw_parts_mut(ideal_tiles, CELLS);
+    pathlengths.fill(-1);
+    ideal_tiles.fill(NO_POCKET);
+
+    // Every pocket holding a free end point reaches the edge
+    let mut sources = Vec::with_capacity(ends.len());
+    for &(x, y) in &ends {
+        if !sources.contains(&index(x, y)) {
+            sources.push(index(x, y));
+        }
+    }
+    for tile in spread(&walls, pathlengths, &sources) {
+        if !walls[tile] {
+            ideal_tiles[tile] = REACHES_EDGE;
+        }
+    }
+
+    // Every other pocket paths to its most ideal tile, which is unique as no two tiles are equally ideal
+    let (ex, ey) = ends[0];
+    let direction = (if ex < BOARD_SIZE / 2 { -1 } else { 1 }, if ey < BOARD_SIZE / 2 { -1 } else { 1 });
+    let idealness = |tile: usize| {
+        let (x, y) = (tile as i32 / BOARD_SIZE, tile as i32 % BOARD_SIZE);
+        let row = if direction.1 == 1 { y } else { BOARD_SIZE - 1 - y };
+        let column = if direction.0 == 1 { x } else { BOARD_SIZE - 1 - x };
+        BOARD_SIZE * row + column
+    };
+    let mut seen = [false; CELLS];
+    for start in 0..CELLS {
+        let (x, y) = (start as i32 / BOARD_SIZE, start as i32 % BOARD_SIZE);
+        if !in_arena(x, y) || walls[start] || ideal_tiles[start] != NO_POCKET {
+            continue;
+        }
+        let mut pocket = vec![start];
+        seen[start] = true;
+        let mut head = 0;
+        while head < pocket.len() {
+            let (x, y) = (pocket[head] as i32 / BOARD_SIZE, pocket[head] as i32 % BOARD_SIZE);
+            for (nx, ny) in neighbors(x, y) {
+                let neighbor = index(nx, ny);
+                if !walls[neighbor] && !seen[neighbor] {
+                    seen[neighbor] = true;
+                    pocket.push(neighbor);
+                }
+            }
+            head += 1;
+        }
+        let ideal = *pocket.iter().max_by_key(|&&tile| idealness(tile)).unwrap();
+        spread(&walls, pathlengths, &[ideal]);
+        for &tile in &pocket {
+            ideal_tiles[tile] = ideal as i32;
+        }
+    }
+    0
+}
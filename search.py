@@ -1,11 +1,13 @@
 import random
 import json
-import subprocess
 import os
-import shutil
-import time
 from typing import List, Dict, Tuple
 from collections import Counter
+import itertools
+from match_scheduler import run_matches
+
+# Every individual plays from this folder, with its hyperparameters in a file of its own
+TEMPLATE = 'python_algo_template'
 
 BASE_PARAMS = {
     "best": 5,
@@ -30,52 +32,27 @@ def generate_random_params() -> Dict:
     params["min_attack_mp"] = random.randint(5, 15)
     return params
 
-def create_algo_folder(params: Dict, folder_name: str):
-    os.makedirs(folder_name, exist_ok=True)
-    shutil.copytree('python_algo_template', folder_name, dirs_exist_ok=True)
-    with open(f'{folder_name}/algo_strategy.py', 'r') as f:
-        content = f.read()
-    content = content.replace('self.hparams = {}', f'self.hparams = {json.dumps(params, indent=4)}')
-    with open(f'{folder_name}/algo_strategy.py', 'w') as f:
-        f.write(content)
-
-def run_game(algo1: str, algo2: str) -> int:
-    # Remove old replay files
-    for file in os.listdir('replays'):
-        os.remove(os.path.join('replays', file))
-    
-    # Run the game
-    subprocess.run(['python3', 'scripts/run_match.py', algo1, algo2], check=True)
-    
-    # Wait for the replay file to be generated
-    timeout = 60  # Adjust this value based on how long games typically take
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        replay_files = os.listdir('replays')
-        if replay_files:
-            # Wait a bit more to ensure the file is fully written
-            time.sleep(5)
-            replay_file = max(replay_files, key=lambda f: os.path.getctime(os.path.join('replays', f)))
-            with open(os.path.join('replays', replay_file), 'r') as f:
-                content = f.read()
-            return 2 if '"winner":2' in content else 1
-        time.sleep(1)  # Check every second
-    
-    raise TimeoutError("Game did not complete within the expected time")
+def write_hparams(params: Dict, path: str):
+    # Read by the algo at startup, the template folder itself is never copied
+    with open(path, 'w') as f:
+        json.dump(params, f, indent=4)
 
 def tournament(population: List[Dict], tournament_size: int = 5) -> Dict:
     tournament = random.sample(population, tournament_size)
-    winners = []
-    for i in range(len(tournament)):
-        for j in range(i+1, len(tournament)):
-            algo1 = f'temp_algo_{i}'
-            algo2 = f'temp_algo_{j}'
-            create_algo_folder(tournament[i], algo1)
-            create_algo_folder(tournament[j], algo2)
-            winner = run_game(algo1, algo2)
-            winners.append(i if winner == 1 else j)
-            shutil.rmtree(algo1)
-            shutil.rmtree(algo2)
+    algos = [f'temp_algo_{i}' for i in range(len(tournament))]
+    players = [(TEMPLATE, f'{algo}.json') for algo in algos]
+    for params, (_, path) in zip(tournament, players):
+        write_hparams(params, path)
+    pairs = list(itertools.combinations(range(len(tournament)), 2))
+    try:
+        results = run_matches([(players[i], players[j]) for i, j in pairs])
+    finally:
+        for _, path in players:
+            os.remove(path)
+    # Games that failed have no winner and count for neither player
+    winners = [i if winner == 1 else j for (i, j), winner in zip(pairs, results) if winner is not None]
+    if not winners:
+        raise RuntimeError("Every game of the tournament failed, see the matches folder")
     winner_index = Counter(winners).most_common(1)[0][0]
     return tournament[winner_index]
 
@@ -1,14 +1,24 @@
 import random
 import json
-import subprocess
 import os
+import sys
 import shutil
-import time
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 from collections import Counter
 from tqdm import tqdm
+from match_scheduler import run_matches
+from result_cache import ResultCache
 import itertools
 
+# Every individual plays from this folder, with its hyperparameters in a file of its own
+TEMPLATE = 'python_algo_template'
+
+# The arena runs the algo in this process, importing its modules the way the algo does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), TEMPLATE))
+
+# Seconds per turn for each strategy in arena games, screening trades planning time for speed
+ARENA_TURN_BUDGET = 1.0
+
 BASE_PARAMS = {
     "best": 8,
     "minscouts": 13,
@@ -56,80 +66,73 @@ def generate_random_params() -> Dict:
     params["starting_wall_y2"] = random.randint(12, 14)
     return params
 
-def create_algo_folder(params: Dict, folder_name: str):
-    os.makedirs(folder_name, exist_ok=True)
-    shutil.copytree('python_algo_template', folder_name, dirs_exist_ok=True)
-    with open(f'{folder_name}/algo_strategy.py', 'r') as f:
-        content = f.read()
-    content = content.replace('self.hparams = {}', f'self.hparams = {json.dumps(params, indent=4)}')
-    with open(f'{folder_name}/algo_strategy.py', 'w') as f:
-        f.write(content)
-    
-    # Save hyperparameters in a separate file
-    with open(f'{folder_name}/hyperparameters.json', 'w') as f:
+def write_hparams(params: Dict, path: str):
+    # Read by the algo at startup, the template folder itself is never copied
+    with open(path, 'w') as f:
         json.dump(params, f, indent=4)
 
-def run_game(algo1: str, algo2: str) -> int:
-    # Clear the replays folder
-    replays_folder = 'replays'
-    if os.path.exists(replays_folder):
-        for file in os.listdir(replays_folder):
-            file_path = os.path.join(replays_folder, file)
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
-    else:
-        os.makedirs(replays_folder)
-
-    replay_dir = f'completed_replays_{algo1}_{algo2}'
-    os.makedirs(replay_dir, exist_ok=True)
-    
-    # Copy hyperparameters to the replay directory
-    shutil.copy(f'{algo1}/hyperparameters.json', f'{replay_dir}/{algo1}_hyperparameters.json')
-    shutil.copy(f'{algo2}/hyperparameters.json', f'{replay_dir}/{algo2}_hyperparameters.json')
-    
-    # Run the game
-    subprocess.run(['python', 'scripts/run_match.py', algo1, algo2], check=True)
-    
-    # Wait for the replay file to be generated
-    timeout = 60  # Adjust this value based on how long games typically take
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        replay_files = [f for f in os.listdir(replays_folder) if f.endswith('.replay')]
-        if replay_files:
-            # Wait a bit more to ensure the file is fully written
-            time.sleep(5)
-            replay_file = max(replay_files, key=lambda f: os.path.getctime(os.path.join(replays_folder, f)))
-            source_path = os.path.join(replays_folder, replay_file)
-            destination_path = os.path.join(replay_dir, replay_file)
-            shutil.move(source_path, destination_path)
-            with open(destination_path, 'rb') as f:
-                content = f.read().decode('utf-8', errors='ignore')
-            return 2 if '"winner":2' in content else 1
-        time.sleep(1)  # Check every second
-    
-    raise TimeoutError("Game did not complete within the expected time")
-
 def tournament(population: List[Dict]) -> List[Tuple[Dict, int]]:
     tournament_size = len(population)
-    total_games = (tournament_size * (tournament_size - 1)) // 2
     wins = [0] * tournament_size
-    
-    with tqdm(total=total_games, desc="Tournament Progress", leave=False) as pbar:
-        for i, j in itertools.combinations(range(tournament_size), 2):
-            algo1 = f'temp_algo_{i}'
-            algo2 = f'temp_algo_{j}'
-            create_algo_folder(population[i], algo1)
-            create_algo_folder(population[j], algo2)
-            winner = run_game(algo1, algo2)
+    algos = [f'temp_algo_{i}' for i in range(tournament_size)]
+    players = [(TEMPLATE, f'{algo}.json') for algo in algos]
+    for params, (_, path) in zip(population, players):
+        write_hparams(params, path)
+
+    # Only matchups no earlier game has decided are played, each of them once
+    cache = ResultCache()
+    all_pairs = list(itertools.combinations(range(tournament_size), 2))
+    unplayed = {}
+    for i, j in all_pairs:
+        if cache.get(population[i], population[j]) is None:
+            unplayed.setdefault(cache.key(population[i], population[j])[0], (i, j))
+    pairs = list(unplayed.values())
+    print(f"Reusing {len(all_pairs) - len(pairs)} of {len(all_pairs)} results, playing {len(pairs)} games")
+
+    replay_dirs = [f'completed_replays_{algos[i]}_{algos[j]}' for i, j in pairs]
+    for (i, j), replay_dir in zip(pairs, replay_dirs):
+        # Copy hyperparameters to the replay directory
+        os.makedirs(replay_dir, exist_ok=True)
+        shutil.copy(players[i][1], f'{replay_dir}/{algos[i]}_hyperparameters.json')
+        shutil.copy(players[j][1], f'{replay_dir}/{algos[j]}_hyperparameters.json')
+
+    def on_result(index: int, winner: int):
+        i, j = pairs[index]
+        cache.put(population[i], population[j], winner)
+        pbar.update(1)
+
+    try:
+        with tqdm(total=len(pairs), desc="Tournament Progress", leave=False) as pbar:
+            run_matches([(players[i], players[j]) for i, j in pairs], replay_dirs=replay_dirs, on_result=on_result)
+    finally:
+        # Clean up the hyperparameter files once every game is over
+        for _, path in players:
+            os.remove(path)
+
+    for i, j in all_pairs:
+        winner = cache.get(population[i], population[j])
+        # Games that failed have no winner and count for neither player
+        if winner is not None:
             wins[i if winner == 1 else j] += 1
-            pbar.update(1)
-            
-            # Clean up temporary folders after each game
-            shutil.rmtree(algo1)
-            shutil.rmtree(algo2)
-    
     return list(zip(population, wins))
 
+def screen(population: List[Dict], promote: int) -> List[Dict]:
+    """
+    Ranks the population by its wins in an arena round robin, played in process without the
+    engine, and returns the promote best of it for the engine tournament.
+    """
+    import arena
+    with open('game-configs.json') as f:
+        config = json.load(f)
+    pairs = list(itertools.combinations(range(len(population)), 2))
+    print(f"Screening {len(population)} individuals in {len(pairs)} arena games...")
+    winners = arena.play_many(config, [(population[i], population[j]) for i, j in pairs], turn_budget=ARENA_TURN_BUDGET)
+    wins = [0] * len(population)
+    for (i, j), winner in zip(pairs, winners):
+        wins[i if winner == 1 else j] += 1
+    ranked = sorted(range(len(population)), key=lambda i: wins[i], reverse=True)
+    return [population[i] for i in ranked[:promote]]
+
 def crossover(parent1: Dict, parent2: Dict) -> Dict:
     child = {}
     for key in parent1.keys():
@@ -153,7 +156,8 @@ def mutate(individual: Dict, mutation_rate: float = 0.1) -> Dict:
                     new_individual[key] = min(13, new_individual[key]) # Ensure within bounds
     return new_individual
 
-def genetic_algorithm(population_size: int = 20, generations: int = 10) -> Dict:
+def genetic_algorithm(population_size: int = 20, generations: int = 10, promote: Optional[int] = None) -> Dict:
+    # With promote set, only the promote best individuals of an arena screening play engine games
     population = [generate_random_params() for _ in range(population_size)]
     
     for generation in range(generations):
@@ -161,7 +165,8 @@ def genetic_algorithm(population_size: int = 20, generations: int = 10) -> Dict:
         print(f"Generation {generation + 1}/{generations}")
         
         # Run tournament
-        results = tournament(population)
+        candidates = screen(population, promote) if promote and promote < len(population) else population
+        results = tournament(candidates)
         
         # Sort results by number of wins
         results.sort(key=lambda x: x[1], reverse=True)
@@ -189,7 +194,8 @@ def genetic_algorithm(population_size: int = 20, generations: int = 10) -> Dict:
     
     # Final tournament to determine the overall best
     print("Running final tournament...")
-    final_results = tournament(population)
+    candidates = screen(population, promote) if promote and promote < len(population) else population
+    final_results = tournament(candidates)
     final_results.sort(key=lambda x: x[1], reverse=True)
     best_params, best_wins = final_results[0]
     
@@ -198,10 +204,11 @@ def genetic_algorithm(population_size: int = 20, generations: int = 10) -> Dict:
 if __name__ == "__main__":
     population_size = 5
     generations = 2
+    promote = None  # e.g. 3, to screen each population in the arena before the engine tournament
 
     print(f"Starting genetic algorithm with population size {population_size} and {generations} generations.")
 
-    best_params = genetic_algorithm(population_size, generations)
+    best_params = genetic_algorithm(population_size, generations, promote)
     
     print("Best hyperparameters found:")
     print(json.dumps(best_params, indent=4))
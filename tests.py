@@ -0,0 +1,107 @@
+import json
+import os
+import tempfile
+import unittest
+import result_cache
+from match_scheduler import ReplayWatcher
+from result_cache import ResultCache
+
+"""
+Tests for the scripts that run the hyperparameter searches. The algo has its own tests in
+python_algo_template/tests.py and gamelib in python_algo_template/gamelib/tests.py.
+
+Usage, from this directory:
+    python -m unittest tests
+"""
+
+END_STATS = json.dumps({'endStats': {'winner': 2, 'turns': 40}})
+
+class ReplayWatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.watcher = ReplayWatcher(self.folder.name)
+        self.path = os.path.join(self.folder.name, 'game.replay')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write(self, text: str):
+        with open(self.path, 'a', newline='') as f:
+            f.write(text)
+
+    def test_no_replay_yet(self):
+        self.assertIsNone(self.watcher.poll())
+
+    def test_end_stats_written_in_parts(self):
+        self.write(json.dumps({'debug': {}}) + '\n' + json.dumps({'turnInfo': [0, 0, -1, 0]}) + '\n')
+        self.assertIsNone(self.watcher.poll())
+        # The engine flushes the endStats line part way through
+        self.write(END_STATS[:20])
+        self.assertIsNone(self.watcher.poll(), 'A truncated endStats line should not count')
+        self.write(END_STATS[20:-1])
+        self.assertIsNone(self.watcher.poll())
+        self.write(END_STATS[-1:])
+        self.assertEqual(END_STATS, self.watcher.poll(), 'The last line is whole once it parses, even without a newline')
+        self.write('\n')
+        self.assertEqual(END_STATS, self.watcher.poll())
+
+    def test_end_stats_after_newline(self):
+        self.write(json.dumps({'turnInfo': [0, 0, -1, 0]}) + '\n' + END_STATS + '\n')
+        self.assertEqual(END_STATS, self.watcher.poll())
+        self.assertEqual(self.watcher.offset, os.path.getsize(self.path), 'The watcher should read every byte once')
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'results.jsonl')
+        self.a = {'minscouts': 5, 'best': 1.5}
+        self.b = {'best': 2.0, 'minscouts': 3}
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_swapped_players(self):
+        cache = ResultCache(self.path, 'v1')
+        self.assertIsNone(cache.get(self.a, self.b))
+        cache.put(self.a, self.b, 2)
+        self.assertEqual(2, cache.get(self.a, self.b))
+        self.assertEqual(1, cache.get(self.b, self.a), 'The winner should flip with the sides')
+        cache.put(self.b, self.a, 2)
+        self.assertEqual(2, cache.get(self.a, self.b), 'The first result of a matchup should be kept')
+        # Key order in the hyperparameters does not matter
+        self.assertEqual(2, cache.get(dict(reversed(list(self.a.items()))), self.b))
+
+    def test_reloaded(self):
+        cache = ResultCache(self.path, 'v1')
+        cache.put(self.b, self.a, 1)
+        cache.put(self.a, self.a, 1)
+        with open(self.path, 'a') as f:
+            f.write('{"key": "abc", "win')
+        reloaded = ResultCache(self.path, 'v1')
+        self.assertEqual(2, reloaded.get(self.a, self.b), 'Results should survive a restart, with a half-written line skipped')
+        self.assertEqual(1, reloaded.get(self.a, self.a))
+
+    def test_version_change(self):
+        ResultCache(self.path, 'v1').put(self.a, self.b, 1)
+        self.assertIsNone(ResultCache(self.path, 'v2').get(self.a, self.b), 'Another code version should start fresh')
+        self.assertEqual(1, ResultCache(self.path, 'v1').get(self.a, self.b), 'The old results should be kept')
+
+    def test_code_version(self):
+        with tempfile.TemporaryDirectory() as algo:
+            os.makedirs(os.path.join(algo, 'gamelib'))
+            def write(name: str, text: str):
+                with open(os.path.join(algo, name), 'w', newline='') as f:
+                    f.write(text)
+            write('algo_strategy.py', 'x = 1\n')
+            write(os.path.join('gamelib', 'util.py'), 'y = 2\n')
+            version = result_cache.code_version(algo)
+            write('benchmark.py', 'z = 3\n')
+            write('notes.txt', 'not code\n')
+            self.assertEqual(version, result_cache.code_version(algo), 'Tools and other files should not change the version')
+            write('algo_strategy.py', 'x = 1\r\n')
+            self.assertEqual(version, result_cache.code_version(algo), 'Line endings should not change the version')
+            write(os.path.join('gamelib', 'util.py'), 'y = 3\n')
+            self.assertNotEqual(version, result_cache.code_version(algo), 'Changing gamelib should change the version')
+
+if __name__ == '__main__':
+    unittest.main()